@@ -0,0 +1,38 @@
+"""
+Stats, streaks and plot data for an athlete's history, computed once as pure
+functions over the typed activity table from columns.frame. Only NumPy and
+pandas are imported here, so the web app and the command line share it
+without pulling in Flask or matplotlib:
+
+    python -m analytics --db activities.db --athlete 123 stats streaks
+    python -m analytics.batch exports/ --out club.parquet
+"""
+from .aggregates import RunningStats, StatsRegistry
+from .columns import ActivityTable, frame
+from .plot_data import (PLOT_DATA, average_speed_over_time, distance_over_time, pace_histogram,
+                        time_series, weekday_counts)
+from .rollups import PERIODS, Rollups, rollup
+from .stats import activity_streaks, format_stats, longest_activity_streak, running_stats
+
+
+# Every analysis by name. Each takes the activity table plus keyword options
+# and returns JSON-ready data
+ANALYSES = {
+    'stats': running_stats,
+    'streaks': activity_streaks,
+    'paces': pace_histogram,
+    'runs_by_weekday': weekday_counts,
+    'average_speed_over_time': average_speed_over_time,
+    'distance_over_time': distance_over_time,
+    'rollups': rollup,
+}
+
+
+def register(name, fn):
+    """Adds an analysis under `name`, for compute() and the command line."""
+    ANALYSES[name] = fn
+    return fn
+
+
+def compute(name, df, **options):
+    return ANALYSES[name](df, **options)
@@ -0,0 +1,39 @@
+"""
+Runs analyses over a stored or exported activity history and prints them as JSON.
+
+    python -m analytics --db activities.db --athlete 123 stats streaks
+    python -m analytics --json activities.json paces
+"""
+import argparse
+import json
+import sys
+
+from . import ANALYSES, compute, frame
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--db', help="activity store written by the web app")
+    source.add_argument('--json', help="file holding a list of Strava activities")
+    parser.add_argument('--athlete', type=int, help="athlete id to read from --db")
+    parser.add_argument('analyses', nargs='*', choices=list(ANALYSES), default=['stats', 'streaks'])
+    args = parser.parse_args()
+
+    if args.db:
+        if args.athlete is None:
+            parser.error("--db needs --athlete")
+        # Imported here so --json works outside the backend directory
+        from store import ActivityStore
+        activities = ActivityStore(args.db).load(args.athlete)
+    else:
+        with open(args.json) as f:
+            activities = json.load(f)
+
+    df = frame(activities)
+    json.dump({name: compute(name, df) for name in args.analyses}, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
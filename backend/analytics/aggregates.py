@@ -0,0 +1,257 @@
+import heapq
+import math
+import threading
+from collections import Counter, OrderedDict
+from datetime import date, datetime
+from fractions import Fraction
+
+from .stats import format_stats
+
+
+class Extremum:
+    """Max (or min) of a multiset that also supports removals: a heap with lazy deletion."""
+
+    def __init__(self, largest=True):
+        self.sign = -1 if largest else 1
+        self.heap = []
+        self.live = Counter()
+        # Live values counting repeats, i.e. what the heap would hold without stale entries
+        self.size = 0
+
+    def add(self, value):
+        self.live[value] += 1
+        self.size += 1
+        heapq.heappush(self.heap, self.sign * value)
+
+    def remove(self, value):
+        self.live[value] -= 1
+        self.size -= 1
+        if self.live[value] <= 0:
+            del self.live[value]
+        # Rebuild once stale entries dominate so the heap stays O(live values)
+        if len(self.heap) > 2 * self.size + 16:
+            self.heap = [self.sign * value for value in self.live for _ in range(self.live[value])]
+            heapq.heapify(self.heap)
+
+    def value(self, default):
+        while self.heap and self.sign * self.heap[0] not in self.live:
+            heapq.heappop(self.heap)
+        return self.sign * self.heap[0] if self.heap else default
+
+
+class StreakTracker:
+    """Consecutive-day intervals over the days with at least one activity, kept up to date per day added or removed."""
+
+    def __init__(self):
+        self.days = Counter()
+        self.starts = {}
+        self.ends = {}
+        self.lengths = Extremum()
+        self.last = Extremum()
+
+    def add(self, day):
+        self.days[day] += 1
+        if self.days[day] > 1:
+            return
+        self.last.add(day)
+        start = end = day
+        if day - 1 in self.ends:
+            start = self.ends.pop(day - 1)
+            del self.starts[start]
+            self.lengths.remove(day - start)
+        if day + 1 in self.starts:
+            end = self.starts.pop(day + 1)
+            del self.ends[end]
+            self.lengths.remove(end - day)
+        self.starts[start] = end
+        self.ends[end] = start
+        self.lengths.add(end - start + 1)
+
+    def remove(self, day):
+        self.days[day] -= 1
+        if self.days[day] > 0:
+            return
+        del self.days[day]
+        self.last.remove(day)
+        start = day
+        while start not in self.starts:
+            start -= 1
+        end = self.starts.pop(start)
+        del self.ends[end]
+        self.lengths.remove(end - start + 1)
+        # Split what is left of the interval around the removed day
+        for left, right in ((start, day - 1), (day + 1, end)):
+            if left <= right:
+                self.starts[left] = right
+                self.ends[right] = left
+                self.lengths.add(right - left + 1)
+
+    def longest(self) -> int:
+        return self.lengths.value(0)
+
+    def current(self) -> int:
+        """Length of the streak ending on the latest activity day."""
+        last = self.last.value(None)
+        return last - self.ends[last] + 1 if last is not None else 0
+
+    def last_date(self):
+        last = self.last.value(None)
+        return date.fromordinal(last) if last is not None else None
+
+
+def number(value):
+    return None if value is None or (isinstance(value, float) and math.isnan(value)) else value
+
+
+def day_ordinal(start_date):
+    if not start_date:
+        return None
+    # Same UTC calendar day as pd.to_datetime(start_date).dt.date
+    return datetime.fromisoformat(str(start_date).replace('Z', '+00:00')).date().toordinal()
+
+
+class RunningStats:
+    """
+    Incrementally maintained running_stats for one athlete. Each activity's
+    contribution is remembered so it can be retracted when the activity is
+    deleted or changes (e.g. its type), and adding or removing k activities
+    costs O(k log n) rather than a pass over the whole history.
+    """
+
+    def __init__(self, activities=()):
+        self.records = {}
+        self.total_runs = 0
+        # Exact sums, so retractions never leave rounding residue behind
+        self.total_distance = Fraction(0)
+        self.total_time_moving = Fraction(0)
+        self.total_elevation_gain = Fraction(0)
+        self.fastest_speed = Extremum()
+        self.farthest_run = Extremum()
+        self.shortest_run = Extremum(largest=False)
+        self.max_altitude = Extremum()
+        self.streaks = StreakTracker()
+        self.add(activities)
+
+    def add(self, activities):
+        """Adds new activities; ones already counted are replaced by their new version."""
+        for activity in activities:
+            activity_id = activity['id']
+            if activity_id in self.records:
+                self.retract(self.records.pop(activity_id))
+            record = (activity.get('type') == 'Run',
+                      number(activity.get('distance')),
+                      number(activity.get('moving_time')),
+                      number(activity.get('total_elevation_gain')),
+                      number(activity.get('max_speed')),
+                      number(activity.get('elev_high')),
+                      day_ordinal(activity.get('start_date')))
+            self.records[activity_id] = record
+            self.apply(record, 1)
+
+    def remove(self, activity_ids):
+        for activity_id in activity_ids:
+            record = self.records.pop(activity_id, None)
+            if record is not None:
+                self.retract(record)
+
+    def retract(self, record):
+        self.apply(record, -1)
+
+    def apply(self, record, sign):
+        is_run, distance, moving_time, elevation_gain, max_speed, elev_high, day = record
+        if day is not None:
+            # The streak counts every activity type, like longest_activity_streak
+            self.streaks.add(day) if sign > 0 else self.streaks.remove(day)
+        if not is_run:
+            return
+        self.total_runs += sign
+        for total, value in (('total_distance', distance), ('total_time_moving', moving_time),
+                             ('total_elevation_gain', elevation_gain)):
+            if value is not None:
+                setattr(self, total, getattr(self, total) + sign * Fraction(value))
+        for extremum, value in ((self.fastest_speed, max_speed), (self.farthest_run, distance),
+                                (self.shortest_run, distance), (self.max_altitude, elev_high)):
+            if value is not None:
+                extremum.add(value) if sign > 0 else extremum.remove(value)
+
+    def result(self) -> dict:
+        return format_stats(
+            self.total_runs,
+            self.total_distance,
+            self.total_time_moving,
+            self.total_elevation_gain,
+            max(0, self.fastest_speed.value(0)),
+            max(0, self.farthest_run.value(0)),
+            min(float("inf"), self.shortest_run.value(float("inf"))),
+            max(0, self.max_altitude.value(0)),
+            self.streaks.longest(),
+        )
+
+
+class StatsRegistry:
+    """
+    RunningStats (or another incremental aggregate built by `factory`) per
+    athlete, tagged with the activity store revision they reflect. When the
+    store moved by exactly the delta we were handed, only that delta is
+    applied; when it is further behind, the rows written since are; only
+    athletes never seen (or evicted) are rebuilt from scratch. At most `size`
+    athletes are kept, least recently used first out. Read results through
+    result(), since reading an Extremum prunes its heap.
+    """
+
+    def __init__(self, factory=RunningStats, size=1000):
+        self.factory = factory
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def update(self, athlete_id, base_revision, revision, delta, load, changes=None):
+        """
+        :param athlete_id:
+        :param base_revision: store revision before `delta` was merged
+        :param revision: store revision after the merge, as the merge reported
+            it; anything but base_revision + 1 means other writes may be
+            missing from `delta`
+        :param delta: the activities that were merged
+        :param load: returns the athlete's full history, used when rebuilding
+        :param changes: called with the revision a cached aggregate reflects,
+            returns the activities written since and the revision they bring
+            it to; used instead of `load` when the aggregate is merely behind
+        :return: the athlete's aggregate
+        """
+        with self.lock:
+            entry = self.entries.get(athlete_id)
+            if entry is not None:
+                self.entries.move_to_end(athlete_id)
+                if entry[0] == revision:
+                    return entry[1]
+                if entry[0] == base_revision and revision == base_revision + 1:
+                    entry[1].add(delta)
+                    self.entries[athlete_id] = (revision, entry[1])
+                    return entry[1]
+        if entry is not None and changes is not None and entry[0] < revision:
+            missed, current = changes(entry[0])
+            with self.lock:
+                # Unless another update replaced it meanwhile; then rebuild below
+                if self.entries.get(athlete_id) is entry:
+                    # Adding replaces activities already counted, so overlap with what is in there is harmless
+                    entry[1].add(missed)
+                    self.entries[athlete_id] = (current, entry[1])
+                    return entry[1]
+        aggregate = self.factory(load())
+        with self.lock:
+            self.entries[athlete_id] = (revision, aggregate)
+            self.entries.move_to_end(athlete_id)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return aggregate
+
+    def result(self, aggregate, *args, **kwargs):
+        """aggregate.result(...), under the lock updates are applied with."""
+        with self.lock:
+            return aggregate.result(*args, **kwargs)
+
+    def get(self, athlete_id):
+        with self.lock:
+            entry = self.entries.get(athlete_id)
+        return entry[1] if entry else None
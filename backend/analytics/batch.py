@@ -0,0 +1,174 @@
+"""
+Offline club reports: running stats, streaks and plot data for many athletes'
+activity exports at once, spread over a process pool. Reads nothing but the
+exports, so it needs no network or Strava credentials.
+
+    python -m analytics.batch exports/ --out club.parquet --plot-data club_plots.csv
+
+Every export is one athlete's history as fetch_activities returns it: a JSON
+list of activities, or NDJSON with one activity (or one page of activities)
+per line. Parquet output needs pyarrow.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+
+import pandas as pd
+
+from .columns import frame
+from .plot_data import pace_histogram, time_series, weekday_counts
+from .stats import activity_streaks, running_stats
+
+
+EXPORT_SUFFIXES = ('.json', '.ndjson', '.jsonl')
+
+
+def find_exports(paths) -> list:
+    exports = []
+    for path in paths:
+        if os.path.isdir(path):
+            exports.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                           if name.endswith(EXPORT_SUFFIXES))
+        else:
+            exports.append(path)
+    return exports
+
+
+def read_export(path) -> list:
+    with open(path) as f:
+        if not path.endswith(('.ndjson', '.jsonl')):
+            return json.load(f)
+        activities = []
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                # Pages written one per line are flattened like fetch_activities does
+                activities.extend(record if isinstance(record, list) else [record])
+        return activities
+
+
+def athlete_id(activities, path):
+    for activity in activities:
+        athlete = activity.get('athlete') or {}
+        if athlete.get('id') is not None:
+            return athlete['id']
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def plot_rows(athlete, df, max_points) -> list:
+    """Plot data in long form, one (athlete, plot, x, label, y) row per point."""
+    rows = []
+    paces = pace_histogram(df)
+    rows += [(athlete, 'paces', pace, None, miles) for pace, miles in zip(paces['paces'], paces['values'])]
+    weekdays = weekday_counts(df)
+    rows += [(athlete, 'runs_by_weekday', i, day, count)
+             for i, (day, count) in enumerate(zip(weekdays['days'], weekdays['counts']))]
+    for name, column in (('average_speed_over_time', 'average_speed'), ('distance_over_time', 'distance')):
+        series = time_series(df, column, max_points)
+        rows += [(athlete, name, x, None, y) for x, y in zip(series['x'], series['y'])]
+    return rows
+
+
+def summarize(path, today, max_points):
+    """(summary row, plot rows) for one export. Failures become a row with `error` set."""
+    try:
+        activities = read_export(path)
+        athlete = athlete_id(activities, path)
+        df = frame(activities)
+        streaks = activity_streaks(df, top=1, today=today)
+        row = {'athlete_id': str(athlete), 'source': path, 'activities': len(df),
+               **running_stats(df), 'current_streak': streaks['current_streak'], 'error': None}
+        plots = plot_rows(str(athlete), df, max_points) if max_points else []
+        return row, plots
+    except Exception as e:
+        return {'athlete_id': None, 'source': path, 'error': f"{type(e).__name__}: {e}"}, []
+
+
+def summarize_chunk(paths, today, max_points):
+    # One task per chunk rather than per athlete keeps pickling overhead off small exports
+    return [summarize(path, today, max_points) for path in paths]
+
+
+def chunked(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def run(exports, workers=None, chunk_size=None, today=None, max_points=200, progress=None):
+    """
+    Summarizes every export on `workers` processes.
+    :return (pd.DataFrame, pd.DataFrame): one summary row per export, and the plot data
+    """
+    workers = workers or os.cpu_count() or 1
+    # Aim for a few chunks per worker so a slow chunk doesn't leave the others idle
+    chunk_size = chunk_size or max(1, len(exports) // (workers * 4))
+    today = today or date.today()
+    rows, plots = [], []
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(summarize_chunk, chunk, today, max_points) for chunk in chunked(exports, chunk_size)]
+        for future in as_completed(futures):
+            for row, plot in future.result():
+                rows.append(row)
+                plots.extend(plot)
+            done += len(future.result())
+            if progress:
+                progress(done, len(exports))
+    summary = pd.DataFrame(rows).sort_values('source', kind='stable').reset_index(drop=True)
+    plot_data = pd.DataFrame(plots, columns=['athlete_id', 'plot', 'x', 'label', 'y'])
+    return summary, plot_data
+
+
+def write_table(df, path):
+    if path.endswith('.parquet'):
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('exports', nargs='+', help="export files, or directories of them")
+    parser.add_argument('--out', required=True, help="summary table, .parquet or .csv")
+    parser.add_argument('--plot-data', help="plot data table, .parquet or .csv")
+    parser.add_argument('--workers', type=int, default=0, help="processes, all cores by default")
+    parser.add_argument('--chunk-size', type=int, default=0, help="exports per task")
+    parser.add_argument('--max-points', type=int, default=200, help="points per time series")
+    parser.add_argument('--today', type=date.fromisoformat, help="date current streaks are measured against")
+    args = parser.parse_args()
+
+    if any(path and path.endswith('.parquet') for path in (args.out, args.plot_data)):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            parser.error("Parquet output needs pyarrow installed")
+
+    exports = find_exports(args.exports)
+    if not exports:
+        parser.error("no exports found")
+
+    start = time.perf_counter()
+
+    def progress(done, total):
+        print(f"\r{done}/{total} athletes  {time.perf_counter() - start:.1f}s",
+              end='' if done < total else '\n', file=sys.stderr, flush=True)
+
+    summary, plot_data = run(exports, args.workers or None, args.chunk_size or None, args.today,
+                             args.max_points if args.plot_data else 0, progress)
+    write_table(summary, args.out)
+    if args.plot_data:
+        write_table(plot_data, args.plot_data)
+
+    failed = summary['error'].notna()
+    for source, error in summary.loc[failed, ['source', 'error']].itertuples(index=False):
+        print(f"{source}: {error}", file=sys.stderr)
+    print(f"{len(summary) - failed.sum()} athletes summarized, {failed.sum()} failed "
+          f"in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    return 1 if failed.any() else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,184 @@
+import numpy as np
+import pandas as pd
+
+from .rollups import PERIODS, period_range, rollup
+
+
+DAYS_OF_WEEK = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+METERS_PER_UNIT = {'mile': 1609.344, 'km': 1000.0}
+
+
+def run_paces(df, unit='mile', min_distance=100.0, max_distance=None, pace_limits=(60, 3600), outlier_iqr=3.0):
+    """
+    Pace of every run that passes the filters, computed once for the whole table.
+    :param df:
+    :param unit: 'mile' or 'km'
+    :param min_distance: meters; shorter runs (treadmill, manual entries) have no meaningful pace
+    :param max_distance: meters, or None
+    :param pace_limits: (fastest, slowest) seconds per unit kept, or None
+    :param outlier_iqr: drop paces beyond this many interquartile ranges outside the quartiles, or None
+    :return (np.ndarray, np.ndarray, np.ndarray, int): pace in seconds per unit, distance in units,
+        moving time in seconds, and how many runs were filtered out
+    """
+    if unit not in METERS_PER_UNIT:
+        raise ValueError(f"Unknown unit {unit}, expected one of {', '.join(METERS_PER_UNIT)}")
+    runs = df[df['type'] == 'Run'] if 'type' in df else df.iloc[0:0]
+    distance = runs['distance'].to_numpy(dtype='float64') if len(runs) else np.empty(0)
+    seconds = runs['moving_time'].to_numpy(dtype='float64') if len(runs) else np.empty(0)
+
+    # NaNs fail every comparison, so missing values drop out here too
+    keep = (distance > 0) & (distance >= min_distance) & (seconds > 0)
+    if max_distance is not None:
+        keep &= distance <= max_distance
+    distance, seconds = distance[keep] / METERS_PER_UNIT[unit], seconds[keep]
+    pace = seconds / distance
+
+    keep = np.ones(len(pace), dtype=bool)
+    if pace_limits is not None:
+        keep &= (pace >= pace_limits[0]) & (pace <= pace_limits[1])
+    if outlier_iqr is not None and keep.sum() >= 4:
+        q1, q3 = np.percentile(pace[keep], [25, 75])
+        spread = outlier_iqr * (q3 - q1)
+        keep &= (pace >= q1 - spread) & (pace <= q3 + spread)
+    return pace[keep], distance[keep], seconds[keep], len(runs) - int(keep.sum())
+
+
+def pace_histogram(df, bin_seconds=60, unit='mile', weight='distance', **filters) -> dict:
+    """
+    Distance (or time) run in each pace bin, the data behind plot_paces. Bins
+    are `bin_seconds` wide and centered on multiples of it, so the default
+    rounds to the nearest whole minute per mile.
+    :param df:
+    :param bin_seconds: bin width in seconds per unit, e.g. 15, 30 or 60
+    :param unit: 'mile' or 'km'
+    :param weight: 'distance' sums distance in units, 'time' sums moving minutes
+    :param filters: passed on to run_paces
+    :return dict:
+    """
+    if weight not in ('distance', 'time'):
+        raise ValueError(f"Unknown weight {weight}, expected distance or time")
+    if not bin_seconds or bin_seconds <= 0:
+        raise ValueError("bin_seconds must be positive")
+    pace, distance, seconds, excluded = run_paces(df, unit, **filters)
+    weights = distance if weight == 'distance' else seconds / 60.0
+
+    centers = totals = np.empty(0)
+    if len(pace):
+        index = np.rint(pace / bin_seconds).astype('int64')
+        first = index.min()
+        totals = np.bincount(index - first, weights=weights)
+        centers = np.arange(first, first + len(totals)) * bin_seconds / 60.0
+
+    return {
+        # Bin centers in minutes per unit; every bin between the slowest and fastest is listed
+        "paces": np.round(centers, 4).tolist(),
+        "values": np.round(totals, 2).tolist(),
+        "bin_seconds": bin_seconds,
+        "unit": unit,
+        "weight": weight,
+        "value_unit": ('miles' if unit == 'mile' else 'km') if weight == 'distance' else 'minutes',
+        "excluded": excluded,
+    }
+
+
+def weekday_counts(df) -> dict:
+    """
+    Number of runs started on each day of the week, the data behind plot_runs_by_weekday.
+    :param df:
+    :return dict:
+    """
+    runs = df[df['type'] == 'Run']
+    # Runs without a start date have no weekday to count
+    dates = pd.to_datetime(runs['start_date_local']).dropna()
+    counts = np.bincount(dates.dt.weekday.to_numpy(dtype='int64'), minlength=7)
+    return {"days": DAYS_OF_WEEK, "counts": counts.tolist()}
+
+
+def time_series(df, column, max_points=500, activity_type='Run', tables=None) -> dict:
+    """
+    A column over time for one activity type. Histories with more than
+    `max_points` activities are shown per week, month or year instead,
+    whichever is the finest with at most `max_points` buckets. Buckets and
+    the trend come from the rollup tables, so a bucket's speed is its
+    distance over moving time, as /activities/rollups reports it, and other
+    columns are the mean per activity. Next to the rolling trend, the trend
+    line fitted through every activity is given by its slope and intercept.
+    :param df:
+    :param column: 'average_speed', or a rollup total such as 'distance'
+    :param max_points:
+    :param activity_type: e.g. 'Run', or None for every activity
+    :param tables: called with (period, activity_type) for a rollup table,
+        e.g. read from the athlete's Rollups; rolled up from `df` by default
+    :return dict:
+    """
+    tables = tables or (lambda period, activity_type: rollup(df, period, activity_type))
+    rows = df[df['type'] == activity_type] if activity_type is not None else df
+    y = rows[column].to_numpy(dtype='float64')
+    keep = ~np.isnan(y) & rows['start_date_local'].notna().to_numpy()
+    dates, y = rows['start_date_local'][keep], y[keep]
+    if not len(y):
+        return {"x": [], "y": [], "period": None, "trend": None}
+
+    first, last = dates.min(), dates.max()
+    for period in PERIODS:
+        if len(period_range(first, last, period)) <= max_points:
+            break
+    table = tables(period, activity_type)
+    starts = np.array(table['start'], dtype='datetime64[D]')
+    # Days since the epoch, the same x scale matplotlib's date2num uses
+    edges = period_range(starts[0], starts[-1], period, extra=1).astype('int64').astype('float64')
+    middles = (edges[:-1] + edges[1:]) / 2
+
+    window = table['trend']['window']
+    if column == 'average_speed':
+        values = np.array(table['average_speed'], dtype='float64')
+        trend = np.array(table['trend']['average_speed'], dtype='float64')
+    else:
+        totals = np.array(table[column], dtype='float64')
+        counts = np.array(table['count'], dtype='float64')
+        rolling_totals = pd.Series(totals).rolling(window, min_periods=1).sum().to_numpy()
+        rolling_counts = pd.Series(counts).rolling(window, min_periods=1).sum().to_numpy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values, trend = totals / counts, rolling_totals / rolling_counts
+
+    x = dates.to_numpy(dtype='datetime64[ns]').astype('int64') / 86400e9
+    # Least squares line through every activity, however the points are bucketed
+    slope, intercept = np.polyfit(x, y, 1) if np.ptp(x) > 0 else (0.0, float(y.mean()))
+    if len(y) > max_points:
+        filled = ~np.isnan(values)
+        x, y = middles[filled], values[filled]
+    else:
+        order = np.argsort(x, kind='stable')
+        x, y = x[order], y[order]
+    trending = ~np.isnan(trend)
+
+    return {
+        "x": np.round(x, 4).tolist(),
+        "y": np.round(y, 3).tolist(),
+        "period": period,
+        "trend": {
+            "x": np.round(middles[trending], 4).tolist(),
+            "y": np.round(trend[trending], 3).tolist(),
+            "window": window,
+            "slope": float(slope),
+            "intercept": float(intercept),
+            "x_unit": "days since 1970-01-01",
+        },
+    }
+
+
+def average_speed_over_time(df, max_points=500, tables=None) -> dict:
+    return time_series(df, 'average_speed', max_points, tables=tables)
+
+
+def distance_over_time(df, max_points=500, tables=None) -> dict:
+    return time_series(df, 'distance', max_points, tables=tables)
+
+
+# Plot data by plot name, each called with (df, max_points, tables)
+PLOT_DATA = {
+    'paces': lambda df, max_points, tables=None: pace_histogram(df),
+    'average_speed_over_time': average_speed_over_time,
+    'distance_over_time': distance_over_time,
+    'runs_by_weekday': lambda df, max_points, tables=None: weekday_counts(df),
+}
@@ -0,0 +1,204 @@
+"""
+Weekly, monthly and yearly totals per activity type, with a trailing rolling
+trend over the buckets. rollup() builds a table from the activity table in
+one groupby; Rollups keeps the same tables for one athlete and, as activities
+arrive, recomputes only the buckets they fall in.
+"""
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+
+PERIODS = ('week', 'month', 'year')
+# Buckets the trend averages over, per period
+TREND_WINDOWS = {'week': 4, 'month': 3, 'year': 2}
+# NumPy datetime unit of each calendar period; weeks are 7 days starting on Monday
+UNITS = {'week': None, 'month': 'M', 'year': 'Y'}
+TOTALS = ['count', 'distance', 'moving_time', 'elevation_gain']
+
+
+def check_period(period):
+    if period not in PERIODS:
+        raise ValueError(f"Unknown period {period}, expected one of {', '.join(PERIODS)}")
+
+
+def period_start(day, period) -> date:
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    return day.replace(month=1, day=1)
+
+
+def period_starts(dates, period) -> np.ndarray:
+    """period_start for a whole datetime column, as datetime64[D]."""
+    days = np.asarray(dates, dtype='datetime64[ns]').astype('datetime64[D]')
+    if period == 'week':
+        # 1970-01-01 was a Thursday, three days after a Monday
+        return days - ((days.astype('int64') + 3) % 7).astype('timedelta64[D]')
+    return days.astype(f'datetime64[{UNITS[period]}]').astype('datetime64[D]')
+
+
+def period_range(first, last, period, extra=0) -> np.ndarray:
+    """
+    Start of every period from the one holding `first` to the one holding
+    `last`, and `extra` more after it, as datetime64[D].
+    """
+    first, last = period_starts([first, last], period)
+    if period == 'week':
+        return np.arange(first, last + np.timedelta64(7 * (1 + extra), 'D'), np.timedelta64(7, 'D'))
+    unit = f'datetime64[{UNITS[period]}]'
+    return np.arange(first.astype(unit), last.astype(unit) + 1 + extra).astype('datetime64[D]')
+
+
+def table(totals, period, activity_type, window=None) -> dict:
+    """
+    The JSON-ready rollup from per-bucket totals: empty buckets in between are
+    filled with zeros so every period in the range is listed once.
+    :param totals: DataFrame of TOTALS indexed by bucket start
+    :param period:
+    :param activity_type:
+    :param window: buckets in the trend, TREND_WINDOWS[period] by default
+    :return dict:
+    """
+    window = window or TREND_WINDOWS[period]
+    if len(totals):
+        starts = period_range(totals.index.min(), totals.index.max(), period)
+        totals = totals.reindex(pd.DatetimeIndex(starts.astype('datetime64[ns]')), fill_value=0)
+    distance = totals['distance'].to_numpy(dtype='float64')
+    moving_time = totals['moving_time'].to_numpy(dtype='float64')
+    rolling_distance = pd.Series(distance).rolling(window, min_periods=1).sum().to_numpy()
+    rolling_time = pd.Series(moving_time).rolling(window, min_periods=1).sum().to_numpy()
+    rolling_buckets = np.minimum(np.arange(1, len(totals) + 1), window)
+
+    def speeds(meters, seconds):
+        # Total distance over total moving time, so long runs weigh in by how long they took
+        with np.errstate(divide='ignore', invalid='ignore'):
+            speed = np.round(meters / seconds, 3)
+        return [value if value == value else None for value in speed.tolist()]
+
+    return {
+        "period": period,
+        "type": activity_type,
+        "start": np.datetime_as_string(totals.index.to_numpy(dtype='datetime64[D]')).tolist(),
+        "count": totals['count'].astype('int64').tolist(),
+        "distance": np.round(distance, 1).tolist(),
+        "moving_time": moving_time.astype('int64').tolist(),
+        "elevation_gain": np.round(totals['elevation_gain'].to_numpy(dtype='float64'), 1).tolist(),
+        "average_speed": speeds(distance, moving_time),
+        # Trailing means over the last `window` buckets, the latest bucket included
+        "trend": {
+            "window": window,
+            "distance": np.round(rolling_distance / np.maximum(rolling_buckets, 1), 1).tolist(),
+            "average_speed": speeds(rolling_distance, rolling_time),
+        },
+    }
+
+
+def empty_totals():
+    return pd.DataFrame({name: pd.Series(dtype='float64') for name in TOTALS},
+                        index=pd.DatetimeIndex([]))
+
+
+def rollup(df, period='week', activity_type='Run', window=None) -> dict:
+    """
+    Totals per `period` for one activity type, computed from the activity table.
+    :param df:
+    :param period: 'week', 'month' or 'year'
+    :param activity_type: e.g. 'Run', or None for every activity
+    :param window: buckets in the trend
+    :return dict:
+    """
+    check_period(period)
+    if activity_type is not None:
+        df = df[df['type'] == activity_type] if 'type' in df else df.iloc[0:0]
+    df = df[df['start_date_local'].notna()]
+    if df.empty:
+        return table(empty_totals(), period, activity_type, window)
+    totals = pd.DataFrame({
+        'start': period_starts(df['start_date_local'], period).astype('datetime64[ns]'),
+        'count': 1,
+        'distance': df['distance'].astype('float64'),
+        'moving_time': df['moving_time'].astype('float64'),
+        'elevation_gain': df['total_elevation_gain'].astype('float64'),
+    }).groupby('start').sum(min_count=0)
+    return table(totals.fillna(0), period, activity_type, window)
+
+
+def number(value):
+    return 0.0 if value is None or value != value else float(value)
+
+
+class Rollups:
+    """
+    Every period's rollup for one athlete. Each bucket remembers which
+    activities are in it, and adding (or replacing) k activities recomputes
+    only the up to 3k buckets they touch, from their members, so totals never
+    drift however many updates are applied.
+    """
+
+    def __init__(self, activities=()):
+        self.records = {}
+        # (period, type, start) -> ids of the activities in the bucket
+        self.members = {}
+        # (period, type, start) -> [count, distance, moving_time, elevation_gain]
+        self.totals = {}
+        self.add(activities)
+
+    def add(self, activities):
+        """Adds new activities; ones already counted move to their new buckets."""
+        touched = set()
+        for activity in activities:
+            activity_id = activity['id']
+            old = self.records.pop(activity_id, None)
+            if old is not None:
+                for key in old[1]:
+                    self.members[key].discard(activity_id)
+                    touched.add(key)
+            start_date = activity.get('start_date_local')
+            if not start_date:
+                continue
+            day = date.fromisoformat(str(start_date)[:10])
+            activity_type = activity.get('type')
+            keys = [(period, activity_type, period_start(day, period)) for period in PERIODS]
+            self.records[activity_id] = (
+                (number(activity.get('distance')), number(activity.get('moving_time')),
+                 number(activity.get('total_elevation_gain'))),
+                keys)
+            for key in keys:
+                self.members.setdefault(key, set()).add(activity_id)
+                touched.add(key)
+        for key in touched:
+            self.recompute(key)
+
+    def remove(self, activity_ids):
+        touched = set()
+        for activity_id in activity_ids:
+            record = self.records.pop(activity_id, None)
+            if record is not None:
+                for key in record[1]:
+                    self.members[key].discard(activity_id)
+                    touched.add(key)
+        for key in touched:
+            self.recompute(key)
+
+    def recompute(self, key):
+        members = self.members.get(key)
+        if not members:
+            self.members.pop(key, None)
+            self.totals.pop(key, None)
+            return
+        values = [self.records[activity_id][0] for activity_id in members]
+        self.totals[key] = [len(values), *map(sum, zip(*values))]
+
+    def result(self, period='week', activity_type='Run', window=None) -> dict:
+        check_period(period)
+        buckets = sorted((start, totals) for (bucket_period, bucket_type, start), totals in self.totals.items()
+                         if bucket_period == period and (activity_type is None or bucket_type == activity_type))
+        if not buckets:
+            return table(empty_totals(), period, activity_type, window)
+        totals = pd.DataFrame([values for _, values in buckets], columns=TOTALS,
+                              index=pd.DatetimeIndex([start for start, _ in buckets]))
+        # Several types share a start when activity_type is None
+        return table(totals.groupby(level=0).sum(), period, activity_type, window)
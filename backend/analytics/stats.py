@@ -0,0 +1,85 @@
+import pandas as pd
+
+from . import streaks
+from .streaks import longest_streak
+
+
+def format_stats(total_runs, total_distance, total_time_moving, total_elevation_gain,
+                 fastest_speed, farthest_run, shortest_run, max_altitude, longest_streak) -> dict:
+    """
+    Turns raw run totals (meters, seconds) into the rounded, unit-converted dict the frontend reads.
+    :return dict:
+    """
+    total_distance = round(float(total_distance)/1609, 2) # divide by 1609 to convert meters to miles
+    total_time_moving = round(float(total_time_moving)/3600, 2) # divide by 3600 to convert seconds to hours
+    total_elevation_gain = round(float(total_elevation_gain), 2)
+    avg_speed_all_time = round(total_distance/total_time_moving, 2) if total_time_moving else 0 # multiply by 1.609 to convert km to mile
+    avg_pace = round(60/avg_speed_all_time, 2) if avg_speed_all_time else 0
+    avg_dist_per_run = round((total_distance/total_runs), 2) if total_runs else 0
+    avg_elev_gain = round((total_elevation_gain/total_runs), 2) if total_runs else 0
+    fastest_speed = round(fastest_speed, 2)
+    farthest_run = round(farthest_run/1609, 2)
+    shortest_run = round(shortest_run/1609, 2)
+    max_altitude = round(max_altitude, 2)
+
+    return {
+        "total_runs": total_runs,
+        "total_distance": total_distance,
+        "total_time_moving": total_time_moving,
+        "total_elevation_gain": total_elevation_gain,
+        "avg_speed_all_time": avg_speed_all_time,
+        "avg_pace": avg_pace,
+        "avg_dist_per_run": avg_dist_per_run,
+        "avg_elev_gain": avg_elev_gain,
+        "fastest_speed": fastest_speed,
+        "longest_streak": longest_streak,
+        "farthest_run": farthest_run,
+        'shortest_run': shortest_run,
+        'max_altitude': max_altitude
+    }
+
+
+def running_stats(df) -> dict:
+    """
+    Totals and extremes over the runs in an activity table, plus the longest
+    streak over every activity type.
+    :param df: activity table, e.g. from columns.frame
+    :return dict:
+    """
+    # Filter down to runs once and reduce whole columns instead of
+    # boxing every row into a Series with iterrows()
+    runs = df[df['type'] == 'Run'] if 'type' in df else df.iloc[0:0]
+    total_runs = len(runs)
+
+    def column(name):
+        if name not in runs:
+            return pd.Series(dtype='float64')
+        return pd.to_numeric(runs[name], errors='coerce').astype('float64')
+
+    distance = column('distance')
+    total_distance = distance.sum()
+    total_time_moving = column('moving_time').sum()
+    total_elevation_gain = column('total_elevation_gain').sum()
+    # Seeded like the old loop; max()/min() skip NaN and fall back to the seed
+    # when there are no runs (NaN never compares greater than the seed)
+    fastest_speed = max(0, float(column('max_speed').max()))
+    farthest_run = max(0, float(distance.max()))
+    shortest_run = min(float("inf"), float(distance.min()))
+    max_altitude = max(0, float(column('elev_high').max()))
+
+    return format_stats(total_runs, total_distance, total_time_moving, total_elevation_gain,
+                        fastest_speed, farthest_run, shortest_run, max_altitude,
+                        longest_activity_streak(df))
+
+
+def longest_activity_streak(df) -> int:
+    # Works on day numbers and leaves df's start_date untouched
+    if df.empty or 'start_date' not in df:
+        return 0
+    return longest_streak(df['start_date'])
+
+
+def activity_streaks(df, top=5, today=None) -> dict:
+    if df.empty or 'start_date' not in df:
+        return streaks.activity_streaks([], top, today)
+    return streaks.activity_streaks(df['start_date'], top, today)
@@ -1,32 +1,115 @@
-from flask import Flask, jsonify, request, session, redirect, Response
+from flask import Flask, g, has_request_context, jsonify, request, session, redirect, Response, stream_with_context
 from flask_cors import CORS
-import io
-import base64
 import requests
-import matplotlib
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-import pandas as pd
-import numpy as np
-from collections import defaultdict, Counter
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
 import os
+import json
+import atexit
+import functools
+import time
+import uuid
+import secrets
 from dotenv import load_dotenv
+from store import ActivityStore
+import sessions
+from httpcache import conditional
+from ratelimit import RateLimiter, RateLimitExceeded, backoff
+import plots
+import analytics
+from analytics import columns
+from geometry import parse_zoom, route_cache
+from spatial import route_indexes
+from singleflight import SingleFlight
+from prefetch import Prefetcher
+import metrics
 
 
 load_dotenv()
 
-matplotlib.use('Agg')
-
 app = Flask(__name__)
-app.secret_key = "abc_123"
-CORS(app)
+# Sessions live server side (see below), so the key only guards Flask's own signed values
+app.secret_key = os.environ.get('SECRET_KEY') or secrets.token_hex(32)
+# The frontend is served from another origin and sends the session cookie with
+# its requests, so CORS names the origins allowed to instead of answering '*'
+FRONTEND_ORIGINS = [origin.strip() for origin in os.environ.get(
+    'FRONTEND_ORIGINS', 'http://stravastats.s3-website-us-west-1.amazonaws.com,http://localhost:3000').split(',')
+    if origin.strip()]
+CORS(app, origins=FRONTEND_ORIGINS, supports_credentials=True)
+# A cross-site cookie must be SameSite=None, which browsers only accept with Secure,
+# i.e. over HTTPS; SESSION_COOKIE_SAMESITE=Lax for a frontend on the same site
+app.config['SESSION_COOKIE_SAMESITE'] = os.environ.get('SESSION_COOKIE_SAMESITE', 'None')
+app.config['SESSION_COOKIE_SECURE'] = os.environ.get('SESSION_COOKIE_SECURE', '1') != '0'
+
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_token = metrics.begin_request(request.method, request.path)
+
+
+@app.after_request
+def record_response_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    # Teardown runs even when the view or an after_request hook raised; those count as 500s
+    endpoint = request.url_rule.rule if request.url_rule else None
+    metrics.end_request(g.pop('metrics_token', None), endpoint, 500 if exc else g.pop('metrics_status', 500))
 
 CLIENT_ID = os.environ.get('CLIENT_ID')
 CLIENT_SECRET = os.environ.get('CLIENT_SECRET')
 REFRESH_TOKEN = os.environ.get('REFRESH_TOKEN')
-AUTH_LINK = "https://www.strava.com/oauth/token"
-
-activity_cache = []
+AUTH_LINK = os.environ.get('STRAVA_AUTH_URL', "https://www.strava.com/oauth/token")
+API_URL = os.environ.get('STRAVA_API_URL', "https://www.strava.com/api/v3")
+PAGE_SIZE = 200
+# How many activity pages may be in flight at once
+FETCH_WINDOW = int(os.environ.get('FETCH_WINDOW', 4))
+
+# One pooled session for all Strava calls so pages reuse keep-alive connections
+http = requests.Session()
+http.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=max(FETCH_WINDOW, 10)))
+http.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=max(FETCH_WINDOW, 10)))
+
+# Shared by every request in this process so concurrent athletes draw from one budget
+strava_limiter = RateLimiter()
+MAX_RETRIES = 5
+MAX_TOKEN_REFRESHES = 2
+
+# Routes are simplified to what the map can show at this zoom unless the client asks for another
+ROUTE_ZOOM = int(os.environ.get('ROUTE_ZOOM', 14))
+
+# Concurrent logins of one athlete (two tabs, a double-fired callback) share one download and compute
+login_flight = SingleFlight()
+
+# Per-athlete running stats, updated with each sync's delta instead of recomputed,
+# for the REGISTRY_SIZE most recently seen athletes
+REGISTRY_SIZE = int(os.environ.get('REGISTRY_SIZE', 1000))
+stats_registry = analytics.StatsRegistry(size=REGISTRY_SIZE)
+rollup_registry = analytics.StatsRegistry(analytics.Rollups, size=REGISTRY_SIZE)
+
+STREAM_TICKET_TTL = 120
+
+# Activities are kept on disk per athlete so returning users only pull what is new
+# Routes are simplified for ROUTE_ZOOM as they are stored, the zoom nearly every map asks for
+activity_store = ActivityStore(os.environ.get('ACTIVITY_DB', 'activities.db'), route_zoom=ROUTE_ZOOM)
+# Re-request this far behind the cursor to pick up late uploads and edits
+SYNC_LOOKBACK = 3 * 24 * 3600
+
+# Sessions, stream tickets and reusable results are kept server side, in a
+# SQLite file every worker on the host shares; STATE_DB= keeps them in this process only
+STATE_DB = os.environ.get('STATE_DB', 'state.db')
+shared_state = sessions.SQLiteBackend(STATE_DB) if STATE_DB else sessions.MemoryBackend()
+app.session_interface = sessions.ServerSessionInterface(shared_state, ttl=int(os.environ.get('SESSION_TTL', 7 * 24 * 3600)))
+# Activity tables, dashboards and plots per athlete and history revision, with a per-process LRU in front
+results = sessions.TieredStore(sessions.MemoryBackend(int(os.environ.get('RESULT_CACHE_ENTRIES', 256))),
+                               shared_state if STATE_DB else None)
+RESULT_TTL = int(os.environ.get('RESULT_TTL', 600))
+# Plot jobs go from pending to done under the same key, so they skip the per-process tier
+plots.renderer.results = shared_state
 
 @app.route('/auth/status', methods=['GET'])
 def auth_status():
@@ -42,7 +125,7 @@ def root():
 @app.route('/auth/strava', methods=['GET'])
 def strava_auth():
     try:
-        response = requests.post(
+        response = http.post(
             AUTH_LINK,
             data={
                 "client_id": CLIENT_ID,
@@ -53,12 +136,15 @@ def strava_auth():
         )
         data = response.json()
         access_token = data.get("access_token")
+        refresh_token = data.get("refresh_token")
 
-        if access_token:
-            # Store the access token in the user's session
+        # Both or neither: a session must never fall back to the app's own refresh token
+        if access_token and refresh_token:
+            # Store the access token in the user's session, under a new id
+            session.rotate()
             session['access_token'] = access_token
+            session['refresh_token'] = refresh_token
             session.modified = True
-            print(session)
             # Return just the access token to frontend
             return jsonify({"access_token": access_token})
         else:
@@ -69,9 +155,8 @@ def strava_auth():
 @app.route('/callback', methods=['POST', 'OPTIONS'])
 def callback():
     if request.method == 'OPTIONS':
-        # Preflight request. Reply successfully:
+        # Preflight request. Reply successfully; flask-cors adds the allowed origin
         resp = Response("OK", content_type='application/json')
-        resp.headers['Access-Control-Allow-Origin'] = '*'
         resp.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
         resp.headers['Access-Control-Allow-Headers'] = 'content-type'
         return resp
@@ -81,11 +166,16 @@ def callback():
         return jsonify({"error": "Expected JSON"}), 400
 
     code = data.get('code')
+    # Part of single-flight and cache keys, and 2 ** zoom overflows for large values
+    zoom = parse_zoom(data.get('zoom', ROUTE_ZOOM))
+    stream = data.get('stream')
 
     if not code:
         return jsonify({"error": "No code provided"}), 400
+    if zoom is None:
+        return jsonify({"error": "zoom must be an integer"}), 400
 
-    token_url = "https://www.strava.com/oauth/token"
+    token_url = AUTH_LINK
     data = {
         "client_id": CLIENT_ID,
         "client_secret": CLIENT_SECRET,
@@ -94,97 +184,576 @@ def callback():
     }
 
     try:
-        response = requests.post(token_url, data=data)
+        with metrics.span('token_exchange'):
+            response = http.post(token_url, data=data)
         response_data = response.json()
 
         if response.ok and "access_token" in response_data:
             access_token = response_data.get('access_token')
+            refresh_token = response_data.get('refresh_token')
 
+            # A new session id for the logged in session, never the one the browser arrived with
+            session.rotate()
             session['access_token'] = access_token
-            session.modified = True
+            session['refresh_token'] = refresh_token
 
-            session['access_token'] = access_token
+            athlete_id = (response_data.get('athlete') or {}).get('id')
+            if athlete_id:
+                session['athlete_id'] = athlete_id
+            register_login(athlete_id, response_data)
 
-            # Initialize StravaStatsAPI and get stat and plot data from it
-            strava = StravaStatsAPI(session['access_token'])
-            all_activities = (strava.fetch_activities())
-            latlong = all_activities[0]['start_latlng']
-            print(latlong)
-            df = pd.DataFrame(all_activities)
-            all_activities = strava.format_activities(all_activities)
-            #print(all_activities[0])
-            stats = strava.running_stats(df)
+            if stream:
+                # Activities, stats and plots follow on /stream/<ticket> as they become ready
+                ticket = issue_stream_ticket(access_token, refresh_token, athlete_id, zoom)
+                return jsonify({"message": "Authentication successful", "access_token": access_token, "stream": f"/stream/{ticket}"})
 
-            plots = []
-            plots.append(strava.plot_paces(df))
-            plots.append(strava.plot_average_speed_over_time(df))
-            plots.append(strava.plot_distance_over_time(df))
-            plots.append(strava.plot_runs_by_weekday(df))
+            # Initialize StravaStatsAPI and get stat and plot data from it
+            strava = StravaStatsAPI(access_token, refresh_token)
+            if athlete_id:
+                payload = login_flight.do((athlete_id, zoom), lambda: sync_dashboard(strava, athlete_id, zoom))
+            else:
+                payload = dashboard(strava, strava.fetch_activities(), zoom)
 
-            return jsonify({"message": "Authentication successful", "access_token": access_token, "activities": all_activities,  "stats": stats, "plots": plots, "latlong": latlong})
+            return jsonify({"message": "Authentication successful", "access_token": access_token, **payload})
         else:
             return jsonify(response_data), 400
+    except RateLimitExceeded as e:
+        return jsonify({"error": str(e)}), 429, {'Retry-After': str(int(e.retry_after))}
     except Exception as e:
         return jsonify({"error": str(e)})
 
 
+def sync_dashboard(strava, athlete_id, zoom):
+    with metrics.span('sync') as span:
+        delta, revisions = strava.pull_new_activities(athlete_id)
+        span.annotate(activities=len(delta))
+    return synced_dashboard(strava, athlete_id, zoom, revisions, delta)
+
+
+def synced_dashboard(strava, athlete_id, zoom, revisions, delta):
+    """
+    The dashboard once a sync is done. Another request or worker may already
+    have built it for this revision of the history, in which case it is reused.
+    :param revisions: (before, after) as the sync's merge reported them
+    """
+    base_revision, revision = revisions
+    key = dashboard_key(athlete_id, revision, zoom)
+    payload = results.get(key)
+    if payload is not None:
+        return payload
+    with metrics.span('store_load'):
+        all_activities = activity_store.load(athlete_id)
+    with metrics.span('stats'):
+        stats = athlete_stats(athlete_id, base_revision, revision, delta, all_activities)
+    df = athlete_frame(athlete_id, revision, all_activities)
+    payload = dashboard(strava, all_activities, zoom, stats, df)
+    # As long as the plot job it points at
+    results.set(key, payload, plots.renderer.ttl)
+    return payload
+
+
+def prefetch_athlete(athlete):
+    """One background refresh: the same sync and recompute a login does, shared with one in flight."""
+    strava = StravaStatsAPI(athlete.access_token, athlete.refresh_token)
+    try:
+        if athlete.expires_at and athlete.expires_at - 300 <= time.time():
+            strava.access_token = strava.request_token()
+            strava.header = {'Authorization': 'Bearer ' + strava.access_token}
+        login_flight.do((athlete.athlete_id, ROUTE_ZOOM), lambda: sync_dashboard(strava, athlete.athlete_id, ROUTE_ZOOM))
+    finally:
+        # Keep whatever tokens a refresh along the way handed out, and when they expire
+        athlete.access_token, athlete.refresh_token = strava.access_token, strava.refresh_token
+        if strava.expires_at is not None:
+            athlete.expires_at = strava.expires_at
+
+
+# Athletes who logged in recently are synced in the background every PREFETCH_INTERVAL
+# seconds while they stay active; PREFETCH_INTERVAL=0 turns it off
+PREFETCH_INTERVAL = int(os.environ.get('PREFETCH_INTERVAL', 900))
+prefetcher = Prefetcher(prefetch_athlete, interval=PREFETCH_INTERVAL,
+                        active_for=int(os.environ.get('PREFETCH_ACTIVE_FOR', 7 * 24 * 3600)),
+                        strava_limiter=strava_limiter) if PREFETCH_INTERVAL else None
+if prefetcher is not None:
+    atexit.register(prefetcher.stop)
+
+
+def register_login(athlete_id, token_response):
+    """Adds a freshly logged in athlete to the background refresher, with the tokens Strava just issued."""
+    # Without their own refresh token a background refresh would fall back to the app's
+    if prefetcher is None or not athlete_id or not token_response.get('refresh_token'):
+        return
+    prefetcher.register(athlete_id, token_response.get('access_token'), token_response.get('refresh_token'),
+                        token_response.get('expires_at'))
+    prefetcher.start()
+
+
+def dashboard_key(athlete_id, revision, zoom):
+    return f"dashboard:{athlete_id}:{revision}:{zoom}"
+
+
+def athlete_frame(athlete_id, revision=None, activities=None):
+    """The athlete's typed activity table, built once per revision of their history for every route and worker."""
+    if revision is None:
+        revision = activity_store.revision(athlete_id)
+
+    def build():
+        history = activities if activities is not None else activity_store.load(athlete_id)
+        with metrics.span('frame', activities=len(history)):
+            return columns.frame(history)
+
+    # A DataFrame has no JSON form worth parsing back, so each worker keeps its own
+    return results.cached(f"frame:{athlete_id}:{revision}", RESULT_TTL, build, shared=False)
+
+
+def athlete_rollups(athlete_id, revision):
+    """The athlete's rollups at `revision` or later, catching up on what was stored since they were last seen."""
+    return rollup_registry.update(athlete_id, revision, revision, [], lambda: activity_store.load(athlete_id),
+                                  functools.partial(activity_store.changes_since, athlete_id))
+
+
+def athlete_stats(athlete_id, base_revision, revision, delta, all_activities):
+    """
+    running_stats for the athlete, kept current by applying only what the last
+    sync brought in. The athlete's rollups are brought up to date the same way.
+    """
+    changes = functools.partial(activity_store.changes_since, athlete_id)
+    rollup_registry.update(athlete_id, base_revision, revision, delta, lambda: all_activities, changes)
+    aggregate = stats_registry.update(athlete_id, base_revision, revision, delta, lambda: all_activities, changes)
+    return stats_registry.result(aggregate)
+
+
+def dashboard(strava, all_activities, zoom, stats=None, df=None):
+    """Stats, map data and a plot job for a freshly loaded history; shared by the WSGI and ASGI callbacks."""
+    latlong = all_activities[0]['start_latlng']
+    if df is None:
+        with metrics.span('frame', activities=len(all_activities)):
+            df = columns.frame(all_activities)
+    with metrics.span('format_activities'):
+        formatted = strava.format_activities(all_activities, zoom=zoom)
+    if stats is None:
+        with metrics.span('stats'):
+            stats = strava.running_stats(df)
+
+    # Plots render on the worker pool; the frontend fetches them from /plots/<job>
+    with metrics.span('plots_submit'):
+        plots_job = plots.renderer.submit(df)
+
+    return {"activities": formatted, "stats": stats, "plots_job": plots_job, "latlong": latlong}
+
+
+def issue_stream_ticket(access_token, refresh_token, athlete_id, zoom):
+    # Kept with the sessions so any worker can open the stream
+    ticket = uuid.uuid4().hex
+    shared_state.set('stream:' + ticket, (access_token, refresh_token, athlete_id, zoom), STREAM_TICKET_TTL)
+    return ticket
+
+
+def stream_event(event, payload, fmt):
+    body = json.dumps(payload)
+    if fmt == 'ndjson':
+        return '{"event": %s, "data": %s}\n' % (json.dumps(event), body)
+    return f"event: {event}\ndata: {body}\n\n"
+
+
+@app.route('/stream/<ticket>', methods=['GET'])
+def stream(ticket):
+    entry = shared_state.get('stream:' + ticket)
+    if entry is None:
+        return jsonify({"error": "Unknown or expired stream"}), 404
+    shared_state.delete('stream:' + ticket)
+    access_token, refresh_token, athlete_id, zoom = entry
+
+    # Server-Sent Events by default so EventSource works; ?format=ndjson for fetch() readers
+    fmt = 'ndjson' if request.args.get('format') == 'ndjson' else 'sse'
+    mimetype = 'application/x-ndjson' if fmt == 'ndjson' else 'text/event-stream'
+
+    def generate():
+        strava = StravaStatsAPI(access_token, refresh_token)
+        # Pages are reduced to typed columns as they arrive instead of being held as dicts
+        table = columns.ActivityTable()
+        sent = set()
+        after = None
+        window = None
+
+        def activities_events(activities):
+            fresh = [activity for activity in activities if activity.get('id') not in sent]
+            if not fresh:
+                return
+            sent.update(activity.get('id') for activity in fresh)
+            yield stream_event('activities', {
+                "activities": StravaStatsAPI.format_activities(fresh, zoom=zoom),
+                "latlong": fresh[0].get('start_latlng'),
+            }, fmt)
+
+        try:
+            if athlete_id:
+                cursor = activity_store.cursor(athlete_id)
+                if cursor is not None:
+                    # Returning athlete: the stored history goes out at once, then only the delta is fetched
+                    stored = activity_store.load(athlete_id)
+                    yield from activities_events(stored)
+                    table.append(stored)
+                    del stored
+                    after, window = max(cursor - SYNC_LOOKBACK, 0), 1
+
+            for page in strava.iter_activity_pages(window, after):
+                if athlete_id:
+                    activity_store.merge(athlete_id, page)
+                yield from activities_events(page)
+                table.append(page)
+
+            if not len(table):
+                yield stream_event('done', {}, fmt)
+                return
+            df = table.frame().drop_duplicates(subset='id', keep='last')
+            # Same order as a full download, so unchanged histories hit the plot cache
+            df = df.sort_values(['start_date', 'id'], ascending=False, ignore_index=True)
+            yield stream_event('stats', strava.running_stats(df.copy()), fmt)
+
+            job_id = plots.renderer.submit(df)
+            for position, plot in plots.renderer.iter_completed(job_id):
+                yield stream_event('plot', {"index": position, "plot": plot, "mime_type": plots.renderer.mime_type}, fmt)
+            yield stream_event('done', {}, fmt)
+        except RateLimitExceeded as e:
+            yield stream_event('error', {"error": str(e), "retry_after": int(e.retry_after)}, fmt)
+        except Exception as e:
+            yield stream_event('error', {"error": str(e)}, fmt)
+
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def athlete_version(*args, **kwargs):
+    """ETag version for routes computed from the athlete's stored history: it changes with every store write."""
+    athlete_id = session.get('athlete_id')
+    if not athlete_id:
+        return None
+    return f"{athlete_id}:{activity_store.revision(athlete_id)}"
+
+
+def athlete_modified(*args, **kwargs):
+    """When the athlete's stored history last changed, the Last-Modified of the same routes."""
+    athlete_id = session.get('athlete_id')
+    return activity_store.modified(athlete_id) if athlete_id else None
+
+
+def plot_version(*args, **kwargs):
+    # Drawn plots also change with the style and the renderer's settings
+    version = athlete_version()
+    renderer = plots.renderer
+    return version and f"{version}:{plots.STYLE_VERSION}:{renderer.format}:{renderer.dpi}:{renderer.size}"
+
+
+def dashboard_version():
+    # Only known once the dashboard is built, since it names its plot job
+    athlete_id = session.get('athlete_id')
+    if not athlete_id:
+        return None
+    revision = activity_store.revision(athlete_id)
+    payload = results.get(dashboard_key(athlete_id, revision, parse_zoom(request.args.get('zoom', ROUTE_ZOOM))))
+    return f"{athlete_id}:{revision}:{payload['plots_job']}" if payload else None
+
+
+@app.route('/dashboard', methods=['GET'])
+@conditional(dashboard_version, results, RESULT_TTL)
+def dashboard_reload():
+    # The dashboard for the history as stored, without a sync; lets a reload skip the OAuth round trip
+    athlete_id = session.get('athlete_id')
+    if not athlete_id or 'access_token' not in session:
+        return jsonify({"error": "Not authenticated"}), 401
+    if not activity_store.revision(athlete_id):
+        return jsonify({"error": "No activities"}), 404
+    zoom = parse_zoom(request.args.get('zoom', ROUTE_ZOOM))
+    if zoom is None:
+        return jsonify({"error": "zoom must be an integer"}), 400
+    revision = activity_store.revision(athlete_id)
+    return jsonify(synced_dashboard(StravaStatsAPI(session['access_token']), athlete_id, zoom, (revision, revision), []))
+
+
+@app.route('/plots/<job_id>', methods=['GET'])
+@conditional(lambda job_id: f"{job_id}:{plots.renderer.format}", results, RESULT_TTL)
+def plot_job(job_id):
+    try:
+        rendered = plots.renderer.result(job_id)
+    except KeyError:
+        return jsonify({"error": "Unknown or expired plot job"}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    if rendered is None:
+        return jsonify({"status": "pending"}), 202
+    return jsonify({"status": "done", "plots": rendered, "mime_type": plots.renderer.mime_type})
+
+
+@app.route('/plots/cache/stats', methods=['GET'])
+def plot_cache_stats():
+    return jsonify(plots.plot_cache.stats())
+
+
+@app.route('/plots/<name>/data', methods=['GET'])
+@conditional(athlete_version, results, RESULT_TTL, athlete_modified)
+def plot_series(name):
+    # Pre-aggregated series for drawing the plots client side; no matplotlib involved
+    if name not in analytics.PLOT_DATA:
+        return jsonify({"error": f"Unknown plot {name}"}), 404
+    athlete_id = session.get('athlete_id')
+    if not athlete_id:
+        return jsonify({"error": "Not authenticated"}), 401
+    max_points = request.args.get('max_points', 500, type=int)
+    revision = activity_store.revision(athlete_id)
+    df = athlete_frame(athlete_id, revision)
+    if df.empty:
+        return jsonify({"error": "No activities"}), 404
+    # Long histories are plotted per bucket, read from the rollups kept up to date by each sync
+    rollups = athlete_rollups(athlete_id, revision)
+    return jsonify(analytics.PLOT_DATA[name](df, max(max_points, 2),
+                                             lambda period, activity_type: rollup_registry.result(rollups, period, activity_type)))
+
+
+@app.route('/plots/paces/histogram', methods=['GET'])
+@conditional(plot_version, results, RESULT_TTL, athlete_modified)
+def pace_histogram():
+    # The pace histogram with the caller's binning, as data plus the figure; image=0 skips the figure
+    athlete_id = session.get('athlete_id')
+    if not athlete_id:
+        return jsonify({"error": "Not authenticated"}), 401
+    options = {
+        'bin_seconds': request.args.get('bin_seconds', 60, type=int),
+        'unit': request.args.get('unit', 'mile'),
+        'weight': request.args.get('weight', 'distance'),
+        'min_distance': request.args.get('min_distance', 100.0, type=float),
+    }
+    if 'outlier_iqr' in request.args:
+        # outlier_iqr=0 keeps every pace inside the hard limits
+        options['outlier_iqr'] = request.args.get('outlier_iqr', type=float) or None
+    if not 5 <= options['bin_seconds'] <= 600:
+        return jsonify({"error": "bin_seconds must be between 5 and 600"}), 400
+    df = athlete_frame(athlete_id)
+    try:
+        if request.args.get('image') == '0':
+            return jsonify({"data": analytics.pace_histogram(df, **options)})
+        data, plot = plots.renderer.pace_histogram(df, **options)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"data": data, "plot": plot, "mime_type": plots.renderer.mime_type})
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/activities/in_bbox', methods=['GET'])
+# Viewports rarely repeat exactly, so bodies aren't kept; revalidation still works
+@conditional(athlete_version, modified=athlete_modified)
+def activities_in_bbox():
+    # Only the routes crossing the viewport, simplified for the zoom they will be drawn at.
+    # bbox is west,south,east,north like Leaflet's LatLngBounds.toBBoxString()
+    athlete_id = session.get('athlete_id')
+    if not athlete_id:
+        return jsonify({"error": "Not authenticated"}), 401
+    try:
+        west, south, east, north = [float(value) for value in request.args['bbox'].split(',')]
+    except (KeyError, ValueError):
+        return jsonify({"error": "Expected bbox=west,south,east,north"}), 400
+    zoom = parse_zoom(request.args.get('zoom', ROUTE_ZOOM))
+    if zoom is None:
+        return jsonify({"error": "zoom must be an integer"}), 400
+
+    index = route_indexes.get(athlete_id, activity_store.revision(athlete_id),
+                              lambda: activity_store.load(athlete_id))
+    activities = index.query(south, west, north, east)
+    return jsonify({"activities": StravaStatsAPI.format_activities(activities, zoom=zoom)})
+
+
+@app.route('/activities/streaks', methods=['GET'])
+@conditional(athlete_version, results, RESULT_TTL, athlete_modified)
+def activity_streaks():
+    # Longest and current streak plus the top streaks with their date ranges
+    athlete_id = session.get('athlete_id')
+    if not athlete_id:
+        return jsonify({"error": "Not authenticated"}), 401
+    top = request.args.get('top', 5, type=int)
+    df = athlete_frame(athlete_id)
+    return jsonify(StravaStatsAPI.activity_streaks(df, top))
+
+
+@app.route('/activities/rollups', methods=['GET'])
+@conditional(athlete_version, results, RESULT_TTL, athlete_modified)
+def activity_rollups():
+    # Weekly, monthly or yearly totals with a rolling trend, served from the incremental rollups
+    athlete_id = session.get('athlete_id')
+    if not athlete_id:
+        return jsonify({"error": "Not authenticated"}), 401
+    period = request.args.get('period', 'week')
+    if period not in analytics.PERIODS:
+        return jsonify({"error": f"period must be one of {', '.join(analytics.PERIODS)}"}), 400
+    # type=all rolls up every activity type together
+    activity_type = request.args.get('type', 'Run')
+    window = request.args.get('window', type=int)
+    if window is not None and window < 1:
+        return jsonify({"error": "window must be positive"}), 400
+    revision = activity_store.revision(athlete_id)
+    rollups = athlete_rollups(athlete_id, revision)
+    return jsonify(rollup_registry.result(rollups, period, None if activity_type == 'all' else activity_type, window))
+
+
+class StravaError(Exception):
+    def __init__(self, response):
+        super().__init__(f"Strava returned {response.status_code}: {response.text[:200]}")
+        self.response = response
+
 
 class StravaStatsAPI:
-    def __init__(self, access_token=None):
+    def __init__(self, access_token=None, refresh_token=None):
         self.access_token = access_token or session.get('access_token')
         if not self.access_token:
             raise ValueError("Failed to retrieve access token.")
         self.header = {'Authorization': 'Bearer ' + self.access_token}
+        # Always the token owner's own refresh token: renewing with the app's
+        # REFRESH_TOKEN would fetch another account's activities into this history
+        self.refresh_token = refresh_token or (session.get('refresh_token') if has_request_context() else None)
+        # Epoch seconds the access token stops working, once a refresh has told us
+        self.expires_at = None
 
     def request_token(self):
-        auth_url = "https://www.strava.com/oauth/token"
+        if not self.refresh_token:
+            raise ValueError("No refresh token to renew the access token with.")
+        auth_url = AUTH_LINK
         data = {
             "client_id": CLIENT_ID,
             "client_secret": CLIENT_SECRET,
-            "refresh_token": REFRESH_TOKEN,
+            "refresh_token": self.refresh_token,
             "grant_type": "refresh_token",
             "f": "json"
         }
-        response = requests.post(auth_url, data=data).json()
-        session['access_token'] = response.get('access_token')
-        session['refresh_token'] = response.get('refresh_token')
-        return session['access_token']
-
-    def fetch_activities(self):
-        activities_url = "https://www.strava.com/api/v3/athlete/activities"
+        response = http.post(auth_url, data=data).json()
+        self.refresh_token = response.get('refresh_token') or self.refresh_token
+        self.expires_at = response.get('expires_at')
+        if has_request_context():
+            session['access_token'] = response.get('access_token')
+            session['refresh_token'] = response.get('refresh_token')
+        return response.get('access_token')
+
+    def fetch_page(self, page, header=None, after=None):
+        param = {'per_page': PAGE_SIZE, 'page': page}
+        if after is not None:
+            param['after'] = after
+        # 429s and server errors are retried here with backoff; anything else,
+        # including a 401, goes back to the caller
+        for attempt in range(MAX_RETRIES):
+            with metrics.span('rate_limit_wait'):
+                strava_limiter.acquire()
+            start = time.perf_counter()
+            response = http.get(API_URL + "/athlete/activities", headers=header or self.header, params=param)
+            metrics.strava_call('athlete/activities', response.status_code, time.perf_counter() - start,
+                                len(response.content), page=page, attempt=attempt)
+            strava_limiter.update(response.headers)
+            if response.status_code == 429:
+                if 'X-RateLimit-Usage' not in response.headers:
+                    strava_limiter.exhaust()
+            elif response.status_code < 500:
+                return response
+            # The last failure goes straight back; there is no retry to wait for
+            if attempt + 1 < MAX_RETRIES:
+                metrics.strava_retries.inc(reason='rate_limited' if response.status_code == 429 else 'server_error')
+                time.sleep(backoff(attempt))
+        return response
+
+    def fetch_activities(self, window=None, after=None):
         all_activities = []
+        for my_dataset in self.iter_activity_pages(window, after):
+            all_activities.extend(my_dataset)
+        return all_activities
+
+    def iter_activity_pages(self, window=None, after=None):
+        """Yields each non-empty page of activities as soon as it and every page before it has arrived."""
+        window = window or FETCH_WINDOW
 
         # If the token is invalid, refresh it
         if not self.access_token:
             self.access_token = self.request_token()
             self.header = {'Authorization': 'Bearer ' + self.access_token}
 
-        request_page_num = 1
-        while True:
-            param = {'per_page': 200, 'page': request_page_num}
-            response = requests.get(activities_url, headers=self.header, params=param)
-            
-            if response.status_code != 200:
-                # Handle token expiration or any other error
-                self.access_token = self.request_token()
-                self.header = {'Authorization': 'Bearer ' + self.access_token}
-                continue  # re-try the request
-
-            my_dataset = response.json()
-            if not my_dataset:
-                break
-
-            all_activities.extend(my_dataset)
-            request_page_num += 1
-        
-        return all_activities
+        fetch_page = metrics.carry(self.fetch_page)
+
+        # Keep up to `window` pages in flight and consume them strictly in page
+        # order, so the result is identical to fetching one page at a time
+        with ThreadPoolExecutor(max_workers=window) as pool:
+            pending = deque()
+            next_page = 1
+            refreshes = 0
+            try:
+                while True:
+                    while len(pending) < window:
+                        pending.append((next_page, self.header, pool.submit(fetch_page, next_page, self.header, after)))
+                        next_page += 1
+
+                    page, header, future = pending.popleft()
+                    response = future.result()
+
+                    if response.status_code == 401 and refreshes < MAX_TOKEN_REFRESHES:
+                        # Token expired. Refreshing touches the session, so it stays
+                        # on this thread, and pages sent with an already replaced
+                        # token are just re-sent.
+                        if header is self.header:
+                            with metrics.span('token_refresh'):
+                                self.access_token = self.request_token()
+                            self.header = {'Authorization': 'Bearer ' + self.access_token}
+                            metrics.token_refreshes.inc()
+                            refreshes += 1
+                        pending.appendleft((page, self.header, pool.submit(fetch_page, page, self.header, after)))
+                        continue  # re-try the request
+
+                    if response.status_code != 200:
+                        raise StravaError(response)
+
+                    my_dataset = response.json()
+                    if my_dataset:
+                        yield my_dataset
+
+                    # An empty or short page is the last one
+                    if len(my_dataset) < PAGE_SIZE:
+                        break
+            finally:
+                # Drop whatever is still queued, also when the consumer stops early
+                for _, _, queued in pending:
+                    queued.cancel()
+
+    def sync_activities(self, athlete_id, store=None):
+        """Pull only activities newer than the stored cursor, merge them and return the full history."""
+        store = store or activity_store
+        self.pull_new_activities(athlete_id, store)
+        return store.load(athlete_id)
+
+    def pull_new_activities(self, athlete_id, store=None):
+        """
+        Fetches and stores the activities after the athlete's cursor.
+        :return (list, (int, int)): just those activities, and the store revision before and after merging them
+        """
+        store = store or activity_store
+        cursor = store.cursor(athlete_id)
+        if cursor is None:
+            activities = self.fetch_activities()
+        else:
+            # The delta for a returning athlete almost always fits in one page,
+            # so don't speculatively request the pages after it
+            activities = self.fetch_activities(window=1, after=max(cursor - SYNC_LOOKBACK, 0))
+        return activities, store.merge(athlete_id, activities)
 
-    def format_activities(self, activities):
+    @staticmethod
+    def format_activities(activities, zoom=None):
         formatted_activities = []
 
         for activity in activities:
+            positions = activity['map']['summary_polyline']
+            simplified = activity['map'].get('simplified')
+            if simplified and simplified['zoom'] == zoom:
+                positions = simplified['polyline']
+            elif zoom is not None:
+                positions = route_cache.get(activity.get('id'), positions, zoom)
+
             formatted_activity = {
-                'activityPositions': activity['map']['summary_polyline'],
+                'activityPositions': positions,
                 'activityName': activity.get('name', ''),
                 'activityType': activity.get('type', ''),
                 'activityDistance': activity.get('distance', 0),
@@ -195,242 +764,33 @@ class StravaStatsAPI:
 
         return formatted_activities
 
-    def running_stats(self, df) -> tuple:
-        total_distance = 0
-        total_time_moving = 0
-        total_elevation_gain = 0
-        fastest_speed = 0
-        farthest_run = 0
-        total_runs = 0
-        shortest_run = float("inf")
-        max_altitude = 0
-
-        for i, activity in df.iterrows():
-            if activity['type'] == 'Run':
-                total_distance += activity['distance']
-                total_time_moving += activity['moving_time']
-                total_elevation_gain += activity['total_elevation_gain']
-                fastest_speed = max(fastest_speed, activity['max_speed'])
-                farthest_run = max(farthest_run, activity['distance'])
-                shortest_run = min(shortest_run, activity['distance'])
-                max_altitude = max(max_altitude, activity['elev_high'])
-                total_runs += 1
-
-        total_distance = round(total_distance/1609, 2) # divide by 1609 to convert meters to miles
-        total_time_moving = round(total_time_moving/3600, 2) # divide by 3600 to convert seconds to hours
-        total_elevation_gain = round(total_elevation_gain, 2) 
-        avg_speed_all_time = round(total_distance/total_time_moving, 2) if total_time_moving else 0 # multiply by 1.609 to convert km to mile
-        avg_pace = round(60/avg_speed_all_time, 2) if avg_speed_all_time else 0
-        avg_dist_per_run = round((total_distance/total_runs), 2) if total_runs else 0
-        avg_elev_gain = round((total_elevation_gain/total_runs), 2) if total_runs else 0
-        fastest_speed = round(fastest_speed, 2)
-        longest_streak = self.longest_activity_streak(df)
-        farthest_run = round(farthest_run/1609, 2)
-        shortest_run = round(shortest_run/1609, 2)
-        max_altitude = round(max_altitude, 2)
-
-
-        return {
-            "total_runs": total_runs,
-            "total_distance": total_distance,
-            "total_time_moving": total_time_moving,
-            "total_elevation_gain": total_elevation_gain,
-            "avg_speed_all_time": avg_speed_all_time,
-            "avg_pace": avg_pace,
-            "avg_dist_per_run": avg_dist_per_run,
-            "avg_elev_gain": avg_elev_gain,
-            "fastest_speed": fastest_speed,
-            "longest_streak": longest_streak,
-            "farthest_run": farthest_run,
-            'shortest_run': shortest_run,
-            'max_altitude': max_altitude
-        }
-    
-    def longest_activity_streak(self, df) -> int:
-        if df.empty:
-            return 0
-
-        # Convert the 'start_date' column to a pandas datetime object
-        df['start_date'] = pd.to_datetime(df['start_date']).dt.date
-
-        # Drop duplicates to consider only one activity per day
-        df = df.drop_duplicates(subset='start_date')
-
-        # Sort the dataframe by date
-        df = df.sort_values(by='start_date')
+    def running_stats(self, df) -> dict:
+        return analytics.running_stats(df)
 
-        # Calculate the difference between every consecutive date
-        df['diff'] = df['start_date'].diff().dt.days
-
-        streak = 1
-        max_streak = 1
-
-        for diff in df['diff']:
-            # If the difference between dates is 1 day, continue the streak
-            if diff == 1.0:
-                streak += 1
-                max_streak = max(max_streak, streak)
-            # If the difference is greater (to account for same-day activities), reset streak
-            elif diff > 1.0:
-                streak = 1
+    def longest_activity_streak(self, df) -> int:
+        return analytics.longest_activity_streak(df)
 
-        return max_streak
+    @staticmethod
+    def activity_streaks(df, top=5) -> dict:
+        return analytics.activity_streaks(df, top)
 
 
     def generate_plot_response(self, fig):
-        """Convert matplotlib figure to base64 encoded PNG."""
-        buf = io.BytesIO()
-        fig.savefig(buf, format='png')
-        plt.close(fig)
-        return base64.b64encode(buf.getvalue()).decode('utf-8')
+        import figures
+        return figures.generate_plot_response(fig, plots.renderer.format, plots.renderer.dpi)
 
     def plot_paces(self, df):
-        miles_by_pace = defaultdict(float)
-        for index, activity in df.iterrows():
-            if activity['type'] == 'Run':
-                distance_miles = activity['distance'] * 0.00062137
-                moving_time_minutes = activity['moving_time'] / 60.0
-                pace = moving_time_minutes / distance_miles 
-                rounded_pace = round(pace)
-                miles_by_pace[rounded_pace] += distance_miles
-
-        paces = list(miles_by_pace.keys())
-        miles = [miles_by_pace[pace] for pace in paces]
-        sorted_indices = sorted(range(len(paces)), key=lambda k: paces[k])
-        paces = [paces[i] for i in sorted_indices]
-        miles = [miles[i] for i in sorted_indices]
-
-        # Specify colors
-        colors = ['#F4BFBF', '#8EA7E9', '#FAF0D7', '#8CC0DE']
-
-        fig, ax = plt.subplots()
-        bars = ax.bar(paces, miles, color=colors, width=0.8)
-        ax.grid(True, which='minor')
-        
-        ax.set_xlabel('Pace (minutes per mile)')
-        ax.set_ylabel('Total Miles Run')
-        ax.set_title('Miles Run at Different Paces')
-        ax.set_xlim([5, 14])
-        
-        xticks = np.arange(5, 16, 1)
-        xticklabels = [f"{i}" for i in xticks]
-        
-        ax.set_xticks(xticks)
-        ax.set_xticklabels(xticklabels)
-        
-        for bar in bars:
-            yval = bar.get_height()
-            ax.text(bar.get_x() + bar.get_width() / 2, yval, round(yval, 2), va='bottom', ha='center')
-        
-        return self.generate_plot_response(fig)
-
-    def plot_average_speed_over_time(self, df) -> None:
-        x = pd.to_datetime(df['start_date_local'])
-        y = df['average_speed']
-
-        # Create a figure object and add subplot to it.
-        fig = plt.figure()
-        ax1 = fig.add_subplot(111)
-
-        # Create a scatter plot with colors based on the average speed, using a colormap 'viridis'
-        sc = ax1.scatter(x, y, c=y, cmap='Pastel2')
-        # Add a color bar to indicate what colors mean in terms of average_speed
-        plt.colorbar(sc)
-
-        # Set the title of the plot
-        ax1.set_title('Average Speed over Time')
-
-        # Convert datetime to numerical format for curve fitting
-        x2 = mdates.date2num(x)
-
-        # Calculate the linear fit (polynomial of degree 1)
-        z = np.polyfit(x2, y, 1)
-        # Create a polynomial object
-        p = np.poly1d(z)
-        # Plot the trend line in red, with dashed style
-        plt.plot(x, p(x2), 'r--')
-
-        # Auto-format the x-axis to better fit the date labels, rotate them by 45 degrees
-        fig.autofmt_xdate(rotation=45)
-
-        # Make sure layout looks tight and nice
-        fig.tight_layout()
+        return plots.render('paces', df)
 
-        return self.generate_plot_response(fig)
-
-
-    def plot_distance_over_time(self, df) -> None:
-        # Convert 'start_date_local' column to datetime format and store it in variable x
-        x = pd.to_datetime(df['start_date_local'])
-
-        # Store 'distance' column values in variable y
-        y = df['distance']
-
-        # Create a figure object for the plot
-        fig = plt.figure()
-
-        # Add a subplot to the figure object
-        ax1 = fig.add_subplot(111)
-
-        # Create a scatter plot where color is based on distance, using colormap 'viridis'
-        sc = ax1.scatter(x, y, c=y, cmap='Pastel2')
-
-        # Add a color bar to show what the colors mean in terms of distance
-        plt.colorbar(sc)
-
-        # Set the title of the plot
-        ax1.set_title('Distance over Time')
-        ax1.set_ylabel('Distance (meters)')
-
-        # Convert datetime x-values to a numerical format suitable for curve fitting
-        x2 = mdates.date2num(x)
-
-        # Calculate the linear fit (polynomial of degree 1)
-        z = np.polyfit(x2, y, 1)
-
-        # Create a polynomial object for the trend line
-        p = np.poly1d(z)
-
-        # Plot the trend line in red, with a dashed style
-        plt.plot(x, p(x2), 'r--')
-
-        # Auto-format x-axis dates and rotate labels for better visibility
-        fig.autofmt_xdate(rotation=45)
-
-        # Ensure layout is tight and clean
-        fig.tight_layout()
-
-        return self.generate_plot_response(fig)
+    def plot_average_speed_over_time(self, df):
+        return plots.render('average_speed_over_time', df)
 
+    def plot_distance_over_time(self, df):
+        return plots.render('distance_over_time', df)
 
     def plot_runs_by_weekday(self, df):
-        # Convert the 'start_date_local' column to datetime format
-        df['start_date_local'] = pd.to_datetime(df['start_date_local'])
-
-        # Extract only the 'Run' activities and the start date
-        run_df = df[df['type'] == 'Run']
-        run_days = run_df['start_date_local'].dt.day_name()
-
-        # Count the occurrences of each weekday
-        weekday_counts = Counter(run_days)
-
-        # Sort by day of the week
-        days_of_week = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-        counts = [weekday_counts.get(day, 0) for day in days_of_week]
-
-        # Specify colors
-        colors = ['#F4BFBF', '#8EA7E9', '#FAF0D7', '#8CC0DE']
-
-        # Create bar plot
-        fig = plt.figure(figsize=(10, 6))
-        plt.bar(days_of_week, counts, color=colors)
-        plt.xlabel('Day of the Week')
-        plt.ylabel('Number of Runs')
-        plt.title('Frequency of Runs by Day of the Week')
-        
-        return self.generate_plot_response(fig)
-    
-# Add other routes for your plots as well, maybe sending back just the data needed to create the plots on the frontend
+        return plots.render('runs_by_weekday', df)
+
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=80)
@@ -0,0 +1,285 @@
+"""
+ASGI entry point. /callback, which spends most of its time waiting on Strava,
+runs on the event loop with one process-wide keep-alive HTTP/2 client, so a
+single worker overlaps many athletes' downloads. Every other route is served
+by the WSGI app in app.py.
+
+    hypercorn asgi:app --bind 0.0.0.0:80
+"""
+import asyncio
+import os
+import time
+from collections import deque
+
+import httpx
+from hypercorn.middleware import AsyncioWSGIMiddleware
+from quart import Quart, Response, g, jsonify, request, session
+from quart.sessions import SessionInterface
+
+import app as wsgi
+from geometry import parse_zoom
+import metrics
+from ratelimit import RateLimitExceeded, backoff
+from singleflight import AsyncSingleFlight
+
+
+class ServerSessions(SessionInterface):
+    """The Flask app's server-side sessions, with the store calls moved off the event loop."""
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+
+    async def open_session(self, app, request):
+        return await asyncio.to_thread(self.sessions.open_session, app, request)
+
+    async def save_session(self, app, session, response):
+        await asyncio.to_thread(self.sessions.save_session, app, session, response)
+
+
+quart_app = Quart(__name__)
+# Same key and session store as the Flask app so both halves share sessions
+quart_app.secret_key = wsgi.app.secret_key
+quart_app.session_interface = ServerSessions(wsgi.app.session_interface)
+
+# Concurrent logins of one athlete on this worker share one download and compute
+login_flight = AsyncSingleFlight()
+
+# Upper bound on concurrent connections to Strava from this worker
+MAX_CONNECTIONS = int(os.environ.get('STRAVA_MAX_CONNECTIONS', 20))
+client = None
+
+
+@quart_app.before_serving
+async def open_client():
+    global client
+    client = httpx.AsyncClient(
+        http2=True,
+        timeout=30.0,
+        limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS),
+    )
+
+
+@quart_app.after_serving
+async def close_client():
+    await client.aclose()
+    if wsgi.prefetcher is not None:
+        # Let a background refresh in progress finish before the worker exits
+        await asyncio.to_thread(wsgi.prefetcher.stop)
+
+
+@quart_app.after_request
+async def allow_cors(response):
+    # What flask-cors does for the Flask app: only the frontend's origins, with its cookies
+    origin = request.headers.get('Origin')
+    if origin in wsgi.FRONTEND_ORIGINS:
+        response.headers['Access-Control-Allow-Origin'] = origin
+        response.headers['Access-Control-Allow-Credentials'] = 'true'
+    response.vary.add('Origin')
+    return response
+
+
+@quart_app.before_request
+async def start_request_metrics():
+    g.metrics_token = metrics.begin_request(request.method, request.path)
+
+
+@quart_app.after_request
+async def record_response_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+@quart_app.teardown_request
+async def finish_request_metrics(exc):
+    # As in app.py: views that raise are counted too
+    endpoint = request.url_rule.rule if request.url_rule else None
+    metrics.end_request(g.pop('metrics_token', None), endpoint, 500 if exc else g.pop('metrics_status', 500))
+
+
+class AsyncStravaAPI:
+    """The I/O half of StravaStatsAPI for the event loop."""
+
+    def __init__(self, access_token, refresh_token=None):
+        self.access_token = access_token
+        self.header = {'Authorization': 'Bearer ' + access_token}
+        # The athlete's own, never the app's REFRESH_TOKEN; see StravaStatsAPI
+        self.refresh_token = refresh_token
+
+    async def request_token(self):
+        if not self.refresh_token:
+            raise ValueError("No refresh token to renew the access token with.")
+        data = {
+            "client_id": wsgi.CLIENT_ID,
+            "client_secret": wsgi.CLIENT_SECRET,
+            "refresh_token": self.refresh_token,
+            "grant_type": "refresh_token",
+            "f": "json"
+        }
+        response = (await client.post(wsgi.AUTH_LINK, data=data)).json()
+        self.refresh_token = response.get('refresh_token') or self.refresh_token
+        session['access_token'] = response.get('access_token')
+        session['refresh_token'] = response.get('refresh_token')
+        return session['access_token']
+
+    async def fetch_page(self, page, header, after=None):
+        param = {'per_page': wsgi.PAGE_SIZE, 'page': page}
+        if after is not None:
+            param['after'] = after
+        # 429s and server errors are retried here with backoff, like StravaStatsAPI.fetch_page
+        for attempt in range(wsgi.MAX_RETRIES):
+            with metrics.span('rate_limit_wait'):
+                await wsgi.strava_limiter.acquire_async()
+            start = time.perf_counter()
+            response = await client.get(wsgi.API_URL + "/athlete/activities", headers=header, params=param)
+            metrics.strava_call('athlete/activities', response.status_code, time.perf_counter() - start,
+                                len(response.content), page=page, attempt=attempt)
+            wsgi.strava_limiter.update(response.headers)
+            if response.status_code == 429:
+                if 'X-RateLimit-Usage' not in response.headers:
+                    wsgi.strava_limiter.exhaust()
+            elif response.status_code < 500:
+                return response
+            if attempt + 1 < wsgi.MAX_RETRIES:
+                metrics.strava_retries.inc(reason='rate_limited' if response.status_code == 429 else 'server_error')
+                await asyncio.sleep(backoff(attempt))
+        return response
+
+    async def iter_activity_pages(self, window=None, after=None):
+        """Same windowed, in-order paging as StravaStatsAPI.iter_activity_pages, with tasks instead of threads."""
+        window = window or wsgi.FETCH_WINDOW
+        pending = deque()
+        next_page = 1
+        refreshes = 0
+        try:
+            while True:
+                while len(pending) < window:
+                    task = asyncio.create_task(self.fetch_page(next_page, self.header, after))
+                    pending.append((next_page, self.header, task))
+                    next_page += 1
+
+                page, header, task = pending.popleft()
+                response = await task
+
+                if response.status_code == 401 and refreshes < wsgi.MAX_TOKEN_REFRESHES:
+                    if header is self.header:
+                        with metrics.span('token_refresh'):
+                            self.access_token = await self.request_token()
+                        self.header = {'Authorization': 'Bearer ' + self.access_token}
+                        metrics.token_refreshes.inc()
+                        refreshes += 1
+                    task = asyncio.create_task(self.fetch_page(page, self.header, after))
+                    pending.appendleft((page, self.header, task))
+                    continue
+
+                if response.status_code != 200:
+                    raise wsgi.StravaError(response)
+
+                my_dataset = response.json()
+                if my_dataset:
+                    yield my_dataset
+
+                if len(my_dataset) < wsgi.PAGE_SIZE:
+                    break
+        finally:
+            for _, _, task in pending:
+                task.cancel()
+
+    async def fetch_activities(self, window=None, after=None):
+        all_activities = []
+        async for my_dataset in self.iter_activity_pages(window, after):
+            all_activities.extend(my_dataset)
+        return all_activities
+
+    async def pull_new_activities(self, athlete_id):
+        store = wsgi.activity_store
+        cursor = await asyncio.to_thread(store.cursor, athlete_id)
+        if cursor is None:
+            activities = await self.fetch_activities()
+        else:
+            activities = await self.fetch_activities(window=1, after=max(cursor - wsgi.SYNC_LOOKBACK, 0))
+        return activities, await asyncio.to_thread(store.merge, athlete_id, activities)
+
+    async def sync_dashboard(self, athlete_id, zoom):
+        """wsgi.sync_dashboard with the Strava I/O on the event loop."""
+        with metrics.span('sync') as span:
+            delta, revisions = await self.pull_new_activities(athlete_id)
+            span.annotate(activities=len(delta))
+        # Loading, stats and formatting are blocking or CPU work; keep them off the event loop
+        return await asyncio.to_thread(wsgi.synced_dashboard, wsgi.StravaStatsAPI(self.access_token, self.refresh_token),
+                                       athlete_id, zoom, revisions, delta)
+
+
+@quart_app.route('/callback', methods=['POST', 'OPTIONS'])
+async def callback():
+    if request.method == 'OPTIONS':
+        resp = Response("OK", content_type='application/json')
+        resp.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
+        resp.headers['Access-Control-Allow-Headers'] = 'content-type'
+        return resp
+
+    data = await request.get_json(silent=True)
+    if not data:
+        return jsonify({"error": "Expected JSON"}), 400
+
+    code = data.get('code')
+    zoom = parse_zoom(data.get('zoom', wsgi.ROUTE_ZOOM))
+    stream = data.get('stream')
+
+    if not code:
+        return jsonify({"error": "No code provided"}), 400
+    if zoom is None:
+        return jsonify({"error": "zoom must be an integer"}), 400
+
+    try:
+        with metrics.span('token_exchange'):
+            response = await client.post(wsgi.AUTH_LINK, data={
+                "client_id": wsgi.CLIENT_ID,
+                "client_secret": wsgi.CLIENT_SECRET,
+                "code": code,
+                "grant_type": "authorization_code"
+            })
+        response_data = response.json()
+
+        if not (response.is_success and "access_token" in response_data):
+            return jsonify(response_data), 400
+
+        access_token = response_data.get('access_token')
+        refresh_token = response_data.get('refresh_token')
+        session.rotate()
+        session['access_token'] = access_token
+        session['refresh_token'] = refresh_token
+
+        athlete_id = (response_data.get('athlete') or {}).get('id')
+        if athlete_id:
+            session['athlete_id'] = athlete_id
+        # Both write to stores that may be SQLite; keep them off the event loop
+        await asyncio.to_thread(wsgi.register_login, athlete_id, response_data)
+
+        if stream:
+            ticket = await asyncio.to_thread(wsgi.issue_stream_ticket, access_token, refresh_token, athlete_id, zoom)
+            return jsonify({"message": "Authentication successful", "access_token": access_token, "stream": f"/stream/{ticket}"})
+
+        strava = AsyncStravaAPI(access_token, refresh_token)
+
+        if athlete_id:
+            payload = await login_flight.do((athlete_id, zoom), lambda: strava.sync_dashboard(athlete_id, zoom))
+        else:
+            all_activities = await strava.fetch_activities()
+            payload = await asyncio.to_thread(wsgi.dashboard, wsgi.StravaStatsAPI(access_token, refresh_token), all_activities, zoom)
+        return jsonify({"message": "Authentication successful", "access_token": access_token, **payload})
+    except RateLimitExceeded as e:
+        return jsonify({"error": str(e)}), 429, {'Retry-After': str(int(e.retry_after))}
+    except Exception as e:
+        return jsonify({"error": str(e)})
+
+
+# Paths handled on the event loop; everything else goes to the Flask app on a thread
+ASYNC_PATHS = {'/callback'}
+flask_app = AsyncioWSGIMiddleware(wsgi.app)
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan' or scope.get('path') in ASYNC_PATHS:
+        await quart_app(scope, receive, send)
+    else:
+        await flask_app(scope, receive, send)
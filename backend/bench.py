@@ -0,0 +1,274 @@
+"""
+Benchmarks for the per-login pipeline: every stage /callback runs, from the
+typed table and stats to each plot, plus the whole login end to end against
+the local Strava stub. Runs over synthetic histories of 100 to 50k activities
+and appends the timings to a JSON lines history, so each run can be compared
+with the previous one from the same machine.
+
+This is a runner of its own rather than part of the pytest suite: the tests
+check behaviour on small inputs and should stay fast, while these runs take
+minutes at the larger sizes and are only meaningful against the recorded
+history, which outlives any one pytest session.
+
+    python bench.py --sizes 100 1000 10000 50000
+    python bench.py --sizes 1000 --cases running_stats plot_paces --fail-on-regression
+    python bench.py --sizes 10000 --cases frame --memory
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+
+
+HISTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_history.jsonl')
+# Login codes the stub maps to athlete ids; every size logs in fresh athletes
+CODES = itertools.count(10 ** 6)
+
+
+def measure(fn, setup=None, repeat=5, budget=10.0):
+    """
+    Times `fn` up to `repeat` times, stopping early once `budget` seconds are spent.
+    `setup` runs untimed before every call and its result is passed to `fn`.
+    :return list: seconds per call
+    """
+    timings = []
+    spent = time.perf_counter()
+    while len(timings) < repeat and (not timings or time.perf_counter() - spent < budget):
+        argument = setup() if setup else None
+        start = time.perf_counter()
+        fn(argument) if setup else fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+class Pipeline:
+    """The web app wired to a stub Strava serving `activities`, with the plot cache off so every run draws."""
+
+    def __init__(self, activities):
+        import app
+        from stub_strava import serve
+
+        self.app = app
+        self.server = serve(activities, 0.0, limits=(10 ** 9, 10 ** 9))
+        base = f"http://127.0.0.1:{self.server.server_port}"
+        app.API_URL = base + "/api/v3"
+        app.AUTH_LINK = base + "/oauth/token"
+        app.strava_limiter.limits = [10 ** 9, 10 ** 9]
+        app.plots.renderer.cache = None
+        self.client = app.app.test_client()
+
+    def login(self, code):
+        response = self.client.post('/callback', json={'code': str(code)})
+        payload = response.get_json()
+        if 'stats' not in payload:
+            raise RuntimeError(f"/callback failed: {payload}")
+        return payload
+
+    def wait_for_plots(self, job_id):
+        while True:
+            response = self.client.get(f'/plots/{job_id}')
+            if response.status_code == 200:
+                return response.get_json()['plots']
+            if response.status_code != 202:
+                raise RuntimeError(f"/plots failed: {response.get_json()}")
+            time.sleep(0.005)
+
+    def close(self):
+        self.server.shutdown()
+
+
+def loop_longest_streak(df):
+    """The longest streak as computed before analytics.streaks: date objects, drop_duplicates, then a Python loop."""
+    import pandas as pd
+    df = df[['start_date']].copy()
+    df['start_date'] = pd.to_datetime(df['start_date']).dt.date
+    df = df.drop_duplicates(subset='start_date').sort_values(by='start_date')
+    df['diff'] = df['start_date'].diff().dt.days
+    streak = max_streak = 1
+    for diff in df['diff']:
+        if diff == 1.0:
+            streak += 1
+            max_streak = max(max_streak, streak)
+        elif diff > 1.0:
+            streak = 1
+    return max_streak
+
+
+def cases(activities, pipeline):
+    """Every benchmark for one history, as name -> (fn, setup or None)."""
+    import analytics
+    import figures
+    from analytics import columns
+    from app import ROUTE_ZOOM, StravaStatsAPI
+    from geometry import route_cache
+
+    api = StravaStatsAPI('bench')
+    df = columns.frame(activities)
+    plot_df = df[[column for column in pipeline.app.plots.PLOT_COLUMNS if column in df]]
+
+    def figure():
+        import matplotlib.pyplot as plt
+        fig, ax = plt.subplots()
+        ax.scatter(plot_df['start_date_local'], plot_df['distance'], c=plot_df['distance'], cmap='Pastel2')
+        return fig
+
+    fresh_athlete = lambda: next(CODES)
+    warm_athlete = next(CODES)
+    pipeline.login(warm_athlete)
+
+    return {
+        'frame': (lambda: columns.frame(activities), None),
+        'format_activities': (lambda: api.format_activities(activities, zoom=ROUTE_ZOOM), None),
+        'format_activities_cold': (lambda _: api.format_activities(activities, zoom=ROUTE_ZOOM),
+                                   route_cache.entries.clear),
+        'running_stats': (lambda: api.running_stats(df), None),
+        'longest_activity_streak': (lambda: api.longest_activity_streak(df), None),
+        'longest_streak_loop': (lambda: loop_longest_streak(df), None),
+        'activity_streaks': (lambda: analytics.activity_streaks(df, 10), None),
+        'pace_histogram': (lambda: analytics.pace_histogram(df, bin_seconds=15), None),
+        'plot_paces': (lambda: api.plot_paces(plot_df), None),
+        'plot_average_speed_over_time': (lambda: api.plot_average_speed_over_time(plot_df), None),
+        'plot_distance_over_time': (lambda: api.plot_distance_over_time(plot_df), None),
+        'plot_runs_by_weekday': (lambda: api.plot_runs_by_weekday(plot_df), None),
+        'generate_plot_response': (figures.generate_plot_response, figure),
+        # A first login: full download, store, stats and plot job
+        'callback_cold': (pipeline.login, fresh_athlete),
+        # A returning athlete: one incremental page on top of the stored history
+        'callback_warm': (lambda: pipeline.login(warm_athlete), None),
+        # A first login until its plots are ready to show
+        'callback_cold_with_plots': (lambda code: pipeline.wait_for_plots(pipeline.login(code)['plots_job']),
+                                     fresh_athlete),
+    }
+
+
+CASE_NAMES = ['frame', 'format_activities', 'format_activities_cold', 'running_stats',
+              'longest_activity_streak', 'longest_streak_loop', 'activity_streaks', 'pace_histogram', 'plot_paces', 'plot_average_speed_over_time',
+              'plot_distance_over_time', 'plot_runs_by_weekday', 'generate_plot_response',
+              'callback_cold', 'callback_warm', 'callback_cold_with_plots']
+
+
+def memory_per_activity(activities) -> dict:
+    """Bytes per activity held as raw dicts, as an object DataFrame and as the typed table."""
+    import tracemalloc
+
+    import pandas as pd
+    from analytics import columns
+
+    # Round-trip through JSON so the dicts look like what requests hands back
+    payload = json.dumps(activities)
+    tracemalloc.start()
+    raw = json.loads(payload)
+    raw_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    sizes = {
+        'raw dicts': raw_bytes,
+        'object DataFrame': pd.DataFrame(raw).memory_usage(deep=True).sum(),
+        'typed table': columns.frame(raw).memory_usage(deep=True).sum(),
+    }
+    return {label: size / max(len(activities), 1) for label, size in sizes.items()}
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def machine():
+    return f"{platform.node()}/{platform.machine()}/{os.cpu_count()}cpu/py{platform.python_version()}"
+
+
+def previous_run(path, host):
+    """Median per (case, activities) of the latest earlier run recorded on `host`."""
+    if not os.path.exists(path):
+        return {}
+    runs = {}
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            if record['machine'] == host:
+                runs.setdefault(record['run'], {})[(record['case'], record['activities'])] = record['median']
+    return runs[list(runs)[-1]] if runs else {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 50000])
+    parser.add_argument('--cases', nargs='+', choices=CASE_NAMES, default=CASE_NAMES)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=10.0, help="seconds per case before repeats stop")
+    parser.add_argument('--history', default=HISTORY, help="JSON lines file the results are appended to")
+    parser.add_argument('--threshold', type=float, default=0.2, help="slowdown that counts as a regression")
+    parser.add_argument('--fail-on-regression', action='store_true')
+    parser.add_argument('--no-record', action='store_true', help="compare without appending to the history")
+    parser.add_argument('--memory', action='store_true', help="also report bytes per activity for each size")
+    args = parser.parse_args()
+
+    # The app opens its activity and state stores at import time
+    workdir = tempfile.mkdtemp()
+    os.environ.setdefault('ACTIVITY_DB', os.path.join(workdir, 'bench.db'))
+    os.environ.setdefault('STATE_DB', os.path.join(workdir, 'state.db'))
+    # and would start the prefetcher, whose Strava traffic runs alongside the timings
+    os.environ['PREFETCH_INTERVAL'] = '0'
+    from stub_strava import synthetic_activities
+
+    host = machine()
+    baseline = previous_run(args.history, host)
+    run = {'run': uuid.uuid4().hex[:12], 'commit': commit(), 'machine': host,
+           'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds')}
+    records = []
+    regressions = 0
+
+    print(f"{'case':<30}{'activities':>11}{'best':>11}{'median':>11}{'change':>10}")
+    for size in args.sizes:
+        activities = synthetic_activities(size, seed=size)
+        pipeline = Pipeline(activities)
+        try:
+            benchmarks = cases(activities, pipeline)
+            for name in args.cases:
+                fn, setup = benchmarks[name]
+                # One untimed call so imports and worker start-up don't count
+                fn(setup()) if setup else fn()
+                timings = measure(fn, setup, args.repeat, args.budget)
+                median = statistics.median(timings)
+                records.append({**run, 'case': name, 'activities': size, 'best': min(timings),
+                                'median': median, 'runs': len(timings)})
+
+                change = ''
+                before = baseline.get((name, size))
+                if before:
+                    ratio = median / before - 1
+                    change = f"{ratio:+.0%}"
+                    if ratio > args.threshold:
+                        change += ' !'
+                        regressions += 1
+                print(f"{name:<30}{size:>11}{min(timings) * 1000:>9.1f}ms{median * 1000:>9.1f}ms{change:>10}",
+                      flush=True)
+        finally:
+            pipeline.close()
+        if args.memory:
+            for label, per_activity in memory_per_activity(activities).items():
+                print(f"{'memory: ' + label:<30}{size:>11}{per_activity:>11.0f} bytes/activity", flush=True)
+
+    if not args.no_record:
+        with open(args.history, 'a') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+    if regressions:
+        print(f"{regressions} case(s) more than {args.threshold:.0%} slower than the previous run on this machine")
+    pipeline.app.plots.renderer.shutdown()
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
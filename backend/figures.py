@@ -0,0 +1,245 @@
+"""
+The dashboard's matplotlib figures, each returned base64 encoded. Only the
+processes that actually draw import this module.
+
+render() draws through templates: every worker builds each plot's figure,
+axes, labels, colorbar and fixed layout once, and later calls only swap the
+data artists before encoding. Timing and size per output format:
+
+    python figures.py --activities 100 1000 10000
+"""
+import abc
+import io
+import base64
+import threading
+import matplotlib
+import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
+from matplotlib.figure import Figure
+from matplotlib.ticker import MaxNLocator
+import pandas as pd
+import numpy as np
+from analytics import pace_histogram, time_series, weekday_counts
+
+
+matplotlib.use('Agg')
+
+
+def encode(fig, fmt='png', dpi=None):
+    """Figure to base64 encoded png, webp or svg."""
+    buf = io.BytesIO()
+    fig.savefig(buf, format=fmt, dpi=dpi)
+    return base64.b64encode(buf.getvalue()).decode('utf-8')
+
+
+def generate_plot_response(fig, fmt='png', dpi=None):
+    """Convert matplotlib figure to base64 encoded PNG (or `fmt`) and close it."""
+    encoded = encode(fig, fmt, dpi)
+    plt.close(fig)
+    return encoded
+
+
+COLORS = ['#F4BFBF', '#8EA7E9', '#FAF0D7', '#8CC0DE']
+
+
+class FigureTemplate(abc.ABC):
+    """
+    One plot's figure with everything but the data built up front. Figures
+    come from matplotlib.figure directly rather than pyplot, so they never
+    enter pyplot's global figure list and are never closed.
+    """
+
+    size = (6.4, 4.8)
+    # Fixed margins, in place of a tight_layout pass on every render
+    margins = {'left': 0.125, 'right': 0.9, 'bottom': 0.11, 'top': 0.88}
+
+    def __init__(self, size=None, dpi=100):
+        self.fig = Figure(figsize=size or self.size, dpi=dpi)
+        self.fig.subplots_adjust(**self.margins)
+        self.ax = self.fig.add_subplot()
+        self.lock = threading.Lock()
+        self.build()
+
+    @abc.abstractmethod
+    def build(self):
+        """Adds everything that doesn't depend on the data to self.ax."""
+
+    @abc.abstractmethod
+    def draw(self, df, **options):
+        """Swaps in the data for `df` and returns it, or None if there's nothing worth returning."""
+
+    def render(self, df, fmt='png', **options):
+        """
+        :return (dict, str): the plotted data, and the base64 encoded figure
+        """
+        with self.lock:
+            data = self.draw(df, **options)
+            return data, encode(self.fig, fmt)
+
+
+class PacesTemplate(FigureTemplate):
+    margins = {'left': 0.12, 'right': 0.95, 'bottom': 0.11, 'top': 0.92}
+    # More bars than this and the value labels run into each other
+    max_labels = 10
+    value_names = {'miles': 'Miles', 'km': 'Kilometers', 'minutes': 'Minutes'}
+
+    def build(self):
+        ax = self.ax
+        ax.grid(True, which='minor')
+        ax.xaxis.set_major_locator(MaxNLocator(integer=True, steps=[1, 2, 5, 10]))
+        self.bars = None
+        self.labels = []
+
+    def draw(self, df, **options):
+        histogram = pace_histogram(df, **options)
+        paces, values = histogram['paces'], histogram['values']
+        if self.bars is not None:
+            self.bars.remove()
+        for label in self.labels:
+            label.remove()
+
+        width = histogram['bin_seconds'] / 60
+        self.bars = self.ax.bar(paces, values, color=COLORS, width=width * 0.8)
+        self.labels = [self.ax.text(pace, total, round(total, 2), va='bottom', ha='center')
+                       for pace, total in zip(paces, values)] if len(paces) <= self.max_labels else []
+
+        name = self.value_names[histogram['value_unit']]
+        self.ax.set_xlabel(f"Pace (minutes per {histogram['unit']})")
+        self.ax.set_ylabel(f"Total {name} Run")
+        self.ax.set_title(f"{name} Run at Different Paces")
+        # Whole minutes either side of the data, and the old 5-14 window when there is none
+        low, high = (paces[0] - width / 2, paces[-1] + width / 2) if paces else (5, 14)
+        self.ax.set_xlim(np.floor(low), np.ceil(high))
+        self.ax.set_ylim(0, max(values, default=0) * 1.08 or 1)
+        return histogram
+
+
+class TimeSeriesTemplate(FigureTemplate):
+    """Runs over time, or their weekly, monthly or yearly means for long histories, under a rolling trend."""
+
+    margins = {'left': 0.12, 'right': 0.98, 'bottom': 0.2, 'top': 0.92}
+    max_points = 500
+
+    def __init__(self, column, title, ylabel=None, size=None, dpi=100):
+        self.column = column
+        self.title = title
+        self.ylabel = ylabel
+        super().__init__(size, dpi)
+
+    def build(self):
+        ax = self.ax
+        ax.set_title(self.title)
+        if self.ylabel:
+            ax.set_ylabel(self.ylabel)
+        self.scatter = ax.scatter([], [], c=[], cmap='Pastel2')
+        self.fig.colorbar(self.scatter, ax=ax)
+        self.trend, = ax.plot([], [], 'r--')
+        locator = mdates.AutoDateLocator()
+        ax.xaxis.set_major_locator(locator)
+        ax.xaxis.set_major_formatter(mdates.AutoDateFormatter(locator))
+
+    def draw(self, df):
+        series = time_series(df, self.column, self.max_points)
+        x, y = np.asarray(series['x']), np.asarray(series['y'])
+
+        self.scatter.set_offsets(np.column_stack([x, y]))
+        self.scatter.set_array(y)
+        if len(y):
+            self.scatter.set_clim(y.min(), y.max())
+        trend = series['trend']
+        self.trend.set_data(trend['x'], trend['y']) if trend else self.trend.set_data([], [])
+
+        # Scatter offsets don't take part in autoscaling, so set the limits
+        # with matplotlib's default 5% margins
+        for setter, values in ((self.ax.set_xlim, x), (self.ax.set_ylim, y)):
+            low, high = (values.min(), values.max()) if len(values) else (0.0, 1.0)
+            pad = (high - low) * 0.05 or 1.0
+            setter(low - pad, high + pad)
+        for label in self.ax.get_xticklabels():
+            label.set_rotation(45)
+            label.set_horizontalalignment('right')
+
+
+class WeekdayTemplate(FigureTemplate):
+    size = (10, 6)
+
+    def build(self):
+        ax = self.ax
+        self.days = weekday_counts(pd.DataFrame({'type': [], 'start_date_local': []}))['days']
+        self.bars = ax.bar(self.days, [0] * len(self.days), color=COLORS)
+        ax.set_xlabel('Day of the Week')
+        ax.set_ylabel('Number of Runs')
+        ax.set_title('Frequency of Runs by Day of the Week')
+
+    def draw(self, df):
+        counts = weekday_counts(df)['counts']
+        for bar, count in zip(self.bars, counts):
+            bar.set_height(count)
+        self.ax.set_ylim(0, max(counts, default=0) * 1.05 or 1)
+
+
+TEMPLATES = {
+    'paces': PacesTemplate,
+    'average_speed_over_time': lambda size, dpi: TimeSeriesTemplate(
+        'average_speed', 'Average Speed over Time', size=size, dpi=dpi),
+    'distance_over_time': lambda size, dpi: TimeSeriesTemplate(
+        'distance', 'Distance over Time', 'Distance (meters)', size=size, dpi=dpi),
+    'runs_by_weekday': WeekdayTemplate,
+}
+
+# Templates built so far in this process, per (plot, size, dpi)
+templates = {}
+templates_lock = threading.Lock()
+
+
+def template(name, size=None, dpi=100):
+    key = (name, size, dpi)
+    with templates_lock:
+        found = templates.get(key)
+        if found is None:
+            found = templates[key] = TEMPLATES[name](size, dpi)
+    return found
+
+
+def render(name, df, fmt='png', dpi=100, size=None) -> str:
+    return template(name, size, dpi).render(df, fmt)[1]
+
+
+def render_pace_histogram(df, options, fmt='png', dpi=100, size=None):
+    """
+    Pace histogram with custom binning, see analytics.pace_histogram for the options.
+    :return (dict, str): the histogram data, and the base64 encoded figure
+    """
+    return template('paces', size, dpi).render(df, fmt, **options)
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    from analytics import columns
+    from stub_strava import synthetic_activities
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--activities', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--formats', nargs='+', default=['png', 'webp', 'svg'])
+    parser.add_argument('--dpi', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    def best(fn):
+        fn()
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = fn()
+            timings.append(time.perf_counter() - start)
+        return min(timings) * 1000, result
+
+    print(f"{'plot':<26}{'activities':>11}  " + ''.join(f"{fmt:>16}" for fmt in args.formats))
+    for count in args.activities:
+        df = columns.frame(synthetic_activities(count, seed=count))
+        for name in TEMPLATES:
+            by_format = [best(lambda: render(name, df, fmt, args.dpi)) for fmt in args.formats]
+            print(f"{name:<26}{count:>11}  " +
+                  ''.join(f"{ms:>7.1f}ms {len(encoded) * 3 // 4 // 1024:>4}KiB" for ms, encoded in by_format))
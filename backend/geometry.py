@@ -0,0 +1,175 @@
+"""
+Route geometry for the activity map: decoding Strava's encoded polylines,
+simplifying them to the detail a map zoom level can actually show, and
+re-encoding the result.
+
+    python geometry.py --routes 5000
+"""
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def decode_polyline(encoded, precision=5):
+    """
+    Decodes a Google encoded polyline into an (n, 2) array of [lat, lng].
+    :param encoded:
+    :param precision:
+    :return np.ndarray:
+    """
+    chunks = np.frombuffer((encoded or '').encode('ascii'), dtype='uint8').astype('int64') - 63
+    # Each value is a run of 5-bit chunks, the last one without the 0x20 continuation bit
+    ends = np.flatnonzero(chunks < 0x20)
+    if not len(ends):
+        return np.empty((0, 2))
+    chunks = chunks[:ends[-1] + 1]
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    position = np.arange(len(chunks)) - np.repeat(starts, ends - starts + 1)
+    values = np.add.reduceat((chunks & 0x1f) << (5 * position), starts)
+    values = (values >> 1) ^ -(values & 1)
+    if len(values) % 2:
+        values = values[:-1]
+    return np.cumsum(values.reshape(-1, 2), axis=0) / 10 ** precision
+
+
+def encode_polyline(points, precision=5) -> str:
+    """
+    Encodes an (n, 2) array of [lat, lng] as a Google encoded polyline.
+    :param points:
+    :param precision:
+    :return str:
+    """
+    points = np.asarray(points, dtype='float64').reshape(-1, 2)
+    if not len(points):
+        return ''
+    scaled = np.rint(points * 10 ** precision).astype('int64')
+    deltas = np.diff(scaled, axis=0, prepend=np.zeros((1, 2), dtype='int64')).ravel()
+    chunks = []
+    for value in ((deltas << 1) ^ (deltas >> 63)).tolist():
+        while value >= 0x20:
+            chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        chunks.append(chr(value + 63))
+    return ''.join(chunks)
+
+
+def simplify(points, tolerance):
+    """
+    Douglas-Peucker simplification. `tolerance` is in degrees of latitude;
+    longitudes are scaled by cos(latitude) so it holds in every direction.
+    :param points:
+    :param tolerance:
+    :return np.ndarray:
+    """
+    points = np.asarray(points, dtype='float64')
+    if len(points) < 3 or tolerance <= 0:
+        return points
+    planar = points * [1.0, math.cos(math.radians(points[:, 0].mean()))]
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = planar[first], planar[last]
+        inner = planar[first + 1:last]
+        segment = end - start
+        length = math.hypot(*segment)
+        if length:
+            distances = np.abs(segment[0] * (inner[:, 1] - start[1]) - segment[1] * (inner[:, 0] - start[0])) / length
+        else:
+            distances = np.hypot(*(inner - start).T)
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = first + 1 + farthest
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return points[keep]
+
+
+# Deepest zoom web map tiles go to
+MAX_ZOOM = 22
+
+
+def parse_zoom(value):
+    """A client's zoom as an int clamped to 0..MAX_ZOOM, None if it isn't a number."""
+    try:
+        zoom = int(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return min(max(zoom, 0), MAX_ZOOM)
+
+
+def zoom_tolerance(zoom) -> float:
+    """Degrees covered by one 256px web-mercator tile pixel at `zoom`, the largest error nobody can see."""
+    return 360.0 / (256 * 2 ** zoom)
+
+
+def simplified_route(encoded, zoom) -> str:
+    """An encoded polyline simplified for `zoom`, re-encoded."""
+    if not encoded:
+        return encoded or ''
+    simplified = encode_polyline(simplify(decode_polyline(encoded), zoom_tolerance(zoom)))
+    # Never hand back something bigger than what we started with
+    return simplified if len(simplified) < len(encoded) else encoded
+
+
+class RouteCache:
+    """Simplified polylines per (activity id, zoom), bounded to `size` entries, least recently used first out."""
+
+    def __init__(self, size=50000):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, activity_id, encoded, zoom) -> str:
+        if not encoded:
+            return encoded or ''
+        key = (activity_id, zoom, len(encoded), hash(encoded))
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        simplified = simplified_route(encoded, zoom)
+        with self.lock:
+            self.entries[key] = simplified
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return simplified
+
+
+route_cache = RouteCache()
+
+
+def random_route(rng, points=400, origin=(38.5, -121.5)):
+    """A wandering synthetic route of `points` GPS fixes roughly 10m apart."""
+    heading = np.cumsum(rng.normal(0, 0.15, points))
+    steps = np.column_stack([np.cos(heading), np.sin(heading)]) * 0.0001
+    start = np.array(origin) + rng.uniform(-1, 1, 2)
+    return start + np.cumsum(steps, axis=0)
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--routes', type=int, default=5000)
+    parser.add_argument('--zooms', type=int, nargs='+', default=[6, 10, 13, 16])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    corpus = [encode_polyline(random_route(rng, int(rng.integers(100, 800)))) for _ in range(args.routes)]
+    vertices = sum(len(decode_polyline(encoded)) for encoded in corpus)
+    print(f"original  bytes={sum(map(len, corpus)):<10} vertices={vertices}")
+    for zoom in args.zooms:
+        cache = RouteCache()
+        start = time.perf_counter()
+        simplified = [cache.get(i, encoded, zoom) for i, encoded in enumerate(corpus)]
+        elapsed = time.perf_counter() - start
+        vertices = sum(len(decode_polyline(encoded)) for encoded in simplified)
+        print(f"zoom={zoom:<3}   bytes={sum(map(len, simplified)):<10} vertices={vertices:<10} {elapsed:.2f}s")
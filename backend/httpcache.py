@@ -0,0 +1,139 @@
+"""
+Conditional GETs and compression for the JSON data routes. A route wrapped in
+conditional() gets a strong ETag derived from a version string (for athlete
+data, the athlete plus their activity store revision), answers a matching
+If-None-Match with an empty 304, and serves its body gzip or brotli encoded
+as the client prefers. Encoded bodies are kept per ETag, so a version is
+computed and compressed once no matter how many times it is fetched. Routes
+that know when their data last changed also send Last-Modified, for clients
+that revalidate with If-Modified-Since instead.
+
+Brotli needs the brotli package; without it only gzip is offered.
+"""
+import functools
+import gzip
+import hashlib
+import time
+
+from flask import Response, make_response, request
+from werkzeug.http import http_date
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Bump whenever a wrapped route's payload changes shape, so clients drop what they validated before
+SCHEMA = 1
+ENCODINGS = ['br', 'gzip'] if brotli else ['gzip']
+# Smaller bodies go out as they are; compressing them saves less than the header costs
+MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+# Nothing is reported as modified before this process started, so a deploy that
+# changes a route's output is never validated by date alone
+STARTED = time.time()
+
+
+def negotiate(accept_encodings) -> str:
+    """The client's most preferred encoding we support, or 'identity'."""
+    return accept_encodings.best_match(ENCODINGS) or 'identity'
+
+
+def compress(body, encoding) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == 'gzip':
+        # mtime=0 keeps the bytes identical for identical bodies
+        return gzip.compress(body, GZIP_LEVEL, mtime=0)
+    return body
+
+
+def etag(version, path, encoding) -> str:
+    # Every representation gets its own strong tag, encodings included
+    digest = hashlib.sha256(f"{SCHEMA}\0{version}\0{path}\0{encoding}".encode()).hexdigest()
+    return digest[:32]
+
+
+def not_modified(tag, headers):
+    response = Response(status=304)
+    if tag is not None:
+        response.set_etag(tag)
+    response.headers.update(headers)
+    return response
+
+
+def fresh_by_date(last_modified) -> bool:
+    """Whether an If-Modified-Since (only looked at without If-None-Match) covers `last_modified`."""
+    since = request.if_modified_since
+    if last_modified is None or since is None or request.if_none_match:
+        return False
+    return last_modified <= since.timestamp()
+
+
+def conditional(version, store=None, ttl=600, modified=None):
+    """
+    Wraps a route so it is served with validators and compression.
+    :param version: called with the route's arguments; a string that changes
+        whenever the route's output would, or None when not known until the
+        route has run (then it is asked again afterwards)
+    :param store: where encoded bodies are kept per ETag (a sessions.TieredStore),
+        None to encode every time
+    :param ttl: seconds encoded bodies are kept
+    :param modified: called with the route's arguments; epoch seconds the
+        output last changed, or None when unknown
+    """
+    def decorate(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            encoding = negotiate(request.accept_encodings)
+            path = request.full_path
+            # The athlete comes from the session cookie, so shared caches must not mix users
+            headers = {'Vary': 'Accept-Encoding, Cookie', 'Cache-Control': 'private, no-cache'}
+
+            current = version(*args, **kwargs)
+            tag = etag(current, path, encoding) if current is not None else None
+            last_modified = modified(*args, **kwargs) if modified is not None else None
+            if last_modified is not None:
+                # Whole seconds, as the header carries them
+                last_modified = int(max(last_modified, STARTED))
+                headers['Last-Modified'] = http_date(last_modified)
+            if fresh_by_date(last_modified):
+                return not_modified(tag, headers)
+            if tag is not None:
+                if request.if_none_match.contains(tag):
+                    return not_modified(tag, headers)
+                entry = store.get('http:' + tag) if store is not None else None
+                if entry is not None:
+                    return encoded(entry, tag, encoding, headers)
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                return response
+            if tag is None:
+                current = version(*args, **kwargs)
+                if current is None:
+                    return response
+                tag = etag(current, path, encoding)
+
+            data = response.get_data()
+            # (body, whether it is encoded)
+            entry = (compress(data, encoding), True) if len(data) >= MIN_SIZE else (data, False)
+            if store is not None:
+                store.set('http:' + tag, entry, ttl)
+            return encoded(entry, tag, encoding, headers)
+
+        return wrapper
+
+    return decorate
+
+
+def encoded(entry, tag, encoding, headers):
+    body, compressed = entry
+    response = Response(body, mimetype='application/json')
+    response.set_etag(tag)
+    response.headers.update(headers)
+    if compressed and encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,107 @@
+"""
+Concurrent-login load test against a local fake Strava. Starts the stub,
+then one single-worker server per mode (gunicorn sync for wsgi, hypercorn for
+asgi), fires many /callback logins at it at once and reports throughput.
+
+    python loadtest.py --logins 40 --concurrency 20 --activities 1000 --latency 0.2
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from stub_strava import serve, synthetic_activities
+
+
+SERVERS = {
+    'wsgi': ['gunicorn', '--workers', '1', '--bind', '127.0.0.1:{port}', 'app:app'],
+    'asgi': ['hypercorn', '--workers', '1', '--bind', '127.0.0.1:{port}', 'asgi:app'],
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode, stub_port, workdir):
+    port = free_port()
+    env = dict(os.environ,
+               STRAVA_API_URL=f"http://127.0.0.1:{stub_port}/api/v3",
+               STRAVA_AUTH_URL=f"http://127.0.0.1:{stub_port}/oauth/token",
+               ACTIVITY_DB=os.path.join(workdir, f"{mode}.db"),
+               STATE_DB=os.path.join(workdir, f"{mode}-state.db"),
+               PLOT_WORKERS='1')
+    command = [part.format(port=port) for part in SERVERS[mode]]
+    process = subprocess.Popen(command, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                return process, port
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+async def run_logins(port, logins, concurrency, first_code):
+    limit = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async def login(http, code):
+        nonlocal failures
+        async with limit:
+            start = time.perf_counter()
+            response = await http.post(f"http://127.0.0.1:{port}/callback", json={"code": str(code)})
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200 or 'stats' not in response.json():
+                failures += 1
+
+    async with httpx.AsyncClient(timeout=600) as http:
+        start = time.perf_counter()
+        # Every login is a different athlete so none of them hits the activity store
+        await asyncio.gather(*(login(http, first_code + i) for i in range(logins)))
+        return time.perf_counter() - start, latencies, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--modes', nargs='+', choices=list(SERVERS), default=list(SERVERS))
+    parser.add_argument('--logins', type=int, default=40)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--activities', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.2, help="seconds added to every stub request")
+    args = parser.parse_args()
+
+    stub = serve(synthetic_activities(args.activities), args.latency, limits=(10 ** 6, 10 ** 6))
+    workdir = tempfile.mkdtemp()
+    try:
+        for n, mode in enumerate(args.modes):
+            process, port = start_server(mode, stub.server_port, workdir)
+            try:
+                elapsed, latencies, failures = asyncio.run(
+                    run_logins(port, args.logins, args.concurrency, first_code=1000 * (n + 1)))
+            finally:
+                process.terminate()
+                process.wait()
+            latencies.sort()
+            print(f"{mode}: {args.logins / elapsed:6.2f} logins/s  "
+                  f"p50={statistics.median(latencies):.2f}s  "
+                  f"p95={latencies[int(len(latencies) * 0.95) - 1]:.2f}s  failures={failures}")
+    finally:
+        stub.shutdown()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
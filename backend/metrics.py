@@ -0,0 +1,245 @@
+"""
+Timings and counters for the login pipeline. They are served in the
+Prometheus text format on /metrics, and there is an optional structured log
+line per request listing the spans the request went through.
+
+METRICS=0 turns every span and counter into a no-op. REQUEST_LOG=1 logs one
+JSON line per request on the 'stravastats.requests' logger. Each server
+process keeps its own numbers, so scrape every worker (or run one per pod).
+"""
+import contextvars
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+
+ENABLED = os.environ.get('METRICS', '1') != '0'
+REQUEST_LOG = ENABLED and os.environ.get('REQUEST_LOG') == '1'
+
+request_logger = logging.getLogger('stravastats.requests')
+if REQUEST_LOG and not request_logger.handlers:
+    request_logger.addHandler(logging.StreamHandler())
+    request_logger.setLevel(logging.INFO)
+# The spans of the request being served, when REQUEST_LOG is on
+current_request = contextvars.ContextVar('current_request', default=None)
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def format_labels(key, extra=()):
+    pairs = [*key, *extra]
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        if not ENABLED:
+            return
+        key = label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def exposition(self):
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} counter"
+        with self.lock:
+            values = sorted(self.values.items())
+        for key, value in values:
+            yield f"{self.name}{format_labels(key)} {value}"
+
+
+class Gauge:
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def set(self, value, **labels):
+        if not ENABLED:
+            return
+        with self.lock:
+            self.values[label_key(labels)] = value
+
+    def exposition(self):
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} gauge"
+        with self.lock:
+            values = sorted(self.values.items())
+        for key, value in values:
+            yield f"{self.name}{format_labels(key)} {value}"
+
+
+class Histogram:
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, math.inf)
+
+    def __init__(self, name, description, buckets=BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        # Per label set: [count per bucket..., sum]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        if not ENABLED:
+            return
+        key = label_key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-1] += value
+
+    def exposition(self):
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} histogram"
+        with self.lock:
+            values = sorted((key, list(counts)) for key, counts in self.values.items())
+        for key, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = '+Inf' if bound == math.inf else repr(bound)
+                yield f"{self.name}_bucket{format_labels(key, [('le', le)])} {cumulative}"
+            yield f"{self.name}_sum{format_labels(key)} {counts[-1]}"
+            yield f"{self.name}_count{format_labels(key)} {cumulative}"
+
+
+stage_seconds = Histogram('stravastats_stage_seconds', "Time spent in each stage of the login pipeline.")
+strava_request_seconds = Histogram('stravastats_strava_request_seconds', "Strava API calls by endpoint and status.")
+strava_response_bytes = Counter('stravastats_strava_response_bytes_total', "Bytes received from the Strava API.")
+strava_retries = Counter('stravastats_strava_retries_total', "Strava API calls retried, by reason.")
+token_refreshes = Counter('stravastats_token_refreshes_total', "Access tokens refreshed after a 401.")
+requests_total = Counter('stravastats_requests_total', "Requests served, by endpoint and status.")
+prefetch_athletes = Gauge('stravastats_prefetch_athletes', "Athletes the background refresher keeps warm.")
+prefetch_queue_depth = Gauge('stravastats_prefetch_queue_depth', "Athletes due for a background refresh.")
+prefetch_lag_seconds = Histogram('stravastats_prefetch_lag_seconds',
+                                 "How late background refreshes start after falling due.",
+                                 (1.0, 10.0, 60.0, 300.0, 900.0, 3600.0, 4 * 3600.0, math.inf))
+prefetch_runs = Counter('stravastats_prefetch_runs_total', "Background refreshes, by outcome.")
+
+REGISTRY = [stage_seconds, strava_request_seconds, strava_response_bytes, strava_retries, token_refreshes,
+            requests_total, prefetch_athletes, prefetch_queue_depth, prefetch_lag_seconds, prefetch_runs]
+
+
+def exposition() -> str:
+    """Every metric in the Prometheus text format, version 0.0.4."""
+    return '\n'.join(line for metric in REGISTRY for line in metric.exposition()) + '\n'
+
+
+class Span:
+    """Times a block into stravastats_stage_seconds{stage} and the request log."""
+
+    __slots__ = ('stage', 'fields', 'start')
+
+    def __init__(self, stage, fields):
+        self.stage = stage
+        self.fields = fields
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        stage_seconds.observe(elapsed, stage=self.stage)
+        log(self.stage, elapsed, **self.fields)
+        return False
+
+    def annotate(self, **fields):
+        """Adds fields only known once the block has run, like a response size."""
+        self.fields.update(fields)
+
+
+class NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def annotate(self, **fields):
+        pass
+
+
+NO_SPAN = NoSpan()
+
+
+def span(stage, **fields):
+    if not ENABLED:
+        return NO_SPAN
+    return Span(stage, fields)
+
+
+def log(stage, seconds, **fields):
+    """Adds a span to the current request's log line, if one is being kept."""
+    record = current_request.get()
+    if record is not None:
+        record['spans'].append({'stage': stage, 'ms': round(seconds * 1000, 2), **fields})
+
+
+def strava_call(endpoint, status, seconds, size, **fields):
+    if not ENABLED:
+        return
+    strava_request_seconds.observe(seconds, endpoint=endpoint, status=status)
+    strava_response_bytes.inc(size, endpoint=endpoint)
+    log('strava:' + endpoint, seconds, status=status, bytes=size, **fields)
+
+
+def carry(fn):
+    """
+    Wraps fn so that spans it records on a pool thread still land in the
+    calling request's log line.
+    """
+    if not REQUEST_LOG:
+        return fn
+    record = current_request.get()
+
+    def run(*args, **kwargs):
+        token = current_request.set(record)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            current_request.reset(token)
+
+    return run
+
+
+def begin_request(method, path):
+    if REQUEST_LOG:
+        return current_request.set({'method': method, 'path': path, 'start': time.perf_counter(), 'spans': []})
+    return None
+
+
+def end_request(token, endpoint, status):
+    requests_total.inc(endpoint=endpoint or 'unknown', status=status)
+    if token is None:
+        return
+    record = current_request.get()
+    current_request.reset(token)
+    if record is None:
+        return
+    record['status'] = status
+    record['ms'] = round((time.perf_counter() - record.pop('start')) * 1000, 2)
+    request_logger.info(json.dumps(record, default=str))
@@ -0,0 +1,168 @@
+import base64
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+
+# Image formats plots are drawn in; a key ends in its format, which names the file on disk
+FORMATS = ('png', 'webp', 'svg')
+# Half-written files older than this were left by a worker that died mid-write
+STALE_TMP_SECONDS = 3600
+
+
+class PlotCache:
+    """
+    Rendered plots keyed by a hash of the data they were drawn from, so an
+    unchanged history never goes through matplotlib twice. Entries live in an
+    in-memory LRU bounded by total bytes, optionally backed by a directory of
+    image files, one per key in the key's format, that survives restarts and
+    is shared between workers. Hits touch a file's mtime, and the disk is
+    pruned least recently used first whenever the bytes this process knows
+    were written exceed `max_disk_bytes`, or every `prune_every` writes to
+    account for other workers' files.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, directory=None, max_disk_bytes=512 * 1024 * 1024,
+                 prune_every=100):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.prune_every = prune_every
+        # Bytes on disk as of the last scan plus what this process wrote since; None until the first scan
+        self.disk_bytes = None
+        self.puts = 0
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(name, df, columns, version, fmt='png') -> str:
+        """
+        Content address for a plot: its name, style version and the values of the columns it reads.
+        :param name:
+        :param df:
+        :param columns:
+        :param version:
+        :param fmt: image format, the key's extension
+        :return str:
+        """
+        digest = hashlib.sha256(f"{name}:{version}:{','.join(columns)}".encode())
+        present = [column for column in columns if column in df]
+        if len(df) and present:
+            digest.update(pd.util.hash_pandas_object(df[present], index=False).values.tobytes())
+        return f"{digest.hexdigest()}.{fmt}"
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                value = self.entries[key]
+            else:
+                value = None
+        if value is not None:
+            self.touch(key)
+            return value
+        if self.directory and os.path.exists(self.path(key)):
+            try:
+                with open(self.path(key), 'rb') as f:
+                    value = base64.b64encode(f.read()).decode('utf-8')
+            except OSError:
+                value = None
+            if value is not None:
+                self.touch(key)
+                self.remember(key, value)
+                with self.lock:
+                    self.hits += 1
+                return value
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def touch(self, key):
+        """Marks the key's file as just used, which is what pruning goes by."""
+        if not self.directory:
+            return
+        try:
+            os.utime(self.path(key))
+        except OSError:
+            pass
+
+    def put(self, key, value):
+        self.remember(key, value)
+        if not self.directory:
+            return
+        data = base64.b64decode(value)
+        # A name of our own, so workers writing the same key never share a temporary file
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, self.path(key))
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        with self.lock:
+            self.puts += 1
+            if self.disk_bytes is not None:
+                self.disk_bytes += len(data)
+            due = (self.disk_bytes is None or self.disk_bytes > self.max_disk_bytes
+                   or self.puts % self.prune_every == 0)
+        if due:
+            self.prune_disk()
+
+    def remember(self, key, value):
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+            self.entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def prune_disk(self):
+        files = []
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            if entry.name.endswith(tuple('.' + fmt for fmt in FORMATS)):
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+            elif entry.name.endswith('.tmp') and now - stat.st_mtime > STALE_TMP_SECONDS:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        with self.lock:
+            self.disk_bytes = total
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries), "bytes": self.size}
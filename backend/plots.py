@@ -0,0 +1,197 @@
+import os
+import threading
+import time
+import uuid
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import metrics
+from plot_cache import PlotCache
+
+
+# Dashboard plots in the order the frontend shows them; figures.TEMPLATES draws them
+PLOT_NAMES = ['paces', 'average_speed_over_time', 'distance_over_time', 'runs_by_weekday']
+
+# Columns each plot reads; together they form the plot's cache key
+PLOT_INPUTS = {
+    'paces': ['type', 'distance', 'moving_time'],
+    # Long histories plot rollup buckets, whose speed is distance over moving time
+    'average_speed_over_time': ['type', 'start_date_local', 'average_speed', 'distance', 'moving_time'],
+    'distance_over_time': ['type', 'start_date_local', 'distance'],
+    'runs_by_weekday': ['type', 'start_date_local'],
+}
+# Only these columns are shipped to the worker processes
+PLOT_COLUMNS = ['type', 'distance', 'moving_time', 'total_elevation_gain', 'average_speed', 'start_date_local']
+# Bump whenever a change to the plot functions alters their output, to invalidate cached PNGs
+STYLE_VERSION = 6
+
+MIME_TYPES = {'png': 'image/png', 'webp': 'image/webp', 'svg': 'image/svg+xml'}
+# Published in place of a job's plots while they are still being drawn
+PENDING = 'pending'
+
+
+def render(name, df, fmt='png', dpi=100, size=None):
+    # Imported on first use so only the processes that draw pay for matplotlib
+    import figures
+    return figures.render(name, df, fmt, dpi, size)
+
+
+def render_pace_histogram(df, options, fmt='png', dpi=100, size=None):
+    import figures
+    return figures.render_pace_histogram(df, options, fmt, dpi, size)
+
+
+class PlotRenderer:
+    """
+    Renders the dashboard plots on a pool of worker processes so the four
+    figures are drawn in parallel and off the request that asked for them.
+    Results are collected per job id and expire after `ttl` seconds.
+    """
+
+    def __init__(self, workers=None, ttl=600, cache=None, fmt='png', dpi=100, size=None):
+        self.workers = workers or min(len(PLOT_NAMES), os.cpu_count() or 1)
+        self.ttl = ttl
+        self.cache = cache
+        if fmt not in MIME_TYPES:
+            raise ValueError(f"Unsupported plot format {fmt}")
+        self.format = fmt
+        self.dpi = dpi
+        # (width, height) in inches for every plot, None for each plot's own size
+        self.size = size
+        self.mime_type = MIME_TYPES[fmt]
+        # Optional shared sessions backend that jobs are published to, so any worker can serve them.
+        # Not a TieredStore: a job's entry changes from PENDING to its plots, and local tiers never see that
+        self.results = None
+        self.pool = None
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def executor(self):
+        # Started lazily, and with spawn so workers never inherit the web
+        # server's threads or locks
+        with self.lock:
+            if self.pool is None:
+                if multiprocessing.current_process().daemon:
+                    # Daemonic server workers (hypercorn) may not start child
+                    # processes; render on one thread since pyplot isn't thread safe
+                    self.pool = ThreadPoolExecutor(max_workers=1)
+                else:
+                    self.pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                    mp_context=multiprocessing.get_context('spawn'))
+            return self.pool
+
+    def submit(self, df) -> str:
+        """Queues every plot for `df` and returns the job id to poll for them."""
+        df = df[[column for column in PLOT_COLUMNS if column in df]]
+        futures = [self.plot(name, df) for name in PLOT_NAMES]
+        with self.lock:
+            self.expire()
+            job_id = uuid.uuid4().hex
+            self.jobs[job_id] = (time.monotonic(), futures)
+        if self.results is not None:
+            self.publish(job_id, futures)
+        return job_id
+
+    def publish(self, job_id, futures):
+        """Marks the job pending in the result store, and stores its plots once they are all drawn."""
+        self.results.set('plots:' + job_id, PENDING, self.ttl)
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def done(_):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            if all(not future.cancelled() and future.exception() is None for future in futures):
+                self.results.set('plots:' + job_id, [future.result() for future in futures], self.ttl)
+            else:
+                self.results.delete('plots:' + job_id)
+
+        for future in futures:
+            future.add_done_callback(done)
+
+    def plot(self, name, df):
+        if self.cache is None:
+            return self.timed(name, self.executor().submit(render, name, df, self.format, self.dpi, self.size))
+
+        key = self.cache.key(name, df, PLOT_INPUTS[name], f"{STYLE_VERSION}:{self.dpi}:{self.size}", self.format)
+        cached = self.cache.get(key)
+        if cached is not None:
+            future = Future()
+            future.set_result(cached)
+            return future
+
+        future = self.timed(name, self.executor().submit(render, name, df, self.format, self.dpi, self.size))
+
+        def store(done):
+            if not done.cancelled() and done.exception() is None:
+                self.cache.put(key, done.result())
+
+        future.add_done_callback(store)
+        return future
+
+    def pace_histogram(self, df, timeout=60, **options):
+        """
+        The pace histogram with custom binning, drawn on the worker pool and
+        waited for. Not cached, since the options are free form.
+        :return (dict, str): the histogram data, and the base64 encoded figure
+        """
+        df = df[[column for column in PLOT_INPUTS['paces'] if column in df]]
+        future = self.timed('paces_histogram', self.executor().submit(
+            render_pace_histogram, df, options, self.format, self.dpi, self.size))
+        return future.result(timeout=timeout)
+
+    @staticmethod
+    def timed(name, future):
+        # Queueing plus drawing, i.e. how long the dashboard waits for this plot
+        if metrics.ENABLED:
+            start = time.perf_counter()
+            future.add_done_callback(
+                lambda _: metrics.stage_seconds.observe(time.perf_counter() - start, stage='plot_' + name))
+        return future
+
+    def result(self, job_id):
+        """
+        The finished plots for a job, None while it is still rendering.
+        Raises KeyError for unknown or expired jobs.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            # Submitted on another worker, perhaps
+            published = self.results.get('plots:' + job_id) if self.results is not None else None
+            if published is None:
+                raise KeyError(job_id)
+            return None if published == PENDING else published
+        futures = job[1]
+        if not all(future.done() for future in futures):
+            return None
+        return [future.result() for future in futures]
+
+    def iter_completed(self, job_id):
+        """Yields (position, plot) for a job's plots in the order they finish rendering."""
+        with self.lock:
+            _, futures = self.jobs[job_id]
+        positions = {future: i for i, future in enumerate(futures)}
+        for future in as_completed(futures):
+            yield positions[future], future.result()
+
+    def expire(self):
+        now = time.monotonic()
+        for job_id, (created, _) in list(self.jobs.items()):
+            if now - created > self.ttl:
+                del self.jobs[job_id]
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+
+plot_cache = PlotCache(max_bytes=int(os.environ.get('PLOT_CACHE_BYTES', 64 * 1024 * 1024)),
+                       directory=os.environ.get('PLOT_CACHE_DIR') or None)
+# PLOT_SIZE is WIDTHxHEIGHT in inches, e.g. 8x5
+renderer = PlotRenderer(int(os.environ.get('PLOT_WORKERS', 0)) or None, cache=plot_cache,
+                        fmt=os.environ.get('PLOT_FORMAT', 'png'), dpi=int(os.environ.get('PLOT_DPI', 100)),
+                        size=tuple(float(side) for side in os.environ['PLOT_SIZE'].split('x'))
+                        if os.environ.get('PLOT_SIZE') else None)
@@ -0,0 +1,196 @@
+"""
+Background refresh of recently active athletes. Every athlete who logs in is
+registered with their tokens; while they stay active, a worker thread pulls
+their new activities every `interval` seconds (the same `after=` sync a login
+does) and rebuilds their stats, rollups and plots, so the next login finds
+everything warm.
+
+Refreshes spend their own small request budget and stand back whenever the
+process-wide Strava budget runs low, so they never starve logins. The clock
+is injectable and run_pending() does one round synchronously, which is all a
+test needs to drive it against the stub Strava.
+"""
+import heapq
+import threading
+import time
+
+import metrics
+from ratelimit import RateLimitExceeded, RateLimiter
+
+
+class Athlete:
+    __slots__ = ('athlete_id', 'access_token', 'refresh_token', 'expires_at', 'last_active', 'due',
+                 'late_since', 'failures', 'refreshed')
+
+    def __init__(self, athlete_id, access_token, refresh_token, expires_at, now):
+        self.athlete_id = athlete_id
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        # Epoch seconds the access token stops working, as Strava reports it
+        self.expires_at = expires_at
+        self.last_active = now
+        self.due = None
+        # When a refresh held back for budget first fell due
+        self.late_since = None
+        self.failures = 0
+        self.refreshed = None
+
+
+class Prefetcher:
+    """
+    Registry of active athletes and the schedule that keeps them warm.
+    :param refresh: called with an Athlete to sync and recompute it; may
+        update the athlete's tokens
+    :param interval: seconds between refreshes of one athlete
+    :param active_for: athletes not seen for this long are dropped
+    :param budget: RateLimiter refreshes take one slot each from
+    :param strava_limiter: the process-wide limiter; refreshes wait while it
+        has fewer than `headroom` requests left
+    :param max_failures: consecutive failures after which an athlete is dropped
+    """
+
+    def __init__(self, refresh, interval=900, active_for=7 * 24 * 3600, budget=None, strava_limiter=None,
+                 headroom=20, max_failures=3, clock=time.time):
+        self.refresh = refresh
+        self.interval = interval
+        self.active_for = active_for
+        self.clock = clock
+        self.budget = budget or RateLimiter(limits=(20, 200), reserve=0, clock=clock)
+        self.strava_limiter = strava_limiter
+        self.headroom = headroom
+        self.max_failures = max_failures
+        self.athletes = {}
+        # (due, athlete_id); entries whose due no longer matches the athlete's are stale
+        self.queue = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def register(self, athlete_id, access_token, refresh_token=None, expires_at=None):
+        """Records a login; the athlete's first refresh falls due one interval later."""
+        now = self.clock()
+        with self.lock:
+            athlete = self.athletes.get(athlete_id)
+            if athlete is None:
+                athlete = self.athletes[athlete_id] = Athlete(athlete_id, access_token, refresh_token,
+                                                              expires_at, now)
+            else:
+                athlete.access_token = access_token
+                athlete.refresh_token = refresh_token or athlete.refresh_token
+                athlete.expires_at = expires_at
+                athlete.last_active = now
+                athlete.failures = 0
+            # A login just synced them, so push the next refresh back
+            self.schedule(athlete, now + self.interval)
+            self.update_gauges(now)
+        self.wakeup.set()
+
+    def schedule(self, athlete, due):
+        athlete.due = due
+        heapq.heappush(self.queue, (due, athlete.athlete_id))
+
+    def next_due(self):
+        """The earliest time a refresh falls due, None when nobody is registered. Call with the lock held."""
+        while self.queue:
+            due, athlete_id = self.queue[0]
+            athlete = self.athletes.get(athlete_id)
+            if athlete is not None and athlete.due == due:
+                return due
+            heapq.heappop(self.queue)
+        return None
+
+    def pop_due(self, now):
+        with self.lock:
+            while True:
+                due = self.next_due()
+                if due is None or due > now:
+                    return None
+                _, athlete_id = heapq.heappop(self.queue)
+                athlete = self.athletes[athlete_id]
+                if now - athlete.last_active <= self.active_for:
+                    return athlete
+                del self.athletes[athlete_id]
+                metrics.prefetch_runs.inc(outcome='expired')
+
+    def run_pending(self) -> int:
+        """
+        Refreshes every athlete that is due, as far as the budgets allow.
+        :return int: refreshes attempted
+        """
+        attempted = 0
+        while not self.stopping.is_set():
+            now = self.clock()
+            athlete = self.pop_due(now)
+            if athlete is None:
+                break
+            wait = self.hold_back()
+            if wait:
+                # Everyone else due waits too; they are behind this athlete in the queue
+                with self.lock:
+                    athlete.late_since = athlete.late_since or athlete.due
+                    self.schedule(athlete, now + wait)
+                metrics.prefetch_runs.inc(outcome='deferred')
+                break
+
+            metrics.prefetch_lag_seconds.observe(max(0.0, now - (athlete.late_since or athlete.due)))
+            athlete.late_since = None
+            attempted += 1
+            try:
+                with metrics.span('prefetch', athlete_id=athlete.athlete_id):
+                    self.refresh(athlete)
+            except Exception:
+                athlete.failures += 1
+                metrics.prefetch_runs.inc(outcome='error')
+            else:
+                athlete.failures = 0
+                athlete.refreshed = self.clock()
+                metrics.prefetch_runs.inc(outcome='ok')
+            with self.lock:
+                if athlete.failures >= self.max_failures:
+                    self.athletes.pop(athlete.athlete_id, None)
+                elif self.athletes.get(athlete.athlete_id) is athlete:
+                    # Failures back off by whole intervals
+                    self.schedule(athlete, self.clock() + self.interval * (1 + athlete.failures))
+        with self.lock:
+            self.update_gauges(self.clock())
+        return attempted
+
+    def hold_back(self) -> float:
+        """Seconds refreshes should wait for budget, 0 to go ahead (taking a slot)."""
+        if self.strava_limiter is not None and self.strava_limiter.remaining() < self.headroom:
+            return 60.0
+        try:
+            self.budget.acquire(max_wait=0)
+        except RateLimitExceeded as e:
+            return e.retry_after
+        return 0.0
+
+    def update_gauges(self, now):
+        metrics.prefetch_athletes.set(len(self.athletes))
+        metrics.prefetch_queue_depth.set(sum(1 for athlete in self.athletes.values()
+                                             if athlete.due is not None and athlete.due <= now))
+
+    def start(self):
+        """Starts the worker thread, once."""
+        with self.lock:
+            if self.thread is not None or self.stopping.is_set():
+                return
+            self.thread = threading.Thread(target=self.loop, name='prefetch', daemon=True)
+            self.thread.start()
+
+    def loop(self):
+        while not self.stopping.is_set():
+            self.run_pending()
+            with self.lock:
+                due = self.next_due()
+            timeout = None if due is None else max(0.0, due - self.clock())
+            self.wakeup.wait(timeout if timeout is None else min(timeout, self.interval))
+            self.wakeup.clear()
+
+    def stop(self, timeout=30.0):
+        """Lets a refresh in progress finish, then stops the worker thread."""
+        self.stopping.set()
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
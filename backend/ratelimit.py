@@ -0,0 +1,118 @@
+import asyncio
+import random
+import threading
+import time
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Strava rate limit reached, retry in {int(retry_after)}s")
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """
+    Process-wide budget for Strava's short (15 minute) and daily request limits.
+    Every thread asks for a slot before calling the API and reports the
+    X-RateLimit-* headers it gets back, so all athletes served by this process
+    share one view of the remaining quota.
+    """
+
+    SHORT_WINDOW = 15 * 60
+    DAILY_WINDOW = 24 * 3600
+
+    def __init__(self, limits=(100, 1000), reserve=2, max_wait=30.0, clock=time.time):
+        self.limits = list(limits)
+        self.usage = [0, 0]
+        # Requests kept back from each window, so we slow down before Strava starts refusing
+        self.reserve = reserve
+        # Longest a caller is made to wait for a slot before giving up
+        self.max_wait = max_wait
+        self.clock = clock
+        self.condition = threading.Condition()
+        self.resets = self.window_ends(clock())
+
+    def window_ends(self, now):
+        # Strava's short window resets on the quarter hour, the daily one at midnight UTC
+        return [now - now % self.SHORT_WINDOW + self.SHORT_WINDOW,
+                now - now % self.DAILY_WINDOW + self.DAILY_WINDOW]
+
+    def roll(self, now):
+        ends = self.window_ends(now)
+        for i in range(2):
+            if now >= self.resets[i]:
+                self.usage[i] = 0
+                self.resets[i] = ends[i]
+
+    def delay(self, now):
+        """Seconds until a request may be sent, 0 if there is budget now."""
+        self.roll(now)
+        wait = 0.0
+        for i in range(2):
+            if self.usage[i] >= self.limits[i] - self.reserve:
+                wait = max(wait, self.resets[i] - now)
+        return wait
+
+    def take(self):
+        """Claims a slot if there is one; otherwise returns how long to wait. Call with the condition held."""
+        wait = self.delay(self.clock())
+        if not wait:
+            self.usage[0] += 1
+            self.usage[1] += 1
+        return wait
+
+    def remaining(self) -> int:
+        """Requests left before either window's reserve is reached."""
+        with self.condition:
+            self.roll(self.clock())
+            return max(0, min(self.limits[i] - self.reserve - self.usage[i] for i in range(2)))
+
+    def acquire(self, max_wait=None):
+        max_wait = self.max_wait if max_wait is None else max_wait
+        with self.condition:
+            while True:
+                wait = self.take()
+                if not wait:
+                    return
+                if wait > max_wait:
+                    raise RateLimitExceeded(wait)
+                self.condition.wait(wait)
+
+    async def acquire_async(self, max_wait=None):
+        """acquire() for event loops: waits with asyncio.sleep instead of blocking the thread."""
+        max_wait = self.max_wait if max_wait is None else max_wait
+        while True:
+            with self.condition:
+                wait = self.take()
+            if not wait:
+                return
+            if wait > max_wait:
+                raise RateLimitExceeded(wait)
+            await asyncio.sleep(min(wait, 1.0))
+
+    def update(self, headers):
+        """Takes Strava's own count as the truth whenever a response carries it."""
+        limit = headers.get('X-RateLimit-Limit')
+        usage = headers.get('X-RateLimit-Usage')
+        if not limit or not usage:
+            return
+        try:
+            limits = [int(value) for value in limit.split(',')[:2]]
+            usage = [int(value) for value in usage.split(',')[:2]]
+        except ValueError:
+            return
+        with self.condition:
+            self.roll(self.clock())
+            self.limits[:len(limits)] = limits
+            self.usage[:len(usage)] = usage
+            self.condition.notify_all()
+
+    def exhaust(self):
+        """A 429 without headers means the short window is spent."""
+        with self.condition:
+            self.usage[0] = max(self.usage[0], self.limits[0])
+
+
+def backoff(attempt, base=0.5, cap=30.0):
+    """Exponential backoff with full jitter for retrying 429s and 5xx responses."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
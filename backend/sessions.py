@@ -0,0 +1,266 @@
+"""
+Server-side state shared by every worker: login sessions, and results worth
+reusing across requests such as an athlete's typed activity table, dashboard
+payload and rendered plots.
+
+Backends hold values under string keys, each with its own TTL. MemoryBackend
+is a per-process LRU; SQLiteBackend is one file shared by every worker on the
+host, standing in for Redis. TieredStore puts the first in front of the
+second. The session cookie carries only a random session id, so access and
+refresh tokens never leave the server, and the id changes on every login.
+
+The shared file holds JSON, never pickles: anyone able to write it could
+otherwise run code in every worker. Values put there must be JSON plus
+tuples and bytes, which are tagged so they come back as they went in.
+"""
+import base64
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+
+def tagged(value):
+    # Tuples and bytes as one-key objects JSON can carry; anything else JSON refuses raises TypeError
+    if isinstance(value, tuple):
+        return {'__tuple__': [tagged(item) for item in value]}
+    if isinstance(value, bytes):
+        return {'__bytes__': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, list):
+        return [tagged(item) for item in value]
+    if isinstance(value, dict):
+        return {key: tagged(item) for key, item in value.items()}
+    return value
+
+
+def untagged(obj):
+    if len(obj) == 1:
+        if '__tuple__' in obj:
+            return tuple(obj['__tuple__'])
+        if '__bytes__' in obj:
+            return base64.b64decode(obj['__bytes__'])
+    return obj
+
+
+def dumps(value) -> str:
+    return json.dumps(tagged(value), separators=(',', ':'))
+
+
+def loads(text):
+    return json.loads(text, object_hook=untagged)
+
+
+class MemoryBackend:
+    """Up to `max_entries` values in this process, least recently used evicted first."""
+
+    def __init__(self, max_entries=1024, clock=time.time):
+        self.max_entries = max_entries
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def entry(self, key):
+        """(value, expiry time) for a live key, None otherwise."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= self.clock():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def get(self, key):
+        entry = self.entry(key)
+        return entry[0] if entry else None
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (value, self.clock() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+class SQLiteBackend:
+    """
+    Values as JSON in one SQLite file, so every worker process on the host
+    sees the same entries. Expired rows are skipped on read and deleted every
+    `purge_every` writes; rows that do not parse (say, left by an older
+    version) read as missing.
+    """
+
+    def __init__(self, path, clock=time.time, purge_every=256):
+        self.path = path
+        self.clock = clock
+        self.purge_every = purge_every
+        self.writes = 0
+        self.lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.connect() as db:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    expires REAL NOT NULL
+                )
+            """)
+
+    def connect(self):
+        # A short-lived connection per call, like ActivityStore
+        return sqlite3.connect(self.path, timeout=30)
+
+    def entry(self, key):
+        with self.connect() as db:
+            row = db.execute("SELECT value, expires FROM entries WHERE key = ? AND expires > ?",
+                             (key, self.clock())).fetchone()
+        if row is None:
+            return None
+        try:
+            return loads(row[0]), row[1]
+        except ValueError:
+            return None
+
+    def get(self, key):
+        entry = self.entry(key)
+        return entry[0] if entry else None
+
+    def set(self, key, value, ttl):
+        now = self.clock()
+        text = dumps(value)
+        with self.connect() as db:
+            db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", (key, text, now + ttl))
+            with self.lock:
+                self.writes += 1
+                purge = self.writes % self.purge_every == 0
+            if purge:
+                db.execute("DELETE FROM entries WHERE expires <= ?", (now,))
+
+    def delete(self, key):
+        with self.connect() as db:
+            db.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+
+class TieredStore:
+    """
+    A per-process backend in front of a shared one. Reads that miss locally
+    are copied into the local tier for what is left of their TTL. Only put
+    values here that never change under the same key (include a revision in
+    the key), since other workers' local tiers are never invalidated. Values
+    the shared backend cannot hold, such as DataFrames, are set with
+    shared=False and stay in this process.
+    """
+
+    def __init__(self, local, shared=None):
+        self.local = local
+        self.shared = shared
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.local.entry(key)
+        if entry is None and self.shared is not None:
+            entry = self.shared.entry(key)
+            if entry is not None:
+                self.local.set(key, entry[0], entry[1] - self.local.clock())
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value, ttl, shared=True):
+        self.local.set(key, value, ttl)
+        if shared and self.shared is not None:
+            self.shared.set(key, value, ttl)
+
+    def delete(self, key):
+        self.local.delete(key)
+        if self.shared is not None:
+            self.shared.delete(key)
+
+    def cached(self, key, ttl, compute, shared=True):
+        """The value under `key`, computing and storing it first if missing."""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value, ttl, shared)
+        return value
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses,
+                "local_entries": len(getattr(self.local, 'entries', ()))}
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(session):
+            session.modified = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        # The id given up by rotate(), deleted from the backend on save
+        self.retired = None
+
+    def rotate(self):
+        """Moves the session to a fresh id, so an id planted in the browser before login is worthless after it."""
+        if not self.new:
+            self.retired = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.modified = True
+
+
+class ServerSessionInterface(SessionInterface):
+    """
+    Flask sessions kept in `backend` for `ttl` seconds after their last
+    change, with only their random id in the cookie.
+    """
+
+    def __init__(self, backend, ttl=7 * 24 * 3600):
+        self.backend = backend
+        self.ttl = ttl
+
+    @staticmethod
+    def key(sid):
+        return 'session:' + sid
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self.backend.get(self.key(sid))
+            if data is not None:
+                return ServerSession(data, sid)
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.retired is not None:
+            self.backend.delete(self.key(session.retired))
+            session.retired = None
+        if not session:
+            if session.modified:
+                self.backend.delete(self.key(session.sid))
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if not session.modified:
+            return
+        self.backend.set(self.key(session.sid), dict(session), self.ttl)
+        response.set_cookie(name, session.sid, max_age=self.ttl, domain=domain, path=path,
+                            httponly=self.get_cookie_httponly(app), secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
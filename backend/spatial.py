@@ -0,0 +1,143 @@
+import math
+import threading
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+
+from geometry import decode_polyline
+
+
+# Routes are bucketed into web-mercator tiles at this zoom (~150km wide at the equator)
+INDEX_ZOOM = 8
+# Routes spanning more tiles than this skip the grid and are always checked directly
+MAX_TILES_PER_ROUTE = 64
+
+
+def tile(lat, lng, zoom=INDEX_ZOOM):
+    """Web-mercator tile (x, y) containing a point."""
+    lat = max(min(lat, 85.0511), -85.0511)
+    n = 2 ** zoom
+    x = int((lng + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def route_entry(activity) -> dict:
+    """What a query needs to answer for an activity: the fields format_activities reads, not the whole record."""
+    return {
+        'id': activity.get('id'),
+        'name': activity.get('name', ''),
+        'type': activity.get('type', ''),
+        'distance': activity.get('distance', 0),
+        'start_date': activity.get('start_date', ''),
+        'map': {key: value for key, value in (activity.get('map') or {}).items()
+                if key in ('summary_polyline', 'simplified')},
+    }
+
+
+def tiles_covering(south, west, north, east, zoom=INDEX_ZOOM):
+    x0, y0 = tile(north, west, zoom)
+    x1, y1 = tile(south, east, zoom)
+    return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+class RouteIndex:
+    """
+    Tile-bucketed index over the bounding boxes of an athlete's routes.
+    Viewport queries only look at the routes filed under the tiles the
+    viewport touches, then confirm the overlap against the exact boxes.
+    Only each route's id, polyline and the fields shown with it are kept.
+    """
+
+    def __init__(self, activities):
+        self.activities = []
+        boxes = []
+        for activity in activities:
+            points = decode_polyline((activity.get('map') or {}).get('summary_polyline'))
+            if not len(points):
+                continue
+            self.activities.append(route_entry(activity))
+            boxes.append([points[:, 0].min(), points[:, 1].min(), points[:, 0].max(), points[:, 1].max()])
+        # south, west, north, east per route
+        self.boxes = np.array(boxes, dtype='float64').reshape(-1, 4)
+
+        self.grid = defaultdict(list)
+        self.oversized = []
+        for i, (south, west, north, east) in enumerate(self.boxes):
+            covering = tiles_covering(south, west, north, east)
+            if len(covering) > MAX_TILES_PER_ROUTE:
+                self.oversized.append(i)
+                continue
+            for key in covering:
+                self.grid[key].append(i)
+
+    def __len__(self):
+        return len(self.activities)
+
+    def query(self, south, west, north, east) -> list:
+        """
+        Activities whose route box intersects the viewport, newest first.
+        :param south:
+        :param west: greater than `east` when the viewport crosses the antimeridian
+        :param north:
+        :param east:
+        :return list:
+        """
+        if west > east:
+            candidates = np.union1d(self.candidates(south, west, north, 180.0),
+                                    self.candidates(south, -180.0, north, east))
+        else:
+            candidates = self.candidates(south, west, north, east)
+        return [self.activities[i] for i in candidates]
+
+    def candidates(self, south, west, north, east):
+        """Indexes of the routes whose box intersects a viewport with west <= east, ascending."""
+        covering = tiles_covering(south, west, north, east)
+        if len(covering) > len(self.grid):
+            candidates = np.arange(len(self.boxes))
+        else:
+            found = set(self.oversized)
+            for key in covering:
+                found.update(self.grid.get(key, ()))
+            candidates = np.fromiter(sorted(found), dtype='int64', count=len(found))
+        if not len(candidates):
+            return candidates
+        boxes = self.boxes[candidates]
+        hits = ((boxes[:, 0] <= north) & (boxes[:, 2] >= south) &
+                (boxes[:, 1] <= east) & (boxes[:, 3] >= west))
+        return candidates[hits]
+
+
+class RouteIndexes:
+    """
+    One RouteIndex per athlete, rebuilt only when the athlete's store revision
+    moves, for the `size` most recently queried athletes.
+    """
+
+    def __init__(self, size=200):
+        self.size = size
+        self.indexes = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, athlete_id, revision, load) -> RouteIndex:
+        """
+        :param athlete_id:
+        :param revision: the store revision the caller sees
+        :param load: called to fetch the activities when the index is stale
+        :return RouteIndex:
+        """
+        with self.lock:
+            cached = self.indexes.get(athlete_id)
+            if cached and cached[0] == revision:
+                self.indexes.move_to_end(athlete_id)
+                return cached[1]
+        index = RouteIndex(load())
+        with self.lock:
+            self.indexes[athlete_id] = (revision, index)
+            self.indexes.move_to_end(athlete_id)
+            while len(self.indexes) > self.size:
+                self.indexes.popitem(last=False)
+        return index
+
+
+route_indexes = RouteIndexes()
@@ -0,0 +1,174 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from geometry import simplified_route
+
+
+class ActivityStore:
+    """
+    Persistent per-athlete copy of the activities pulled from Strava, keyed by
+    athlete and activity id. The newest start_date doubles as the sync cursor
+    for the `after=` parameter of /athlete/activities.
+
+    With a `route_zoom`, each route is also simplified for that zoom as it is
+    merged and stored next to the activity, so serving the map never runs
+    the simplification; load() hands it back as map.simplified.
+
+    Rows are only ever added or replaced. Syncs ask Strava for what is new
+    since the cursor, which says nothing about activities deleted there, so
+    those stay in the stored history, and in the stats, rollups and route
+    index built from it.
+    """
+
+    def __init__(self, path, route_zoom=None):
+        self.path = path
+        self.route_zoom = route_zoom
+        self.lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.connect() as db:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS activities (
+                    athlete_id INTEGER NOT NULL,
+                    activity_id INTEGER NOT NULL,
+                    start_date TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    revision INTEGER NOT NULL DEFAULT 0,
+                    route TEXT,
+                    route_zoom INTEGER,
+                    PRIMARY KEY (athlete_id, activity_id)
+                )
+            """)
+            # Stores created before rows remembered the revision that wrote them and the simplified route
+            existing = [column[1] for column in db.execute("PRAGMA table_info(activities)")]
+            for column, declaration in (('revision', "INTEGER NOT NULL DEFAULT 0"), ('route', "TEXT"),
+                                        ('route_zoom', "INTEGER")):
+                if column not in existing:
+                    db.execute(f"ALTER TABLE activities ADD COLUMN {column} {declaration}")
+            db.execute("CREATE INDEX IF NOT EXISTS activities_start ON activities (athlete_id, start_date)")
+            # Bumped on every write so readers can cheaply tell whether an athlete's history changed
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS revisions (
+                    athlete_id INTEGER PRIMARY KEY,
+                    revision INTEGER NOT NULL,
+                    modified REAL
+                )
+            """)
+            if 'modified' not in [column[1] for column in db.execute("PRAGMA table_info(revisions)")]:
+                db.execute("ALTER TABLE revisions ADD COLUMN modified REAL")
+
+    def connect(self):
+        # A short-lived connection per call keeps this safe across threads and
+        # gunicorn workers sharing the same file
+        return sqlite3.connect(self.path, timeout=30)
+
+    def cursor(self, athlete_id):
+        """
+        Epoch seconds of the athlete's newest stored activity, or None if nothing is stored.
+        :param athlete_id:
+        :return int:
+        """
+        with self.connect() as db:
+            row = db.execute("SELECT MAX(start_date) FROM activities WHERE athlete_id = ?",
+                             (athlete_id,)).fetchone()
+        if not row or not row[0]:
+            return None
+        return int(datetime.fromisoformat(row[0].replace('Z', '+00:00')).timestamp())
+
+    def merge(self, athlete_id, activities) -> tuple:
+        """
+        Inserts new activities and replaces changed ones. Activities stored
+        exactly as given are skipped, so re-fetching the lookback window
+        leaves the revision alone unless something in it changed.
+        :param athlete_id:
+        :param activities:
+        :return (int, int): the athlete's revision before and after the merge,
+            read in the same transaction as the write; after == before + 1
+            means nobody else wrote in between
+        """
+        rows = [(athlete_id, activity['id'], activity.get('start_date', ''), json.dumps(activity))
+                for activity in activities]
+        # Simplified before taking the write lock; a route that did not change is rarely in a sync
+        routes = {activity['id']: self.simplify(activity) for activity in activities}
+        with self.lock, self.connect() as db:
+            # Take the write lock up front so no other worker writes between reading and bumping
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT revision FROM revisions WHERE athlete_id = ?", (athlete_id,)).fetchone()
+            before = row[0] if row else 0
+            stored = {}
+            ids = [row[1] for row in rows]
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                stored.update(db.execute(
+                    f"SELECT activity_id, data FROM activities WHERE athlete_id = ? "
+                    f"AND activity_id IN ({','.join('?' * len(chunk))})", (athlete_id, *chunk)).fetchall())
+            rows = [(*row, before + 1, routes[row[1]], self.route_zoom if routes[row[1]] is not None else None)
+                    for row in rows if stored.get(row[1]) != row[3]]
+            if not rows:
+                return before, before
+            db.executemany("INSERT OR REPLACE INTO activities "
+                           "(athlete_id, activity_id, start_date, data, revision, route, route_zoom) "
+                           "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self.bump(db, athlete_id)
+        return before, before + 1
+
+    def simplify(self, activity):
+        polyline = (activity.get('map') or {}).get('summary_polyline')
+        if self.route_zoom is None or not polyline:
+            return None
+        return simplified_route(polyline, self.route_zoom)
+
+    @staticmethod
+    def activity(data, route, route_zoom) -> dict:
+        activity = json.loads(data)
+        if route is not None:
+            activity['map']['simplified'] = {'zoom': route_zoom, 'polyline': route}
+        return activity
+
+    def bump(self, db, athlete_id):
+        db.execute("INSERT INTO revisions VALUES (?, 1, ?) ON CONFLICT (athlete_id) "
+                   "DO UPDATE SET revision = revision + 1, modified = excluded.modified", (athlete_id, time.time()))
+
+    def revision(self, athlete_id) -> int:
+        """Counter that moves whenever the athlete's stored activities change, 0 if none were ever stored."""
+        with self.connect() as db:
+            row = db.execute("SELECT revision FROM revisions WHERE athlete_id = ?", (athlete_id,)).fetchone()
+        return row[0] if row else 0
+
+    def changes_since(self, athlete_id, revision) -> tuple:
+        """
+        The activities inserted or replaced after `revision`, so a cache built
+        at that revision can catch up without reloading the whole history.
+        Nothing is ever removed, so these are all the changes there are.
+        :param athlete_id:
+        :param revision:
+        :return (list, int): those activities, and the revision they bring the
+            history to, read in one transaction
+        """
+        with self.connect() as db:
+            db.execute("BEGIN")
+            rows = db.execute("SELECT data, route, route_zoom FROM activities WHERE athlete_id = ? AND revision > ?",
+                              (athlete_id, revision)).fetchall()
+            row = db.execute("SELECT revision FROM revisions WHERE athlete_id = ?", (athlete_id,)).fetchone()
+        return [self.activity(*columns) for columns in rows], row[0] if row else 0
+
+    def modified(self, athlete_id):
+        """Epoch seconds of the athlete's last store write, None if unknown."""
+        with self.connect() as db:
+            row = db.execute("SELECT modified FROM revisions WHERE athlete_id = ?", (athlete_id,)).fetchone()
+        return row[0] if row else None
+
+    def load(self, athlete_id) -> list:
+        """
+        All stored activities for an athlete, newest first like the Strava API returns them.
+        :param athlete_id:
+        :return list:
+        """
+        with self.connect() as db:
+            rows = db.execute("SELECT data, route, route_zoom FROM activities WHERE athlete_id = ? "
+                              "ORDER BY start_date DESC, activity_id DESC", (athlete_id,)).fetchall()
+        return [self.activity(*columns) for columns in rows]
@@ -0,0 +1,171 @@
+"""
+Local stand-in for the parts of the Strava API the backend calls, for
+benchmarking offline. Serves a synthetic activity history with an injected
+per-request latency.
+
+    python stub_strava.py --activities 5000 --latency 0.2 --bench
+"""
+import argparse
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from flask import Flask, jsonify, request
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from geometry import encode_polyline, random_route
+
+
+ACTIVITY_TYPES = ['Run', 'Run', 'Run', 'Ride', 'Walk', 'Hike', 'Swim']
+
+
+def synthetic_activities(count, seed=0, start=datetime(2015, 1, 1, tzinfo=timezone.utc), routes=True):
+    """
+    Builds `count` Strava-shaped activity dicts, newest first like /athlete/activities.
+    :param count:
+    :param seed:
+    :param start:
+    :param routes: False leaves out the route polylines, which take most of the time to generate
+    :return list:
+    """
+    rng = random.Random(seed)
+    route_rng = np.random.default_rng(seed)
+    activities = []
+    when = start
+    # Steps average 33 hours; long histories take shorter ones so they still span about 10 years
+    step = min(1.0, 10 * 365 * 24 / (33 * max(count, 1)))
+    for i in range(count):
+        when += timedelta(hours=rng.randint(6, 60) * step)
+        kind = rng.choice(ACTIVITY_TYPES)
+        distance = round(rng.uniform(1000, 25000), 1)
+        speed = rng.uniform(2.2, 4.5) if kind != 'Ride' else rng.uniform(5, 10)
+        elev_low = round(rng.uniform(0, 1500), 1)
+        route = random_route(route_rng, rng.randint(50, 400)) if routes else [(0.0, 0.0)]
+        activities.append({
+            'id': 1000000 + i,
+            'athlete': {'id': 1},
+            'name': f"{kind} {i}",
+            'type': kind,
+            'distance': distance,
+            'moving_time': int(distance / speed),
+            'elapsed_time': int(distance / speed * 1.1),
+            'total_elevation_gain': round(rng.uniform(0, 400), 1),
+            'average_speed': round(speed, 3),
+            'max_speed': round(speed * rng.uniform(1.1, 1.6), 3),
+            'elev_high': round(elev_low + rng.uniform(0, 300), 1),
+            'elev_low': elev_low,
+            'start_date': when.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'start_date_local': when.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'start_latlng': [round(route[0][0], 5), round(route[0][1], 5)],
+            'map': {'id': f"a{1000000 + i}", 'summary_polyline': encode_polyline(route) if routes else ''},
+        })
+    activities.reverse()
+    return activities
+
+
+def create_app(activities, latency=0.0, limits=(100, 1000), window=900, faults=None, rate_limit_headers=True):
+    """
+    :param faults: status codes to answer /athlete/activities with instead,
+        one per request until the list runs out; tests read what is left
+    :param rate_limit_headers: False leaves out the X-RateLimit-* headers
+    """
+    stub = Flask(__name__)
+    # Request counters for the short and daily windows, reported like Strava does
+    usage = {'count': [0, 0], 'since': time.monotonic()}
+    usage_lock = threading.Lock()
+    stub.usage = usage
+
+    @stub.after_request
+    def add_rate_limit_headers(response):
+        if not rate_limit_headers:
+            return response
+        response.headers['X-RateLimit-Limit'] = f"{limits[0]},{limits[1]}"
+        response.headers['X-RateLimit-Usage'] = f"{usage['count'][0]},{usage['count'][1]}"
+        return response
+
+    @stub.route('/api/v3/athlete/activities')
+    def athlete_activities():
+        time.sleep(latency)
+        with usage_lock:
+            if time.monotonic() - usage['since'] >= window:
+                usage['count'][0] = 0
+                usage['since'] = time.monotonic()
+            if usage['count'][0] >= limits[0] or usage['count'][1] >= limits[1]:
+                return jsonify({"message": "Rate Limit Exceeded"}), 429
+            usage['count'][0] += 1
+            usage['count'][1] += 1
+            fault = faults.pop(0) if faults else None
+        if fault:
+            return jsonify({"message": "Injected fault"}), fault
+        if request.headers.get('Authorization') == 'Bearer expired':
+            return jsonify({"message": "Authorization Error"}), 401
+        per_page = int(request.args.get('per_page', 30))
+        page = int(request.args.get('page', 1))
+        selected = activities
+        if 'after' in request.args:
+            # Strava returns activities oldest first when filtering with after=
+            after = datetime.fromtimestamp(int(request.args['after']), timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+            selected = [a for a in reversed(activities) if a['start_date'] > after]
+        return jsonify(selected[(page - 1) * per_page:page * per_page])
+
+    @stub.route('/oauth/token', methods=['POST'])
+    def token():
+        time.sleep(latency)
+        # Numeric codes stand for different athletes, so load tests can log in many at once
+        code = request.form.get('code', '')
+        athlete_id = int(code) if code.isdigit() else 1
+        return jsonify({"access_token": "stub", "refresh_token": "stub", "expires_at": int(time.time()) + 6 * 3600,
+                        "athlete": {"id": athlete_id}})
+
+    return stub
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def serve(activities, latency=0.0, port=0, **options):
+    """Starts the stub on a background thread and returns the running server."""
+    server = make_server('127.0.0.1', port, create_app(activities, latency, **options),
+                         threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bench(count, latency, windows):
+    import app
+
+    server = serve(synthetic_activities(count), latency, limits=(10 ** 6, 10 ** 6))
+    app.strava_limiter.limits = [10 ** 6, 10 ** 6]
+    app.API_URL = f"http://127.0.0.1:{server.server_port}/api/v3"
+    strava = app.StravaStatsAPI("stub")
+    try:
+        for window in windows:
+            start = time.perf_counter()
+            fetched = strava.fetch_activities(window=window)
+            elapsed = time.perf_counter() - start
+            print(f"window={window:<3} activities={len(fetched):<6} {elapsed:.2f}s")
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--activities', type=int, default=5000)
+    parser.add_argument('--latency', type=float, default=0.2, help="seconds added to every request")
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--limits', type=int, nargs=2, default=[100, 1000], metavar=('SHORT', 'DAILY'),
+                        help="requests allowed per window before answering 429")
+    parser.add_argument('--window', type=float, default=900, help="seconds before the short limit resets")
+    parser.add_argument('--bench', action='store_true', help="time serial vs windowed fetch_activities")
+    parser.add_argument('--windows', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    if args.bench:
+        bench(args.activities, args.latency, args.windows)
+    else:
+        stub = create_app(synthetic_activities(args.activities), args.latency, args.limits, args.window)
+        stub.run(port=args.port, threaded=True)
@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# app opens its stores and starts nothing in the background based on the
+# environment at import, so point them somewhere disposable first
+STATE_DIR = tempfile.mkdtemp(prefix='stravastats-tests-')
+os.environ.setdefault('ACTIVITY_DB', os.path.join(STATE_DIR, 'activities.db'))
+os.environ.setdefault('STATE_DB', os.path.join(STATE_DIR, 'state.db'))
+os.environ.setdefault('PLOT_CACHE_DIR', '')
+os.environ.setdefault('PREFETCH_INTERVAL', '0')
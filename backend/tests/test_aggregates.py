@@ -0,0 +1,187 @@
+"""Incremental aggregates against a full recompute, over seeded random update sequences."""
+import copy
+import random
+import time
+
+import pytest
+
+from analytics import PERIODS, columns, rollup, running_stats
+from analytics.aggregates import Extremum, RunningStats, StatsRegistry
+from analytics.rollups import Rollups
+from store import ActivityStore
+from stub_strava import synthetic_activities
+
+
+def edited(activity, rng):
+    # The kinds of edits Strava reports back: a new type, a corrected distance, a moved start
+    activity = copy.deepcopy(activity)
+    change = rng.choice(['type', 'distance', 'date', 'missing'])
+    if change == 'type':
+        activity['type'] = rng.choice(['Run', 'Ride', 'Walk'])
+    elif change == 'distance':
+        activity['distance'] = round(rng.uniform(500, 30000), 1)
+        activity['max_speed'] = round(rng.uniform(2, 9), 3)
+    elif change == 'date':
+        day = rng.randint(1, 28)
+        activity['start_date'] = activity['start_date_local'] = f"2016-02-{day:02d}T07:00:00Z"
+    else:
+        activity['elev_high'] = None
+    return activity
+
+
+def updates(seed, steps=40):
+    """Yields (current history, added or replaced activities, removed ids) after each random step."""
+    rng = random.Random(seed)
+    pool = synthetic_activities(600, seed=seed, routes=False)
+    current = {activity['id']: activity for activity in pool[:100]}
+    fresh = pool[100:]
+    yield dict(current), list(current.values()), []
+    for _ in range(steps):
+        added, removed = [], []
+        for _ in range(rng.randint(1, 8)):
+            action = rng.random()
+            if action < 0.5 and fresh:
+                added.append(fresh.pop())
+            elif action < 0.8 and current:
+                added.append(edited(current[rng.choice(list(current))], rng))
+            elif current:
+                removed.append(rng.choice(list(current)))
+        added = [activity for activity in added if activity['id'] not in removed]
+        for activity_id in removed:
+            current.pop(activity_id, None)
+        current.update((activity['id'], activity) for activity in added)
+        yield dict(current), added, removed
+
+
+@pytest.mark.parametrize('seed', range(8))
+def test_running_stats_aggregate_matches_recompute(seed):
+    aggregate = RunningStats()
+    for current, added, removed in updates(seed):
+        aggregate.remove(removed)
+        aggregate.add(added)
+        assert aggregate.result() == running_stats(columns.frame(list(current.values())))
+
+
+def assert_same_rollup(incremental, recomputed):
+    # Sums taken in another order may land either side of a rounding boundary, one last digit apart
+    for key, value in recomputed.items():
+        if key == 'trend':
+            assert_same_rollup(incremental[key], value)
+        elif key in ('distance', 'elevation_gain'):
+            assert incremental[key] == pytest.approx(value, abs=0.1 + 1e-6)
+        elif key == 'average_speed':
+            assert incremental[key] == pytest.approx(value, abs=0.001 + 1e-6)
+        else:
+            assert incremental[key] == value
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_rollups_match_recompute(seed):
+    rollups = Rollups()
+    for current, added, removed in updates(seed, steps=15):
+        rollups.remove(removed)
+        rollups.add(added)
+        df = columns.frame(list(current.values()))
+        for period in PERIODS:
+            for activity_type in ('Run', None):
+                assert_same_rollup(rollups.result(period, activity_type), rollup(df, period, activity_type))
+
+
+@pytest.mark.parametrize('largest', [True, False])
+def test_extremum_matches_max_of_live_values(largest):
+    rng = random.Random(int(largest))
+    extremum = Extremum(largest)
+    live = []
+    for _ in range(5000):
+        if live and rng.random() < 0.45:
+            value = live.pop(rng.randrange(len(live)))
+            extremum.remove(value)
+        else:
+            value = rng.randint(0, 200)
+            live.append(value)
+            extremum.add(value)
+        expected = (max(live) if largest else min(live)) if live else None
+        assert extremum.value(None) == expected
+
+
+def test_extremum_stays_linear_under_churn():
+    # Many repeats of few values, like streak lengths: the heap used to be rebuilt on every removal
+    extremum = Extremum()
+    values = [i % 20 for i in range(50_000)]
+    for value in values:
+        extremum.add(value)
+    start = time.perf_counter()
+    for value in values:
+        extremum.remove(value)
+        extremum.add(value + 1)
+    assert time.perf_counter() - start < 5
+    assert len(extremum.heap) <= 2 * extremum.size + 16
+    assert extremum.value(None) == 20
+
+
+def test_registry_applies_delta_only_after_a_single_write():
+    activities = synthetic_activities(200, seed=1, routes=False)
+    history = activities[50:]
+    registry = StatsRegistry()
+    loads = []
+
+    def load(snapshot):
+        return lambda: loads.append(1) or list(snapshot)
+
+    aggregate = registry.update(1, 0, 1, history, load(history))
+    assert loads == [1]
+
+    # Exactly this delta moved the store from 1 to 2
+    history = activities[40:]
+    assert registry.update(1, 1, 2, activities[40:50], load(history)) is aggregate
+    assert loads == [1]
+    assert registry.result(aggregate) == running_stats(columns.frame(history))
+
+    # Another writer added activities[30:40] first; this sync's merge changed nothing
+    history = activities[30:]
+    rebuilt = registry.update(1, 3, 3, [], load(history))
+    assert loads == [1, 1]
+    assert registry.result(rebuilt) == running_stats(columns.frame(history))
+
+    # Or it did change something, but the store moved by two revisions
+    history = activities[10:]
+    rebuilt = registry.update(1, 4, 5, activities[10:20], load(history))
+    assert loads == [1, 1, 1]
+    assert registry.result(rebuilt) == running_stats(columns.frame(history))
+
+
+def test_registry_catches_up_from_the_store(tmp_path):
+    activities = synthetic_activities(200, seed=2, routes=False)
+    store = ActivityStore(str(tmp_path / 'activities.db'))
+    registry = StatsRegistry()
+    loads = []
+
+    def load():
+        loads.append(1)
+        return store.load(1)
+
+    def changes(revision):
+        loads.append(('since', revision))
+        return store.changes_since(1, revision)
+
+    before, after = store.merge(1, activities[100:])
+    aggregate = registry.update(1, before, after, activities[100:], load, changes)
+    assert loads == [1]
+
+    # Other writers stored two syncs, one replacing an activity, before this one
+    store.merge(1, activities[80:100])
+    store.merge(1, [dict(activities[90], type='Ride')] + activities[70:80])
+    before, after = store.merge(1, activities[60:70])
+    assert registry.update(1, before, after, activities[60:70], load, changes) is aggregate
+    assert loads == [1, ('since', 1)]
+    assert registry.result(aggregate) == running_stats(columns.frame(store.load(1)))
+
+
+def test_registry_keeps_the_most_recently_used():
+    activities = synthetic_activities(20, seed=3, routes=False)
+    registry = StatsRegistry(size=2)
+    for athlete_id in (1, 2, 1, 3):
+        registry.update(athlete_id, 0, 1, activities, lambda: activities)
+    assert registry.get(1) is not None
+    assert registry.get(2) is None
+    assert registry.get(3) is not None
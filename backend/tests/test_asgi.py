@@ -0,0 +1,76 @@
+"""The ASGI /callback through Quart's test client, against the local Strava stub."""
+import asyncio
+import threading
+
+import pytest
+
+import app as wsgi
+import asgi
+from ratelimit import RateLimiter
+from stub_strava import serve, synthetic_activities
+
+
+ACTIVITIES = synthetic_activities(25, seed=12, routes=False)
+
+
+@pytest.fixture
+def strava(monkeypatch):
+    server = serve(ACTIVITIES)
+    base = f"http://127.0.0.1:{server.server_port}"
+    monkeypatch.setattr(wsgi, 'PAGE_SIZE', 10)
+    monkeypatch.setattr(wsgi, 'strava_limiter', RateLimiter(reserve=0))
+    monkeypatch.setattr(wsgi, 'API_URL', base + '/api/v3')
+    monkeypatch.setattr(wsgi, 'AUTH_LINK', base + '/oauth/token')
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def blocking_calls(monkeypatch):
+    """Records, per store call made by the callback, whether it ran on the event loop's thread."""
+    calls = []
+
+    def recorded(name, fn):
+        def call(*args, **kwargs):
+            calls.append((name, threading.current_thread() is loop_thread))
+            return fn(*args, **kwargs)
+        return call
+
+    loop_thread = None
+    for target, name in ((wsgi, 'issue_stream_ticket'), (wsgi, 'register_login'),
+                         (wsgi.activity_store, 'merge'), (wsgi.activity_store, 'load')):
+        monkeypatch.setattr(target, name, recorded(name, getattr(target, name)))
+
+    def run(coroutine):
+        nonlocal loop_thread
+        loop_thread = threading.current_thread()
+        return asyncio.run(coroutine)
+
+    return calls, run
+
+
+async def post_callback(payload):
+    async with asgi.quart_app.test_app() as test_app:
+        response = await test_app.test_client().post('/callback', json=payload)
+        return response.status_code, await response.get_json()
+
+
+def test_callback_returns_the_dashboard(strava, blocking_calls):
+    calls, run = blocking_calls
+    status, payload = run(post_callback({'code': '9301'}))
+    assert status == 200
+    assert payload['stats'] == wsgi.analytics.running_stats(wsgi.columns.frame(ACTIVITIES))
+    assert len(payload['activities']) == len(ACTIVITIES)
+    assert wsgi.activity_store.revision(9301)
+    assert {name for name, _ in calls} >= {'register_login', 'merge', 'load'}
+    assert not [name for name, on_loop in calls if on_loop]
+
+
+def test_stream_ticket_is_issued_off_the_event_loop(strava, blocking_calls):
+    calls, run = blocking_calls
+    status, payload = run(post_callback({'code': '9302', 'stream': True}))
+    assert status == 200
+    assert ('issue_stream_ticket', False) in calls
+    assert not [name for name, on_loop in calls if on_loop]
+    # Any worker, the WSGI half included, can open it
+    assert wsgi.app.test_client().get(payload['stream']).status_code == 200
@@ -0,0 +1,44 @@
+"""Input checks on the login callback."""
+import pytest
+
+import app
+from geometry import MAX_ZOOM, parse_zoom
+
+
+@pytest.mark.parametrize('value, zoom', [(12, 12), ('12', 12), (12.7, 12), (-3, 0), (5000, MAX_ZOOM),
+                                         ('abc', None), (None, None), ([], None), (float('inf'), None)])
+def test_parse_zoom(value, zoom):
+    assert parse_zoom(value) == zoom
+
+
+@pytest.mark.parametrize('zoom', ['abc', [14], {'z': 1}])
+def test_callback_rejects_non_numeric_zoom(zoom):
+    response = app.app.test_client().post('/callback', json={'code': '1', 'zoom': zoom})
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "zoom must be an integer"}
+
+
+def test_strava_auth_keeps_the_issued_refresh_token(monkeypatch, capsys):
+    responses = []
+
+    class Response:
+        def __init__(self, data):
+            self.data = data
+
+        def json(self):
+            return self.data
+
+    monkeypatch.setattr(app, 'REFRESH_TOKEN', 'app-owner-secret')
+    monkeypatch.setattr(app.http, 'post', lambda url, data: responses.pop(0))
+
+    client = app.app.test_client()
+    responses.append(Response({"access_token": "access"}))
+    assert client.get('/auth/strava').status_code == 400
+    with client.session_transaction() as session:
+        assert 'refresh_token' not in session
+
+    responses.append(Response({"access_token": "access", "refresh_token": "rotated"}))
+    assert client.get('/auth/strava').get_json() == {"access_token": "access"}
+    with client.session_transaction() as session:
+        assert session['refresh_token'] == 'rotated'
+    assert 'app-owner-secret' not in capsys.readouterr().out
@@ -0,0 +1,52 @@
+"""Cross-origin requests from the frontend carry the session cookie, so CORS names the origin instead of '*'."""
+import asyncio
+
+import app
+import asgi
+
+
+FRONTEND = app.FRONTEND_ORIGINS[0]
+
+
+def test_session_routes_allow_the_frontend_with_credentials():
+    app.activity_store.merge(9701, [])
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session['athlete_id'] = 9701
+
+    response = client.get('/activities/streaks', headers={'Origin': FRONTEND})
+    assert response.status_code == 200
+    assert response.headers['Access-Control-Allow-Origin'] == FRONTEND
+    assert response.headers['Access-Control-Allow-Credentials'] == 'true'
+
+    response = client.get('/activities/streaks', headers={'Origin': 'https://elsewhere.example'})
+    assert 'Access-Control-Allow-Origin' not in response.headers
+
+
+def test_callback_preflight_names_the_origin():
+    response = app.app.test_client().options('/callback', headers={
+        'Origin': FRONTEND, 'Access-Control-Request-Method': 'POST', 'Access-Control-Request-Headers': 'content-type'})
+    assert response.status_code == 200
+    assert response.headers['Access-Control-Allow-Origin'] == FRONTEND
+    assert response.headers['Access-Control-Allow-Credentials'] == 'true'
+
+
+def test_session_cookie_can_cross_sites():
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session['athlete_id'] = 9702
+    cookie = client.get_cookie(app.app.config['SESSION_COOKIE_NAME'])
+    assert (cookie.same_site, cookie.secure, cookie.http_only) == ('None', True, True)
+
+
+def test_asgi_callback_names_the_origin():
+    async def preflight(origin):
+        async with asgi.quart_app.test_app() as test_app:
+            return (await test_app.test_client().options('/callback', headers={
+                'Origin': origin, 'Access-Control-Request-Method': 'POST'})).headers
+
+    headers = asyncio.run(preflight(FRONTEND))
+    assert headers['Access-Control-Allow-Origin'] == FRONTEND
+    assert headers['Access-Control-Allow-Credentials'] == 'true'
+    assert 'Origin' in headers['Vary']
+    assert 'Access-Control-Allow-Origin' not in asyncio.run(preflight('https://elsewhere.example'))
@@ -0,0 +1,140 @@
+"""Paging, retries, token refreshes and the rate limiter against the local Strava stub."""
+import pytest
+
+import app
+from ratelimit import RateLimiter, RateLimitExceeded, backoff
+from stub_strava import serve, synthetic_activities
+
+
+ACTIVITIES = synthetic_activities(25, routes=False)
+# Fixed, 800s before the short window resets, so a spent window is never waited out
+NOW = 1000.0
+
+
+@pytest.fixture
+def strava(monkeypatch):
+    """Starts a stub with the given options and points the app at it; returns the stub's request counters."""
+    servers = []
+    sleeps = []
+    monkeypatch.setattr(app, 'PAGE_SIZE', 10)
+    monkeypatch.setattr(app, 'strava_limiter', RateLimiter(reserve=0, clock=lambda: NOW))
+    monkeypatch.setattr(app, 'backoff', lambda attempt: sleeps.append(attempt) or 0)
+
+    def start(**options):
+        server = serve(ACTIVITIES, **options)
+        servers.append(server)
+        base = f"http://127.0.0.1:{server.server_port}"
+        monkeypatch.setattr(app, 'API_URL', base + '/api/v3')
+        monkeypatch.setattr(app, 'AUTH_LINK', base + '/oauth/token')
+        return server.app.usage['count'], sleeps
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+@pytest.fixture
+def refreshes(monkeypatch):
+    calls = []
+    request_token = app.StravaStatsAPI.request_token
+
+    def counted(self):
+        calls.append(self.refresh_token)
+        return request_token(self)
+
+    monkeypatch.setattr(app.StravaStatsAPI, 'request_token', counted)
+    return calls
+
+
+def test_fetches_every_page(strava, refreshes):
+    requests, sleeps = strava()
+    assert app.StravaStatsAPI('stub').fetch_activities(window=1) == ACTIVITIES
+    assert requests[0] == 3
+    assert sleeps == refreshes == []
+
+
+def test_server_errors_are_retried_with_backoff(strava, refreshes):
+    requests, sleeps = strava(faults=[500, 503])
+    assert app.StravaStatsAPI('stub').fetch_activities(window=1) == ACTIVITIES
+    assert requests[0] == 5
+    assert sleeps == [0, 1]
+    assert refreshes == []
+
+
+def test_server_errors_give_up_after_max_retries(strava, refreshes):
+    requests, sleeps = strava(faults=[503] * 20)
+    with pytest.raises(app.StravaError):
+        app.StravaStatsAPI('stub').fetch_activities(window=1)
+    assert requests[0] == app.MAX_RETRIES
+    # No wait after the last attempt
+    assert sleeps == list(range(app.MAX_RETRIES - 1))
+    assert refreshes == []
+
+
+def test_429_with_headers_is_retried(strava, refreshes):
+    requests, sleeps = strava(faults=[429])
+    assert app.StravaStatsAPI('stub').fetch_activities(window=1) == ACTIVITIES
+    assert requests[0] == 4
+    assert sleeps == [0]
+    assert refreshes == []
+    # The limiter now counts what Strava reported
+    assert app.strava_limiter.usage == [4, 4]
+
+
+def test_429_without_headers_spends_the_window(strava, refreshes):
+    requests, sleeps = strava(faults=[429], rate_limit_headers=False)
+    with pytest.raises(RateLimitExceeded) as raised:
+        app.StravaStatsAPI('stub').fetch_activities(window=1)
+    # No further request once the window is known to be spent
+    assert requests[0] == 1
+    assert raised.value.retry_after == 800
+    assert refreshes == []
+
+
+def test_stops_before_strava_refuses(strava):
+    requests, _ = strava(limits=(2, 1000))
+    with pytest.raises(RateLimitExceeded):
+        app.StravaStatsAPI('stub').fetch_activities(window=1)
+    # The headers said the window was full, so the third page was never sent
+    assert requests[0] == 2
+
+
+def test_token_is_refreshed_only_on_401(strava, refreshes):
+    requests, sleeps = strava()
+    api = app.StravaStatsAPI('expired', 'athlete-refresh-token')
+    assert api.fetch_activities(window=1) == ACTIVITIES
+    assert refreshes == ['athlete-refresh-token']
+    assert api.access_token == 'stub'
+    assert sleeps == []
+
+
+def test_token_refreshes_are_bounded(strava, monkeypatch):
+    requests, _ = strava()
+    calls = []
+    monkeypatch.setattr(app.StravaStatsAPI, 'request_token', lambda self: calls.append(1) or 'expired')
+    with pytest.raises(app.StravaError, match='401'):
+        app.StravaStatsAPI('expired', 'athlete-refresh-token').fetch_activities(window=1)
+    assert len(calls) == app.MAX_TOKEN_REFRESHES
+    assert requests[0] == app.MAX_TOKEN_REFRESHES + 1
+
+
+def test_no_refresh_without_the_athletes_refresh_token(strava, monkeypatch):
+    strava()
+    monkeypatch.setattr(app, 'REFRESH_TOKEN', 'app-owner')
+    with pytest.raises(ValueError):
+        app.StravaStatsAPI('expired').fetch_activities(window=1)
+
+
+def test_rate_limit_exceeded_is_a_429_with_retry_after(strava):
+    strava()
+    app.strava_limiter.exhaust()
+    response = app.app.test_client().post('/callback', json={'code': '4242'})
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '800'
+
+
+@pytest.mark.parametrize('attempt', range(10))
+def test_backoff_is_capped_exponential_with_jitter(attempt):
+    delays = [backoff(attempt) for _ in range(200)]
+    assert all(0 <= delay <= min(30.0, 0.5 * 2 ** attempt) for delay in delays)
+    assert len(set(delays)) > 1
@@ -0,0 +1,120 @@
+"""Validators and content negotiation of conditional() routes."""
+import gzip
+import json
+
+import pytest
+from flask import Flask, jsonify
+from werkzeug.http import http_date
+
+import app
+import httpcache
+from sessions import MemoryBackend, TieredStore
+from stub_strava import synthetic_activities
+
+
+@pytest.fixture
+def client():
+    state = {'version': 'v1', 'modified': httpcache.STARTED + 100, 'calls': 0}
+    web = Flask(__name__)
+
+    @web.route('/data')
+    @httpcache.conditional(lambda: state['version'], TieredStore(MemoryBackend()), modified=lambda: state['modified'])
+    def data():
+        state['calls'] += 1
+        return jsonify({"values": list(range(500)), "version": state['version']})
+
+    @web.route('/small')
+    @httpcache.conditional(lambda: state['version'])
+    def small():
+        return jsonify({"ok": True})
+
+    client = web.test_client()
+    client.state = state
+    return client
+
+
+def test_etag_is_stable_until_the_version_changes(client):
+    first = client.get('/data')
+    again = client.get('/data')
+    assert first.status_code == again.status_code == 200
+    assert first.headers['ETag'] == again.headers['ETag']
+    # The encoded body was kept, so the view ran once
+    assert client.state['calls'] == 1
+
+    client.state['version'] = 'v2'
+    changed = client.get('/data')
+    assert changed.headers['ETag'] != first.headers['ETag']
+    assert changed.get_json()['version'] == 'v2'
+
+
+def test_matching_if_none_match_is_an_empty_304(client):
+    tag = client.get('/data').headers['ETag']
+    response = client.get('/data', headers={'If-None-Match': tag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == tag
+
+    client.state['version'] = 'v2'
+    assert client.get('/data', headers={'If-None-Match': tag}).status_code == 200
+
+
+def test_if_modified_since(client):
+    response = client.get('/data')
+    last_modified = response.headers['Last-Modified']
+    assert last_modified == http_date(int(client.state['modified']))
+    assert client.get('/data', headers={'If-Modified-Since': last_modified}).status_code == 304
+
+    client.state['modified'] += 60
+    assert client.get('/data', headers={'If-Modified-Since': last_modified}).status_code == 200
+    # If-None-Match wins when both are sent
+    stale = {'If-Modified-Since': http_date(int(client.state['modified'])), 'If-None-Match': '"other"'}
+    assert client.get('/data', headers=stale).status_code == 200
+
+
+def test_never_older_than_the_process(client):
+    client.state['modified'] = httpcache.STARTED - 3600
+    assert client.get('/data').headers['Last-Modified'] == http_date(int(httpcache.STARTED))
+
+
+@pytest.mark.parametrize('accept, encoding', [('gzip', 'gzip'), ('gzip;q=0', None), ('', None),
+                                              ('identity', None), ('deflate', None)])
+def test_accept_encoding_negotiation(client, accept, encoding):
+    response = client.get('/data', headers={'Accept-Encoding': accept})
+    assert response.headers.get('Content-Encoding') == encoding
+    body = gzip.decompress(response.data) if encoding == 'gzip' else response.data
+    assert json.loads(body)['values'] == list(range(500))
+    assert 'Accept-Encoding' in response.headers['Vary']
+
+
+def test_brotli_is_preferred_when_available(client):
+    brotli = pytest.importorskip('brotli')
+    response = client.get('/data', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert json.loads(brotli.decompress(response.data))['values'] == list(range(500))
+
+
+def test_encodings_get_their_own_etags(client):
+    plain = client.get('/data', headers={'Accept-Encoding': 'identity'})
+    gzipped = client.get('/data', headers={'Accept-Encoding': 'gzip'})
+    assert plain.headers['ETag'] != gzipped.headers['ETag']
+    assert client.get('/data', headers={'Accept-Encoding': 'gzip', 'If-None-Match': plain.headers['ETag']}
+                      ).status_code == 200
+
+
+def test_small_bodies_are_not_compressed(client):
+    response = client.get('/small', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_json() == {"ok": True}
+    assert 'Last-Modified' not in response.headers
+
+
+def test_athlete_routes_revalidate_by_store_write():
+    app.activity_store.merge(9101, synthetic_activities(30, routes=False))
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session['athlete_id'] = 9101
+    response = client.get('/activities/rollups?period=month')
+    assert response.status_code == 200
+    last_modified = response.headers['Last-Modified']
+    assert client.get('/activities/rollups?period=month',
+                      headers={'If-Modified-Since': last_modified}).status_code == 304
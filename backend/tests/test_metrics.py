@@ -0,0 +1,102 @@
+"""/metrics: request counts by endpoint and status, stage histograms, and requests whose view raised."""
+import asyncio
+import json
+import logging
+import re
+
+import pytest
+
+import app
+import asgi
+import metrics
+from stub_strava import synthetic_activities
+
+
+def scrape(client):
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    return response.get_data(as_text=True)
+
+
+def sample(text, name, **labels):
+    """The value of one sample in an exposition, 0 when it is not there yet."""
+    wanted = metrics.format_labels(metrics.label_key(labels))
+    for line in text.splitlines():
+        if line.startswith(name + wanted + ' '):
+            return float(line.rsplit(' ', 1)[1])
+    return 0
+
+
+class Broken:
+    def stats(self):
+        raise RuntimeError("disk gone")
+
+
+def test_exposition_has_request_counts_and_stage_histograms():
+    client = app.app.test_client()
+    before = scrape(client)
+    for _ in range(3):
+        client.get('/')
+    assert client.get('/plots/unknown-job').status_code == 404
+    app.activity_store.merge(9601, synthetic_activities(20, seed=16, routes=False))
+    with client.session_transaction() as session:
+        session['athlete_id'] = 9601
+    assert client.get('/activities/streaks').status_code == 200
+    text = scrape(client)
+
+    for metric in metrics.REGISTRY:
+        assert f"# TYPE {metric.name} {type(metric).__name__.lower()}" in text
+    ok = sample(text, 'stravastats_requests_total', endpoint='/', status=200)
+    assert ok == sample(before, 'stravastats_requests_total', endpoint='/', status=200) + 3
+    assert sample(text, 'stravastats_requests_total', endpoint='/plots/<job_id>', status=404) >= 1
+
+    # The streaks route built the athlete's table under a 'frame' span
+    buckets = [float(value) for value in re.findall(r'stravastats_stage_seconds_bucket\{stage="frame",le="[^"]+"\} (\S+)', text)]
+    assert len(buckets) == len(metrics.Histogram.BUCKETS)
+    assert buckets == sorted(buckets) and buckets[-1] >= 1
+    assert sample(text, 'stravastats_stage_seconds_count', stage='frame') == buckets[-1]
+    assert sample(text, 'stravastats_stage_seconds_sum', stage='frame') > 0
+
+
+def test_raising_views_count_as_500(monkeypatch):
+    monkeypatch.setattr(app.plots, 'plot_cache', Broken())
+    client = app.app.test_client()
+    counted = lambda: sample(metrics.exposition(), 'stravastats_requests_total', endpoint='/plots/cache/stats', status=500)
+    before = counted()
+
+    assert client.get('/plots/cache/stats').status_code == 500
+    assert counted() == before + 1
+
+    # With exceptions propagating, as in debug and testing, no after_request hook runs at all
+    monkeypatch.setitem(app.app.config, 'PROPAGATE_EXCEPTIONS', True)
+    with pytest.raises(RuntimeError, match="disk gone"):
+        client.get('/plots/cache/stats')
+    assert counted() == before + 2
+
+
+def test_request_log_line_for_a_raising_view(monkeypatch, caplog):
+    monkeypatch.setattr(metrics, 'REQUEST_LOG', True)
+    monkeypatch.setattr(app.plots, 'plot_cache', Broken())
+    caplog.set_level(logging.INFO, logger='stravastats.requests')
+
+    assert app.app.test_client().get('/plots/cache/stats').status_code == 500
+    record = json.loads(caplog.records[-1].getMessage())
+    assert (record['path'], record['status']) == ('/plots/cache/stats', 500)
+    assert metrics.current_request.get() is None
+
+
+def test_asgi_raising_views_count_as_500(monkeypatch):
+    def broken(value):
+        raise RuntimeError("bad zoom")
+
+    monkeypatch.setattr(asgi, 'parse_zoom', broken)
+    counted = lambda: sample(metrics.exposition(), 'stravastats_requests_total', endpoint='/callback', status=500)
+    before = counted()
+
+    async def post():
+        async with asgi.quart_app.test_app() as test_app:
+            return (await test_app.test_client().post('/callback', json={'code': '1'})).status_code
+
+    assert asyncio.run(post()) == 500
+    assert counted() == before + 1
@@ -0,0 +1,108 @@
+"""pace_histogram against the iterrows() loop behind the old plot_paces, and its binning options."""
+import random
+from collections import defaultdict
+
+import pytest
+
+import app
+from analytics import columns, pace_histogram
+from stub_strava import synthetic_activities
+
+
+def reference_plot_paces(df) -> dict:
+    # The data plot_paces drew before pace_histogram: miles per whole-minute pace, one row at a time
+    miles_by_pace = defaultdict(float)
+    for index, activity in df.iterrows():
+        if activity['type'] == 'Run':
+            distance_miles = activity['distance'] * 0.00062137
+            moving_time_minutes = activity['moving_time'] / 60.0
+            pace = moving_time_minutes / distance_miles
+            rounded_pace = round(pace)
+            miles_by_pace[rounded_pace] += distance_miles
+    return dict(sorted(miles_by_pace.items()))
+
+
+def reference_histogram(df, bin_seconds, unit, weight, min_distance, max_distance, pace_limits):
+    # The same loop, generalised to the options pace_histogram takes (outlier trimming aside)
+    meters = {'mile': 1609.344, 'km': 1000.0}[unit]
+    totals = defaultdict(float)
+    kept = 0
+    for index, activity in df.iterrows():
+        distance, seconds = activity['distance'], activity['moving_time']
+        if activity['type'] != 'Run' or not distance > 0 or not seconds > 0 or distance < min_distance:
+            continue
+        if max_distance is not None and distance > max_distance:
+            continue
+        pace = seconds / (distance / meters)
+        if pace_limits is not None and not pace_limits[0] <= pace <= pace_limits[1]:
+            continue
+        totals[round(pace / bin_seconds)] += distance / meters if weight == 'distance' else seconds / 60.0
+        kept += 1
+    if not totals:
+        return {}, kept
+    return {index * bin_seconds / 60.0: totals.get(index, 0.0) for index in range(min(totals), max(totals) + 1)}, kept
+
+
+def frame(count, seed):
+    return columns.frame(synthetic_activities(count, seed=seed, routes=False))
+
+
+@pytest.mark.parametrize('count', [0, 1, 50, 1000])
+def test_matches_iterrows_loop(count):
+    df = frame(count, count)
+    histogram = pace_histogram(df, pace_limits=None, outlier_iqr=None, min_distance=0)
+    expected = reference_plot_paces(df)
+    found = {pace: value for pace, value in zip(histogram['paces'], histogram['values']) if value}
+    assert list(found) == list(expected)
+    assert list(found.values()) == pytest.approx(list(expected.values()), abs=0.01)
+
+
+@pytest.mark.parametrize('seed', range(4))
+@pytest.mark.parametrize('bin_seconds', [5, 15, 30, 60, 90])
+def test_bin_width_and_range_options(seed, bin_seconds):
+    rng = random.Random(seed)
+    df = frame(400, seed)
+    options = {
+        'unit': rng.choice(['mile', 'km']),
+        'weight': rng.choice(['distance', 'time']),
+        'min_distance': rng.choice([0, 100.0, 5000.0]),
+        'max_distance': rng.choice([None, 20000.0]),
+        'pace_limits': rng.choice([None, (60, 3600), (240, 600)]),
+    }
+    histogram = pace_histogram(df, bin_seconds, outlier_iqr=None, **options)
+    expected, kept = reference_histogram(df, bin_seconds, **options)
+    assert histogram['paces'] == pytest.approx(list(expected), abs=1e-4)
+    assert histogram['values'] == pytest.approx(list(expected.values()), abs=0.006)
+    assert histogram['bin_seconds'] == bin_seconds
+    # Every run is either in a bin or counted as excluded
+    assert histogram['excluded'] == int((df['type'] == 'Run').sum()) - kept
+
+
+def test_outliers_are_trimmed():
+    df = frame(400, 1)
+    trimmed = pace_histogram(df, pace_limits=None)
+    kept = pace_histogram(df, pace_limits=None, outlier_iqr=None)
+    assert trimmed['excluded'] >= kept['excluded']
+    assert sum(trimmed['values']) <= sum(kept['values'])
+
+
+@pytest.mark.parametrize('options', [{'bin_seconds': 0}, {'unit': 'furlong'}, {'weight': 'calories'}])
+def test_bad_options_are_rejected(options):
+    with pytest.raises(ValueError):
+        pace_histogram(frame(10, 0), **options)
+
+
+def test_histogram_route():
+    activities = synthetic_activities(200, seed=21, routes=False)
+    app.activity_store.merge(9401, activities)
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session['athlete_id'] = 9401
+
+    response = client.get('/plots/paces/histogram?image=0&bin_seconds=30&unit=km&weight=time&outlier_iqr=0')
+    assert response.status_code == 200
+    expected = pace_histogram(columns.frame(activities), 30, 'km', 'time', outlier_iqr=None)
+    assert response.get_json()['data'] == expected
+
+    assert client.get('/plots/paces/histogram?image=0&bin_seconds=1').status_code == 400
+    assert client.get('/plots/paces/histogram?image=0&unit=furlong').status_code == 400
@@ -0,0 +1,85 @@
+"""The plot cache: counters, the disk tier and its pruning."""
+import base64
+import os
+import time
+
+import pandas as pd
+import pytest
+
+from plot_cache import PlotCache
+
+
+@pytest.mark.parametrize('fmt', ['png', 'webp', 'svg'])
+def test_disk_files_are_named_after_the_format(tmp_path, fmt):
+    df = pd.DataFrame({'distance': [1000.0, 2000.0]})
+    key = PlotCache.key('paces', df, ['distance'], '1', fmt)
+    value = base64.b64encode(b'image bytes').decode()
+
+    PlotCache(directory=str(tmp_path)).put(key, value)
+    assert os.listdir(tmp_path) == [key]
+    assert key.endswith('.' + fmt)
+    # A fresh process finds it on disk
+    assert PlotCache(directory=str(tmp_path)).get(key) == value
+
+
+def test_formats_have_their_own_keys():
+    df = pd.DataFrame({'distance': [1000.0]})
+    assert PlotCache.key('paces', df, ['distance'], '1', 'png') != PlotCache.key('paces', df, ['distance'], '1', 'svg')
+
+
+def test_disk_tier_is_pruned_across_formats(tmp_path):
+    cache = PlotCache(directory=str(tmp_path), max_disk_bytes=25)
+    df = pd.DataFrame({'distance': [1000.0]})
+    for i, fmt in enumerate(['png', 'webp', 'svg']):
+        cache.put(PlotCache.key('paces', df, ['distance'], str(i), fmt), base64.b64encode(b'x' * 10).decode())
+    assert sum(os.path.getsize(tmp_path / name) for name in os.listdir(tmp_path)) <= 25
+
+
+def image(size=10):
+    return base64.b64encode(b'x' * size).decode()
+
+
+def test_hits_and_misses_are_counted(tmp_path):
+    cache = PlotCache(directory=str(tmp_path))
+    assert cache.get('a.png') is None
+    cache.put('a.png', image())
+    assert cache.get('a.png') == image()
+    # From disk in another process
+    assert PlotCache(directory=str(tmp_path)).get('a.png') == image()
+    assert cache.get('b.png') is None
+    assert cache.stats() == {"hits": 1, "misses": 2, "entries": 1, "bytes": len(image())}
+
+
+def test_stats_route(monkeypatch):
+    import app
+    cache = PlotCache()
+    monkeypatch.setattr(app.plots, 'plot_cache', cache)
+    cache.put('a.png', image())
+    cache.get('a.png')
+    cache.get('b.png')
+    assert app.app.test_client().get('/plots/cache/stats').get_json() == \
+        {"hits": 1, "misses": 1, "entries": 1, "bytes": len(image())}
+
+
+def test_pruning_keeps_the_most_recently_used(tmp_path):
+    cache = PlotCache(directory=str(tmp_path), max_disk_bytes=25)
+    cache.put('old.png', image())
+    cache.put('used.png', image())
+    for name, age in (('old.png', 100), ('used.png', 50)):
+        os.utime(tmp_path / name, (time.time() - age, time.time() - age))
+    # A hit makes it the newest
+    cache.get('used.png')
+    cache.put('new.png', image())
+    assert sorted(os.listdir(tmp_path)) == ['new.png', 'used.png']
+
+
+def test_disk_is_scanned_only_when_due(tmp_path, monkeypatch):
+    cache = PlotCache(directory=str(tmp_path), prune_every=5)
+    scans = []
+    prune_disk = cache.prune_disk
+    monkeypatch.setattr(cache, 'prune_disk', lambda: scans.append(1) or prune_disk())
+    for i in range(10):
+        cache.put(f"{i}.png", image())
+    # The first write to learn the size, then every fifth
+    assert len(scans) == 3
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
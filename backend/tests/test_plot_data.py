@@ -0,0 +1,59 @@
+"""Plot data against the rollups and odd histories."""
+import numpy as np
+import pytest
+
+from analytics import Rollups, columns, rollup, time_series, weekday_counts
+from stub_strava import synthetic_activities
+
+
+@pytest.mark.parametrize('count', [3000, 20_000])
+def test_long_history_speed_matches_rollups(count):
+    activities = synthetic_activities(count, routes=False)
+    df = columns.frame(activities)
+    series = time_series(df, 'average_speed', max_points=500)
+    table = rollup(df, series['period'])
+
+    assert series['y'] == [speed for speed in table['average_speed'] if speed is not None]
+    assert series['trend']['y'] == [speed for speed in table['trend']['average_speed'] if speed is not None]
+    # Read from the incremental rollups instead, the series is the same
+    assert time_series(df, 'average_speed', max_points=500, tables=Rollups(activities).result) == series
+
+
+def test_long_history_distance_is_mean_per_run():
+    df = columns.frame(synthetic_activities(3000, routes=False))
+    series = time_series(df, 'distance', max_points=500)
+    table = rollup(df, series['period'])
+    expected = [round(distance / count, 3) for distance, count in zip(table['distance'], table['count']) if count]
+    assert series['y'] == pytest.approx(expected, abs=0.002)
+
+
+def test_weekday_counts_skip_runs_without_a_start_date():
+    activities = synthetic_activities(100, routes=False)
+    undated = [dict(activity, start_date_local=None) for activity in activities[:5]]
+    df = columns.frame(undated + activities[5:])
+    runs = df[(df['type'] == 'Run') & df['start_date_local'].notna()]
+
+    counts = weekday_counts(df)['counts']
+    assert counts == [int((runs['start_date_local'].dt.weekday == day).sum()) for day in range(7)]
+    assert weekday_counts(columns.frame(undated))['counts'] == [0] * 7
+
+
+@pytest.mark.parametrize('count', [200, 3000])
+def test_trend_line_is_the_fit_through_every_run(count):
+    # What the scatter plot used to draw: np.polyfit over date2num of each run
+    import matplotlib.dates as mdates
+    df = columns.frame(synthetic_activities(count, routes=False))
+    runs = df[df['type'] == 'Run']
+    slope, intercept = np.polyfit(mdates.date2num(runs['start_date_local'].dt.tz_localize(None)),
+                                  runs['average_speed'], 1)
+    trend = time_series(df, 'average_speed', max_points=500)['trend']
+    assert trend['slope'] == pytest.approx(slope, rel=1e-6)
+    assert trend['intercept'] == pytest.approx(intercept, rel=1e-6)
+
+
+def test_trend_line_of_a_single_day_is_flat():
+    activities = [dict(activity, start_date_local='2020-05-01T07:00:00Z', type='Run')
+                  for activity in synthetic_activities(3, routes=False)]
+    trend = time_series(columns.frame(activities), 'average_speed')['trend']
+    assert trend['slope'] == 0.0
+    assert trend['intercept'] == pytest.approx(sum(activity['average_speed'] for activity in activities) / 3)
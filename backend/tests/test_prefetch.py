@@ -0,0 +1,158 @@
+"""The background refresher, driven round by round with a fake clock against the local Strava stub."""
+import time
+
+import pytest
+
+import app
+from prefetch import Prefetcher
+from ratelimit import RateLimiter
+from stub_strava import serve, synthetic_activities
+
+
+ACTIVITIES = synthetic_activities(25, routes=False)
+INTERVAL = 900
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def strava(monkeypatch):
+    """Points the app at a stub Strava; returns the stub's request counters."""
+    server = serve(ACTIVITIES)
+    base = f"http://127.0.0.1:{server.server_port}"
+    monkeypatch.setattr(app, 'API_URL', base + '/api/v3')
+    monkeypatch.setattr(app, 'AUTH_LINK', base + '/oauth/token')
+    monkeypatch.setattr(app, 'strava_limiter', RateLimiter(reserve=0))
+    yield server.app.usage['count']
+    server.shutdown()
+
+
+@pytest.fixture
+def refreshes(monkeypatch):
+    calls = []
+    request_token = app.StravaStatsAPI.request_token
+
+    def counted(self):
+        calls.append(self.refresh_token)
+        return request_token(self)
+
+    monkeypatch.setattr(app.StravaStatsAPI, 'request_token', counted)
+    return calls
+
+
+def prefetcher(clock, refresh=None, **options):
+    options.setdefault('budget', RateLimiter(limits=(20, 200), reserve=0, clock=clock))
+    return Prefetcher(refresh or app.prefetch_athlete, interval=INTERVAL, clock=clock, **options)
+
+
+def test_refreshes_once_due(strava, refreshes):
+    clock = Clock()
+    worker = prefetcher(clock)
+    worker.register(501, 'stub', 'athlete-refresh-token')
+    assert worker.run_pending() == 0
+
+    clock.now += INTERVAL
+    assert worker.run_pending() == 1
+    assert strava[0]
+    assert app.activity_store.revision(501)
+    athlete = worker.athletes[501]
+    assert athlete.refreshed == clock.now
+    assert athlete.due == clock.now + INTERVAL
+    assert refreshes == []
+
+
+def test_defers_while_the_budget_is_low(strava):
+    clock = Clock()
+    worker = prefetcher(clock, budget=RateLimiter(limits=(1, 200), reserve=0, clock=clock))
+    worker.register(502, 'stub', 'athlete-refresh-token')
+    worker.register(503, 'stub', 'athlete-refresh-token')
+
+    clock.now += INTERVAL
+    # One slot in the short window: the second athlete waits for it to reset
+    assert worker.run_pending() == 1
+    late = next(athlete for athlete in worker.athletes.values() if athlete.refreshed is None)
+    assert late.due > clock.now
+    assert late.late_since == 1000.0 + INTERVAL
+
+
+def test_stands_back_for_logins(strava):
+    clock = Clock()
+    limiter = RateLimiter(limits=(100, 1000), reserve=0, clock=clock)
+    worker = prefetcher(clock, strava_limiter=limiter, headroom=20)
+    worker.register(504, 'stub', 'athlete-refresh-token')
+
+    clock.now += INTERVAL
+    # Logins have used most of the window
+    limiter.update({'X-RateLimit-Limit': '100,1000', 'X-RateLimit-Usage': '90,90'})
+    assert worker.run_pending() == 0
+    assert strava[0] == 0
+    assert worker.athletes[504].due == clock.now + 60
+
+
+def test_idle_athletes_expire():
+    clock = Clock()
+    calls = []
+    worker = prefetcher(clock, refresh=calls.append, active_for=2 * INTERVAL)
+    worker.register(505, 'stub', 'athlete-refresh-token')
+
+    clock.now += INTERVAL
+    assert worker.run_pending() == 1
+    clock.now += INTERVAL
+    assert worker.run_pending() == 1
+    clock.now += INTERVAL
+    # Not seen for three intervals: dropped instead of refreshed
+    assert worker.run_pending() == 0
+    assert len(calls) == 2
+    assert 505 not in worker.athletes
+
+
+def test_failures_back_off_then_drop_the_athlete():
+    clock = Clock()
+    calls = []
+
+    def failing(athlete):
+        calls.append(clock.now)
+        raise app.StravaError("Strava is down")
+
+    worker = prefetcher(clock, refresh=failing, max_failures=3)
+    worker.register(506, 'stub', 'athlete-refresh-token')
+    start = clock.now
+
+    clock.now += INTERVAL
+    assert worker.run_pending() == 1
+    assert worker.athletes[506].due == clock.now + 2 * INTERVAL
+    clock.now += INTERVAL
+    # Backing off: not due yet
+    assert worker.run_pending() == 0
+    clock.now += INTERVAL
+    assert worker.run_pending() == 1
+    assert worker.athletes[506].due == clock.now + 3 * INTERVAL
+    clock.now += 3 * INTERVAL
+    assert worker.run_pending() == 1
+    assert calls == [start + INTERVAL, start + 3 * INTERVAL, start + 6 * INTERVAL]
+    assert 506 not in worker.athletes
+
+
+def test_expiring_token_is_refreshed_first(strava, refreshes):
+    clock = Clock()
+    worker = prefetcher(clock)
+    # Strava's expires_at is wall clock time, not the prefetcher's
+    worker.register(507, 'old-access-token', 'athlete-refresh-token', expires_at=int(time.time()) + 60)
+
+    clock.now += INTERVAL
+    assert worker.run_pending() == 1
+    assert refreshes == ['athlete-refresh-token']
+    athlete = worker.athletes[507]
+    assert (athlete.access_token, athlete.refresh_token) == ('stub', 'stub')
+    # What Strava said about the new token, so the next round does not refresh again
+    assert athlete.expires_at > time.time() + 3600
+
+    clock.now += INTERVAL
+    assert worker.run_pending() == 1
+    assert refreshes == ['athlete-refresh-token']
@@ -0,0 +1,157 @@
+"""The session and result backends, their tiering, and session ids changing on login."""
+import pickle
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import app
+from sessions import MemoryBackend, SQLiteBackend, TieredStore
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+VALUES = [
+    {"access_token": "a", "refresh_token": "r", "athlete_id": 7},
+    ("access", "refresh", 7, 12),
+    (b"\x1f\x8b compressed", True),
+    ["png-base64", "svg"],
+    {"stats": {"distance": 12.5}, "latlong": [[51.5, -0.1]], "nested": [("a", b"b")]},
+    "pending",
+]
+
+
+def test_memory_backend_expires_and_evicts_least_recently_used():
+    clock = Clock()
+    backend = MemoryBackend(max_entries=2, clock=clock)
+    backend.set('a', 1, 10)
+    backend.set('b', 2, 10)
+    assert backend.get('a') == 1
+    backend.set('c', 3, 10)
+    # b was used least recently
+    assert (backend.get('a'), backend.get('b'), backend.get('c')) == (1, None, 3)
+    clock.now += 10
+    assert backend.get('a') is None
+    assert backend.entries == {'c': (3, 1010.0)}
+    backend.delete('c')
+    assert backend.get('c') is None
+
+
+@pytest.mark.parametrize('value', VALUES)
+def test_sqlite_backend_round_trips_json_tuples_and_bytes(tmp_path, value):
+    backend = SQLiteBackend(str(tmp_path / 'state.db'))
+    backend.set('key', value, 60)
+    assert backend.get('key') == value
+    # And another worker opening the same file sees it too
+    assert SQLiteBackend(str(tmp_path / 'state.db')).get('key') == value
+
+
+def test_sqlite_backend_stores_json_and_refuses_what_it_cannot(tmp_path):
+    path = str(tmp_path / 'state.db')
+    backend = SQLiteBackend(path)
+    backend.set('ticket', ("access", b"\x00"), 60)
+    with sqlite3.connect(path) as db:
+        stored = db.execute("SELECT value FROM entries WHERE key = 'ticket'").fetchone()[0]
+    assert stored == '{"__tuple__":["access",{"__bytes__":"AA=="}]}'
+
+    with pytest.raises(TypeError):
+        backend.set('frame', pd.DataFrame({'distance': [1.0]}), 60)
+    assert backend.get('frame') is None
+
+
+class Planted:
+    ran = False
+
+    def __reduce__(self):
+        return (setattr, (Planted, 'ran', True))
+
+
+def test_sqlite_backend_never_unpickles(tmp_path):
+    path = str(tmp_path / 'state.db')
+    backend = SQLiteBackend(path)
+    with sqlite3.connect(path) as db:
+        db.execute("INSERT INTO entries VALUES (?, ?, ?)", ('session:planted', pickle.dumps(Planted()), 10 ** 12))
+    assert backend.get('session:planted') is None
+    assert not Planted.ran
+
+
+def test_sqlite_backend_expires_and_purges(tmp_path):
+    clock = Clock()
+    path = str(tmp_path / 'state.db')
+    backend = SQLiteBackend(path, clock=clock, purge_every=3)
+    backend.set('short', 1, 5)
+    backend.set('long', 2, 50)
+    clock.now += 5
+    assert (backend.get('short'), backend.get('long')) == (None, 2)
+    # The third write purges what has expired
+    backend.set('other', 3, 50)
+    with sqlite3.connect(path) as db:
+        assert sorted(key for key, in db.execute("SELECT key FROM entries")) == ['long', 'other']
+    backend.delete('long')
+    assert backend.get('long') is None
+
+
+def test_tiered_store_copies_shared_hits_locally_for_their_remaining_ttl(tmp_path):
+    clock = Clock()
+    shared = SQLiteBackend(str(tmp_path / 'state.db'), clock=clock)
+    writer = TieredStore(MemoryBackend(clock=clock), shared)
+    reader = TieredStore(MemoryBackend(clock=clock), shared)
+
+    writer.set('dashboard:1:5', {"stats": {}}, 60)
+    clock.now += 20
+    assert reader.get('dashboard:1:5') == {"stats": {}}
+    assert reader.local.entries['dashboard:1:5'] == ({"stats": {}}, 1060.0)
+    assert reader.get('missing') is None
+    assert reader.stats() == {"hits": 1, "misses": 1, "local_entries": 1}
+
+    writer.delete('dashboard:1:5')
+    assert shared.get('dashboard:1:5') is None
+
+
+def test_tiered_store_keeps_unshared_values_local(tmp_path):
+    shared = SQLiteBackend(str(tmp_path / 'state.db'))
+    store = TieredStore(MemoryBackend(), shared)
+    df = pd.DataFrame({'distance': [1.0, 2.0]})
+    calls = []
+
+    def build():
+        calls.append(1)
+        return df
+
+    assert store.cached('frame:1:5', 60, build, shared=False) is df
+    assert store.cached('frame:1:5', 60, build, shared=False) is df
+    assert calls == [1]
+    assert shared.get('frame:1:5') is None
+
+
+def session_id(client):
+    cookie = client.get_cookie(app.app.config['SESSION_COOKIE_NAME'])
+    return cookie.value if cookie else None
+
+
+def test_login_issues_a_new_session_id(monkeypatch):
+    class Response:
+        def json(self):
+            return {"access_token": "access", "refresh_token": "refresh"}
+
+    monkeypatch.setattr(app.http, 'post', lambda url, data: Response())
+    client = app.app.test_client()
+    # A session that already exists, whose id someone else may know
+    with client.session_transaction() as session:
+        session['athlete_id'] = 9501
+    planted = session_id(client)
+    assert app.shared_state.get('session:' + planted) == {'athlete_id': 9501}
+
+    assert client.get('/auth/strava').status_code == 200
+    rotated = session_id(client)
+    assert rotated and rotated != planted
+    # The old id leads nowhere, the new one carries the login
+    assert app.shared_state.get('session:' + planted) is None
+    assert app.shared_state.get('session:' + rotated) == \
+        {'athlete_id': 9501, 'access_token': 'access', 'refresh_token': 'refresh'}
@@ -0,0 +1,140 @@
+"""Concurrent callers of SingleFlight and AsyncSingleFlight share one call, its result and its exception."""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from singleflight import AsyncSingleFlight, SingleFlight
+
+
+CALLERS = 8
+
+
+def concurrently(flight, fn, key='athlete'):
+    """Calls flight.do from CALLERS threads at once; fn is held until all of them are in."""
+    started = threading.Barrier(CALLERS + 1)
+
+    def call():
+        started.wait()
+        return flight.do(key, fn)
+
+    pool = ThreadPoolExecutor(CALLERS)
+    futures = [pool.submit(call) for _ in range(CALLERS)]
+    started.wait()
+    # Not waited for here: the caller releases fn first
+    pool.shutdown(wait=False)
+    return futures
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return {'stats': 42}
+
+    futures = concurrently(flight, fetch)
+    # Everyone has reached do() by now; the first is holding the rest
+    time.sleep(0.2)
+    assert flight.in_flight() == 1
+    release.set()
+    results = [future.result(5) for future in futures]
+    assert calls == [1]
+    assert all(result is results[0] for result in results)
+    assert flight.in_flight() == 0
+
+
+def test_exception_reaches_every_waiter():
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        raise RuntimeError("Strava is down")
+
+    futures = concurrently(flight, fetch)
+    time.sleep(0.2)
+    release.set()
+    for future in futures:
+        with pytest.raises(RuntimeError, match="Strava is down"):
+            future.result(5)
+    assert calls == [1]
+    # Nothing is remembered once the call is over
+    assert flight.do('athlete', lambda: 'again') == 'again'
+
+
+def test_keys_fly_separately():
+    flight = SingleFlight()
+    assert [flight.do(key, lambda key=key: key * 2) for key in (1, 2, 1)] == [2, 4, 2]
+
+
+def test_async_callers_share_one_call():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def main():
+        release = asyncio.Event()
+
+        async def fetch():
+            calls.append(1)
+            await release.wait()
+            return {'stats': 42}
+
+        waiters = [asyncio.ensure_future(flight.do('athlete', fetch)) for _ in range(CALLERS)]
+        await asyncio.sleep(0)
+        release.set()
+        return await asyncio.gather(*waiters)
+
+    results = asyncio.run(main())
+    assert calls == [1]
+    assert all(result is results[0] for result in results)
+    assert flight.calls == {}
+
+
+def test_async_exception_reaches_every_waiter():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def main():
+        release = asyncio.Event()
+
+        async def fetch():
+            calls.append(1)
+            await release.wait()
+            raise RuntimeError("Strava is down")
+
+        waiters = [asyncio.ensure_future(flight.do('athlete', fetch)) for _ in range(CALLERS)]
+        await asyncio.sleep(0)
+        release.set()
+        return await asyncio.gather(*waiters, return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert calls == [1]
+    assert all(isinstance(result, RuntimeError) and str(result) == "Strava is down" for result in results)
+
+
+def test_async_caller_leaving_does_not_cancel_the_others():
+    flight = AsyncSingleFlight()
+
+    async def main():
+        release = asyncio.Event()
+
+        async def fetch():
+            await release.wait()
+            return 'done'
+
+        leaving = asyncio.ensure_future(flight.do('athlete', fetch))
+        staying = asyncio.ensure_future(flight.do('athlete', fetch))
+        await asyncio.sleep(0)
+        leaving.cancel()
+        release.set()
+        return await staying, leaving.cancelled()
+
+    assert asyncio.run(main()) == ('done', True)
@@ -0,0 +1,90 @@
+"""The per-athlete route index against a brute-force box check, and the viewport route built on it."""
+import random
+
+import pytest
+
+import app
+from geometry import encode_polyline
+from spatial import RouteIndex, RouteIndexes
+
+
+def route_activities(count, seed):
+    """Short straight routes scattered over the globe, antimeridian included, newest first."""
+    rng = random.Random(seed)
+    activities = []
+    for i in range(count):
+        lat, lng = rng.uniform(-70, 70), rng.choice([rng.uniform(-180, 180), rng.uniform(178, 180)])
+        end = (lat + rng.uniform(-0.5, 0.5), min(lng + rng.uniform(0, 0.5), 180.0))
+        activities.append({'id': 5000 + i, 'name': f"Run {i}", 'type': 'Run', 'distance': 1000.0,
+                           'start_date': f"2020-01-01T00:{i // 60:02d}:{i % 60:02d}Z", 'moving_time': 300,
+                           'map': {'summary_polyline': encode_polyline([(lat, lng), end])}})
+    activities.reverse()
+    return activities
+
+
+def overlaps(box, south, west, north, east):
+    return box[0] <= north and box[2] >= south and box[1] <= east and box[3] >= west
+
+
+def brute_force(index, south, west, north, east):
+    if west > east:
+        return [activity for activity, box in zip(index.activities, index.boxes)
+                if overlaps(box, south, west, north, 180.0) or overlaps(box, south, -180.0, north, east)]
+    return [activity for activity, box in zip(index.activities, index.boxes)
+            if overlaps(box, south, west, north, east)]
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_query_matches_brute_force(seed):
+    rng = random.Random(seed)
+    index = RouteIndex(route_activities(300, seed))
+    for _ in range(50):
+        south = rng.uniform(-80, 70)
+        north = south + rng.uniform(0.1, 20)
+        west = rng.uniform(-180, 180)
+        east = west + rng.uniform(0.1, 60)
+        if east > 180:
+            east -= 360
+        assert index.query(south, west, north, east) == brute_force(index, south, west, north, east)
+
+
+def test_viewport_across_the_antimeridian():
+    activities = route_activities(300, 7)
+    index = RouteIndex(activities)
+    found = index.query(-90, 179.0, 90, -179.0)
+    assert found
+    assert found == brute_force(index, -90, 179.0, 90, -179.0)
+    # Newest first, like the history they came from
+    ids = [activity['id'] for activity in activities]
+    assert sorted(found, key=lambda activity: ids.index(activity['id'])) == found
+
+
+def test_index_keeps_only_what_it_serves():
+    activity = dict(route_activities(1, 0)[0], splits_metric=[{'distance': 1000}] * 50, description='x' * 1000)
+    entry, = RouteIndex([activity]).activities
+    assert set(entry) == {'id', 'name', 'type', 'distance', 'start_date', 'map'}
+
+
+def test_indexes_keep_the_most_recently_used():
+    indexes = RouteIndexes(size=2)
+    loads = []
+    for athlete_id in (1, 2, 1, 3, 1, 2):
+        indexes.get(athlete_id, 1, lambda: loads.append(athlete_id) or route_activities(5, athlete_id))
+    assert loads == [1, 2, 3, 2]
+
+
+def test_in_bbox_route():
+    activities = route_activities(200, 3)
+    app.activity_store.merge(9001, activities)
+    client = app.app.test_client()
+    assert client.get('/activities/in_bbox?bbox=-10,-10,10,10').status_code == 401
+
+    with client.session_transaction() as session:
+        session['athlete_id'] = 9001
+    assert client.get('/activities/in_bbox?bbox=west').status_code == 400
+
+    response = client.get('/activities/in_bbox?bbox=179,-90,-179,90&zoom=10')
+    assert response.status_code == 200
+    expected = brute_force(RouteIndex(activities), -90, 179.0, 90, -179.0)
+    assert [activity['activityName'] for activity in response.get_json()['activities']] == \
+        [activity['name'] for activity in expected]
@@ -0,0 +1,113 @@
+"""running_stats against the iterrows() loop it replaced."""
+import pandas as pd
+import pytest
+
+from analytics import columns, running_stats
+from analytics.aggregates import RunningStats
+from stub_strava import synthetic_activities
+
+
+def reference_running_stats(df) -> dict:
+    # StravaStatsAPI.running_stats and longest_activity_streak as they were before the columnar rewrite
+    total_distance = 0
+    total_time_moving = 0
+    total_elevation_gain = 0
+    fastest_speed = 0
+    farthest_run = 0
+    total_runs = 0
+    shortest_run = float("inf")
+    max_altitude = 0
+
+    for i, activity in df.iterrows():
+        if activity['type'] == 'Run':
+            total_distance += activity['distance']
+            total_time_moving += activity['moving_time']
+            total_elevation_gain += activity['total_elevation_gain']
+            fastest_speed = max(fastest_speed, activity['max_speed'])
+            farthest_run = max(farthest_run, activity['distance'])
+            shortest_run = min(shortest_run, activity['distance'])
+            max_altitude = max(max_altitude, activity['elev_high'])
+            total_runs += 1
+
+    total_distance = round(total_distance/1609, 2)
+    total_time_moving = round(total_time_moving/3600, 2)
+    total_elevation_gain = round(total_elevation_gain, 2)
+    avg_speed_all_time = round(total_distance/total_time_moving, 2) if total_time_moving else 0
+    avg_pace = round(60/avg_speed_all_time, 2) if avg_speed_all_time else 0
+    avg_dist_per_run = round((total_distance/total_runs), 2) if total_runs else 0
+    avg_elev_gain = round((total_elevation_gain/total_runs), 2) if total_runs else 0
+    fastest_speed = round(fastest_speed, 2)
+    longest_streak = reference_longest_streak(df)
+    farthest_run = round(farthest_run/1609, 2)
+    shortest_run = round(shortest_run/1609, 2)
+    max_altitude = round(max_altitude, 2)
+
+    return {
+        "total_runs": total_runs,
+        "total_distance": total_distance,
+        "total_time_moving": total_time_moving,
+        "total_elevation_gain": total_elevation_gain,
+        "avg_speed_all_time": avg_speed_all_time,
+        "avg_pace": avg_pace,
+        "avg_dist_per_run": avg_dist_per_run,
+        "avg_elev_gain": avg_elev_gain,
+        "fastest_speed": fastest_speed,
+        "longest_streak": longest_streak,
+        "farthest_run": farthest_run,
+        'shortest_run': shortest_run,
+        'max_altitude': max_altitude
+    }
+
+
+def reference_longest_streak(df) -> int:
+    if df.empty:
+        return 0
+    df = df.copy()
+    df['start_date'] = pd.to_datetime(df['start_date']).dt.date
+    df = df.drop_duplicates(subset='start_date')
+    df = df.sort_values(by='start_date')
+    df['diff'] = df['start_date'].diff().dt.days
+
+    streak = 1
+    max_streak = 1
+    for diff in df['diff']:
+        if diff == 1.0:
+            streak += 1
+            max_streak = max(max_streak, streak)
+        elif diff > 1.0:
+            streak = 1
+    return max_streak
+
+
+def with_odd_decimals(activities, seed):
+    # Three-decimal values whose two-decimal rounding flips if they are stored as float32 first
+    for i, activity in enumerate(activities):
+        activity['max_speed'] = round(activity['max_speed'], 2) + 0.005
+        activity['elev_high'] = round(activity['elev_high'], 1) + 0.065 + (i + seed) % 7 * 0.1
+    return activities
+
+
+@pytest.mark.parametrize('count', [10, 100, 1000, 10_000, 100_000])
+def test_running_stats_matches_iterrows_loop(count):
+    activities = synthetic_activities(count, seed=count, routes=False)
+    expected = reference_running_stats(pd.DataFrame(activities))
+
+    assert running_stats(pd.DataFrame(activities)) == expected
+    # What /callback, /stream and the batch CLI compute from
+    assert running_stats(columns.frame(activities)) == expected
+    assert RunningStats(activities).result() == expected
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_running_stats_rounds_like_iterrows_loop(seed):
+    activities = with_odd_decimals(synthetic_activities(500, seed=seed, routes=False), seed)
+    expected = reference_running_stats(pd.DataFrame(activities))
+
+    assert running_stats(columns.frame(activities)) == expected
+    assert RunningStats(activities).result() == expected
+
+
+def test_running_stats_without_runs():
+    activities = [activity for activity in synthetic_activities(50, routes=False) if activity['type'] != 'Run']
+    assert running_stats(columns.frame(activities)) == reference_running_stats(pd.DataFrame(activities))
+    assert running_stats(columns.frame([]))['total_runs'] == 0
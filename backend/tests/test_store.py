@@ -0,0 +1,42 @@
+"""The activity store: merging, and the simplified routes kept next to each activity."""
+import numpy as np
+
+import app
+from geometry import decode_polyline, encode_polyline, random_route, simplified_route
+from store import ActivityStore
+from stub_strava import synthetic_activities
+
+
+def test_routes_are_simplified_when_merged(tmp_path, monkeypatch):
+    activities = synthetic_activities(20, seed=4)
+    store = ActivityStore(str(tmp_path / 'activities.db'), route_zoom=12)
+    store.merge(1, activities)
+    loaded = store.load(1)
+    for activity in loaded:
+        simplified = activity['map']['simplified']
+        assert simplified == {'zoom': 12, 'polyline': simplified_route(activity['map']['summary_polyline'], 12)}
+        assert len(simplified['polyline']) < len(activity['map']['summary_polyline'])
+
+    # Serving the map at that zoom does no simplification at all
+    monkeypatch.setattr(app.route_cache, 'get', None)
+    formatted = app.StravaStatsAPI.format_activities(loaded, zoom=12)
+    assert [activity['activityPositions'] for activity in formatted] == \
+        [activity['map']['simplified']['polyline'] for activity in loaded]
+
+
+def test_replaced_routes_are_simplified_again(tmp_path):
+    store = ActivityStore(str(tmp_path / 'activities.db'), route_zoom=12)
+    activity, = synthetic_activities(1, seed=5)
+    store.merge(1, [activity])
+    moved = encode_polyline(random_route(np.random.default_rng(1), 300, origin=(51.5, -0.1)))
+    store.merge(1, [dict(activity, map=dict(activity['map'], summary_polyline=moved))])
+    stored, = store.load(1)
+    assert stored['map']['simplified']['polyline'] == simplified_route(moved, 12)
+    assert abs(decode_polyline(stored['map']['simplified']['polyline'])[0, 0] - 51.5) < 1.5
+
+
+def test_without_a_route_zoom_nothing_is_added(tmp_path):
+    store = ActivityStore(str(tmp_path / 'activities.db'))
+    activities = synthetic_activities(3, seed=6)
+    store.merge(1, activities)
+    assert store.load(1) == activities
@@ -0,0 +1,67 @@
+"""Longest, current and top streaks against a day-by-day walk over the calendar."""
+import random
+from datetime import date, datetime, timedelta, timezone
+
+import pandas as pd
+import pytest
+
+from analytics.streaks import activity_streaks, longest_streak
+
+
+def reference_streaks(days):
+    """Every streak as (length, first day), walking the sorted unique days one at a time."""
+    streaks = []
+    for day in sorted(set(days)):
+        if streaks and streaks[-1][1] + timedelta(days=streaks[-1][0]) == day:
+            streaks[-1] = (streaks[-1][0] + 1, streaks[-1][1])
+        else:
+            streaks.append((1, day))
+    return streaks
+
+
+def start_dates(days, rng):
+    # One to three activities at random times on each day
+    return [datetime.combine(day, datetime.min.time(), timezone.utc) + timedelta(seconds=rng.randrange(86400))
+            for day in days for _ in range(rng.randint(1, 3))]
+
+
+@pytest.mark.parametrize('seed', range(6))
+def test_top_streaks_match_reference(seed):
+    rng = random.Random(seed)
+    first = date(2018, 1, 1)
+    days = [first + timedelta(days=i) for i in range(600) if rng.random() < 0.7]
+    streaks = reference_streaks(days)
+
+    result = activity_streaks(pd.Series(start_dates(days, rng)), top=8, today=date(2030, 1, 1))
+    # Longest first, the most recent first among equal lengths
+    expected = sorted(streaks, key=lambda streak: (-streak[0], -streak[1].toordinal()))[:8]
+    assert result['top_streaks'] == [{"length": length, "start": start.isoformat(),
+                                      "end": (start + timedelta(days=length - 1)).isoformat()}
+                                     for length, start in expected]
+    assert result['longest_streak'] == max(length for length, _ in streaks) == longest_streak(start_dates(days, rng))
+    assert result['current_streak'] == 0
+
+
+@pytest.mark.parametrize('last_day_ago, current', [(0, 4), (1, 4), (2, 0)])
+def test_current_streak_runs_to_today_or_yesterday(last_day_ago, current):
+    today = date(2024, 3, 10)
+    last = today - timedelta(days=last_day_ago)
+    days = [last - timedelta(days=i) for i in range(4)] + [last - timedelta(days=10)]
+    result = activity_streaks(pd.Series(start_dates(days, random.Random(0))), today=today)
+    assert result['current_streak'] == current
+    assert result['longest_streak'] == 4
+
+
+def test_top_is_bounded_and_empty_histories_have_no_streaks():
+    days = [date(2020, 1, 1) + timedelta(days=2 * i) for i in range(10)]
+    assert len(activity_streaks(pd.Series(start_dates(days, random.Random(1))), top=3)['top_streaks']) == 3
+    assert activity_streaks(pd.Series(start_dates(days, random.Random(1))), top=0)['top_streaks'] == []
+    assert activity_streaks(pd.Series([], dtype='object')) == \
+        {"longest_streak": 0, "current_streak": 0, "top_streaks": []}
+
+
+def test_days_are_utc_calendar_days():
+    # 23:30 and 00:30 UTC are different days, whatever the local time was
+    result = activity_streaks(pd.Series(['2021-06-01T23:30:00Z', '2021-06-02T00:30:00Z', None, 'not a date']),
+                              today=date(2021, 6, 2))
+    assert result['current_streak'] == result['longest_streak'] == 2
@@ -0,0 +1,102 @@
+"""The streamed login: tickets, event order and errors part way through, against the local Strava stub."""
+import json
+
+import pytest
+
+import app
+from analytics import columns, running_stats
+from ratelimit import RateLimiter
+from stub_strava import serve, synthetic_activities
+
+
+ACTIVITIES = synthetic_activities(25, seed=11, routes=False)
+
+
+@pytest.fixture
+def strava(monkeypatch):
+    """Starts a stub with the given options and points the app at it, one page in flight at a time."""
+    servers = []
+    monkeypatch.setattr(app, 'PAGE_SIZE', 10)
+    monkeypatch.setattr(app, 'FETCH_WINDOW', 1)
+    monkeypatch.setattr(app, 'strava_limiter', RateLimiter(reserve=0))
+    monkeypatch.setattr(app, 'backoff', lambda attempt: 0)
+
+    def start(**options):
+        server = serve(ACTIVITIES, **options)
+        servers.append(server)
+        base = f"http://127.0.0.1:{server.server_port}"
+        monkeypatch.setattr(app, 'API_URL', base + '/api/v3')
+        monkeypatch.setattr(app, 'AUTH_LINK', base + '/oauth/token')
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def login(client, code):
+    response = client.post('/callback', json={'code': code, 'stream': True})
+    assert response.status_code == 200
+    return response.get_json()['stream']
+
+
+def sse_events(body):
+    events = []
+    for block in body.decode().strip().split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in block.splitlines())
+        events.append((lines['event'], json.loads(lines['data'])))
+    return events
+
+
+def ndjson_events(body):
+    return [(event['event'], event['data']) for event in map(json.loads, body.decode().splitlines())]
+
+
+def test_ticket_opens_the_stream_once(strava):
+    strava()
+    client = app.app.test_client()
+    url = login(client, '9201')
+    assert client.get(url).status_code == 200
+    assert client.get(url).status_code == 404
+    assert client.get('/stream/unknown').status_code == 404
+
+
+def test_events_arrive_in_order(strava):
+    strava()
+    client = app.app.test_client()
+    events = sse_events(client.get(login(client, '9202')).data)
+    names = [name for name, _ in events]
+
+    # One activities event per page as it arrives, then the stats, each plot and the end
+    assert names[:3] == ['activities'] * 3
+    assert names[3] == 'stats'
+    assert names[4:-1] == ['plot'] * len(app.plots.PLOT_NAMES)
+    assert names[-1] == 'done'
+    streamed = [activity['activityName'] for name, data in events[:3] for activity in data['activities']]
+    assert streamed == [activity['name'] for activity in ACTIVITIES]
+    assert events[3][1] == running_stats(columns.frame(ACTIVITIES))
+    assert sorted(data['index'] for name, data in events if name == 'plot') == list(range(len(app.plots.PLOT_NAMES)))
+
+
+def test_returning_athlete_gets_the_stored_history_first(strava):
+    server = strava()
+    client = app.app.test_client()
+    client.get(login(client, '9203')).get_data()
+    before = server.app.usage['count'][0]
+
+    events = ndjson_events(client.get(login(client, '9203') + '?format=ndjson').data)
+    assert [name for name, _ in events[:2]] == ['activities', 'stats']
+    assert len(events[0][1]['activities']) == len(ACTIVITIES)
+    assert events[-1][0] == 'done'
+    # Only the delta after the cursor was asked for
+    assert server.app.usage['count'][0] == before + 1
+
+
+def test_strava_failing_mid_stream_ends_with_an_error(strava):
+    # The first page comes through, the second fails every retry
+    strava(faults=[0] + [503] * app.MAX_RETRIES)
+    client = app.app.test_client()
+    events = sse_events(client.get(login(client, '9204')).data)
+    assert [name for name, _ in events] == ['activities', 'error']
+    assert len(events[0][1]['activities']) == 10
+    assert '503' in events[1][1]['error']
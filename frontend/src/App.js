@@ -21,16 +21,16 @@ function App() {
     }
   }, [isAuthenticated]);
 
-  const handleStatsReceived = (stats, plots, activities, latlong) => {
+  const handleStatsReceived = (stats, activities, latlong) => {
     setStats(stats);
-    setPlots(plots);
     setActivities(activities);
     setLatLong(latlong);
   };
 
+  // Plots arrive as data URLs, so the image format is up to the backend
   const images = plots?.map(plot => ({
-    original: `data:image/png;base64,${plot}`,
-    thumbnail: `data:image/png;base64,${plot}`,
+    original: plot,
+    thumbnail: plot,
   })) || [];
 
 
@@ -46,6 +46,7 @@ function App() {
             <CallbackManager
               onAuthenticated={() => setIsAuthenticated(true)}
               onStatsReceived={handleStatsReceived}
+              onPlotsReceived={setPlots}
             />
           }
         />
@@ -2,7 +2,25 @@ import React, { useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
 import axios from 'axios';
 
-function CallbackManager({ onAuthenticated, onStatsReceived }) {
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL || 'http://stravastatsbackend.eba-akb9vbnz.us-west-1.elasticbeanstalk.com';
+
+// The backend keeps the login in a session cookie on its own origin; send it with every call
+const backend = axios.create({ baseURL: BACKEND_URL, withCredentials: true });
+
+// Plots render in the background after /callback returns; poll until they are done
+async function pollPlots(job, onPlotsReceived) {
+    while (true) {
+        const response = await backend.get(`/plots/${job}`);
+        if (response.status === 200) {
+            const mimeType = response.data.mime_type || 'image/png';
+            onPlotsReceived(response.data.plots.map(plot => `data:${mimeType};base64,${plot}`));
+            return;
+        }
+        await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+}
+
+function CallbackManager({ onAuthenticated, onStatsReceived, onPlotsReceived }) {
     const navigate = useNavigate();
 
     useEffect(() => {
@@ -11,13 +29,17 @@ function CallbackManager({ onAuthenticated, onStatsReceived }) {
             const code = queryParams.get('code');
             console.log(code);
             try {
-                const response = await axios.post(`http://stravastatsbackend.eba-akb9vbnz.us-west-1.elasticbeanstalk.com/callback`, { code: code });
+                const response = await backend.post('/callback', { code: code });
                 console.log(response);
                 if (response.data && response.data.access_token) {
                     onAuthenticated();
 
                     
-                    onStatsReceived(response.data.stats, response.data.plots, response.data.activities, response.data.latlong);
+                    onStatsReceived(response.data.stats, response.data.activities, response.data.latlong);
+                    if (response.data.plots_job) {
+                        pollPlots(response.data.plots_job, onPlotsReceived)
+                            .catch(error => console.error('Error while loading plots:', error));
+                    }
 
                     setTimeout(() => navigate('/'));
                 } else {
@@ -30,7 +52,7 @@ function CallbackManager({ onAuthenticated, onStatsReceived }) {
         }
 
         handleCallback();
-    }, [onAuthenticated, navigate, onStatsReceived]);
+    }, [onAuthenticated, navigate, onStatsReceived, onPlotsReceived]);
 
     return (<div className="loading-screen">
                 <i className="fas fa-spinner fa-spin"></i>